@@ -0,0 +1,117 @@
+# Paths of the day files of a MiniSEED archive.
+#
+# Two layouts are supported:
+#   flat    PATH/NET.STA.LOC.CHAN.YEAR.DOY.mseed, as written by the archive
+#           and the scripts here
+#   sds     the SeisComP Data Structure,
+#           PATH/YEAR/NET/STA/CHAN.D/NET.STA.LOC.CHAN.D.YEAR.DOY
+# The layout of a directory is detected from its contents (year directories
+# mean SDS) unless it's given.
+#
+# DayFiles() resolves a channel and time range to the files that exist, from
+# the computed paths and a cached listing of each directory, so a query over
+# years only opens files that are there. A listing is reread when the
+# directory's modification time changes, i.e. when a file is added.
+
+import os
+import re
+
+# Defaults
+path = '/data/seismometer_data/mseed'
+
+_layouts = {}           # archive path -> layout
+_listings = {}          # directory -> (mtime, set of file names)
+
+_flat_name = re.compile(r'^([^.]*)\.([^.]*)\.([^.]*)\.([^.]*)\.(\d{4})\.(\d{3})'
+    r'\.mseed$')
+_sds_name = re.compile(r'^([^.]*)\.([^.]*)\.([^.]*)\.([^.]*)\.D\.(\d{4})'
+    r'\.(\d{3})$')
+
+# Layout of the archive in path, 'flat' or 'sds'.
+def ArchiveLayout(path=path):
+    if path not in _layouts:
+        layout = 'flat'
+        try:
+            for entry in os.scandir(path):
+                if entry.is_dir() and re.match(r'^\d{4}$', entry.name):
+                    layout = 'sds'
+                    break
+        except OSError:
+            pass
+        _layouts[path] = layout
+    return _layouts[path]
+
+# Path of the day file of a channel, whether or not it exists.
+def DayFilename(path, net, station, loc, chan, year, doy, layout=None):
+    layout = layout or ArchiveLayout(path)
+    if layout == 'sds':
+        return os.path.join(path, '%d' % year, net, station, chan + '.D',
+            '%s.%s.%s.%s.D.%d.%03d' % (net, station, loc, chan, year, doy))
+    return os.path.join(path, '%s.%s.%s.%s.%d.%03d.mseed' %
+        (net, station, loc, chan, year, doy))
+
+# (net, station, loc, chan, year, doy) of a day file name in either layout,
+# or None.
+def ParseDayFilename(filename):
+    name = os.path.basename(filename)
+    m = _flat_name.match(name) or _sds_name.match(name)
+    if not m:
+        return None
+    net, station, loc, chan, year, doy = m.groups()
+    return net, station, loc, chan, int(year), int(doy)
+
+# Names of the files in a directory, cached until the directory changes.
+def _Listing(directory):
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return frozenset()
+    cached = _listings.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        names = frozenset(os.listdir(directory))
+    except OSError:
+        names = frozenset()
+    _listings[directory] = (mtime, names)
+    return names
+
+def _Exists(filename):
+    directory, name = os.path.split(filename)
+    return name in _Listing(directory)
+
+# The days from starttime to endtime, as (year, day of the year).
+def Days(starttime, endtime):
+    from obspy import UTCDateTime
+    day = UTCDateTime(starttime.date)
+    days = []
+    while day <= endtime:
+        days.append((day.year, day.julday))
+        day += 86400
+    return days
+
+# The day files of a channel that exist, for starttime to endtime.
+def DayFiles(net, station, loc, chan, starttime, endtime, path=path,
+        layout=None):
+    files = [DayFilename(path, net, station, loc, chan, year, doy, layout)
+        for year, doy in Days(starttime, endtime)]
+    return [f for f in files if _Exists(f)]
+
+# All of the day files in the archive, optionally only those whose name
+# matches a glob pattern in the flat layout, e.g. 'AM.BCCWA.*.BHZ.*'.
+def ArchiveFiles(path=path, pattern='*', layout=None):
+    import fnmatch
+    layout = layout or ArchiveLayout(path)
+    if layout == 'sds':
+        names = []
+        for root, dirs, files in os.walk(path):
+            names += [os.path.join(root, f) for f in files]
+    else:
+        names = [os.path.join(path, f) for f in _Listing(path)]
+    files = []
+    for f in names:
+        parsed = ParseDayFilename(f)
+        if parsed and fnmatch.fnmatch('%s.%s.%s.%s.%d.%03d.mseed' % parsed,
+                pattern):
+            files.append(f)
+    return sorted(files)
@@ -0,0 +1,304 @@
+# Band power and band RMS of seismic and infrasound data.
+#
+# WelchPsd() computes the averaged PSD of a long record like matplotlib's
+# mlab.psd() (Hann window, mean removed from each segment, one-sided density),
+# but transforms the segments in batches of bounded size instead of all at
+# once. RollingPsd() does the same for each window of a record, e.g. every
+# hour, as one array operation per batch of windows.
+#
+# BandPower() integrates PSDs over any number of bands at once: the spectrum
+# is integrated once into a cumulative sum (trapezoid rule), and the power in
+# a band is the difference of the cumulative sum at its edges, interpolated
+# between the frequency bins. It works on one PSD or an array of them.
+#
+# ArchiveBandRms() puts these together for the day files: the RMS in each
+# band for each window, in physical units, for any channel. The CSV table is
+# updated incrementally, so a continuous metric only costs the new days.
+#
+# Example, hourly RMS of the microseism bands in m/s:
+#   python band_power.py --channel AM.BCCWA.01.BHZ --units 2e-9
+#       --starttime 2025-05-01 --table band_rms_BCCWA.csv
+# Microbarometer, narrow and wide band RMS in Pa:
+#   python band_power.py --channel AM.BKSVL.01.BDF --units 6.3e-3
+#       --band nb 0.5 2.0 --band wb 0.1 45 --starttime 2025-05-01
+
+import argparse
+import csv
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append('.')
+
+# Defaults
+window = 3600.0         # seconds per band RMS value
+overlap = 0.5           # of the FFT segments
+max_batch = 1 << 22     # samples per batch of FFT segments
+
+################################################################################
+# Spectra.
+
+# Sum over the segments of the squared magnitude spectra of x (..., n), with
+# segments of nfft samples every step samples. Returns (sums (..., nfft//2+1),
+# number of segments).
+def _SegmentPower(x, nfft, step, window):
+    from numpy.lib.stride_tricks import sliding_window_view
+    from scipy.fft import rfft
+    segments = sliding_window_view(x, nfft, axis=-1)[..., ::step, :]
+    count = segments.shape[-2]
+    batch = max(1, max_batch // (nfft * int(np.prod(x.shape[:-1]))))
+    total = np.zeros(x.shape[:-1] + (nfft // 2 + 1,))
+    for i in range(0, count, batch):
+        s = segments[..., i:i + batch, :]
+        s = (s - s.mean(axis=-1, keepdims=True)) * window
+        total += np.sum(np.abs(rfft(s, axis=-1)) ** 2, axis=-2)
+    return total, count
+
+# One-sided PSD density from the sums of _SegmentPower().
+def _Density(total, count, fs, nfft, window):
+    psd = total / (count * fs * np.sum(window ** 2))
+    psd[..., 1:(nfft + 1) // 2] *= 2
+    return psd
+
+# Averaged PSD of a record, like mlab.psd(data, Fs=fs, NFFT=nfft,
+# detrend=mlab.detrend_mean, noverlap=overlap*nfft). Records shorter than
+# nfft are zero padded. Returns (psd, freqs).
+def WelchPsd(data, fs, nfft, overlap=overlap):
+    data = np.asarray(data, dtype=np.float64)
+    if len(data) < nfft:
+        data = np.concatenate([data, np.zeros(nfft - len(data))])
+    w = np.hanning(nfft)
+    step = max(1, int(nfft * (1 - overlap)))
+    total, count = _SegmentPower(data, nfft, step, w)
+    return _Density(total, count, fs, nfft, w), np.fft.rfftfreq(nfft, 1 / fs)
+
+# Averaged PSD of each whole window of window_samples in a record. Returns
+# (psds (windows, frequencies), freqs); the start of window i is sample
+# i * window_samples.
+def RollingPsd(data, fs, window_samples, nfft, overlap=overlap):
+    data = np.asarray(data, dtype=np.float64)
+    nfft = min(nfft, window_samples)
+    windows = len(data) // window_samples
+    frames = data[:windows * window_samples].reshape(windows, window_samples)
+    w = np.hanning(nfft)
+    step = max(1, int(nfft * (1 - overlap)))
+    psds = np.empty((windows, nfft // 2 + 1))
+    batch = max(1, max_batch // window_samples)
+    for i in range(0, windows, batch):
+        total, count = _SegmentPower(frames[i:i + batch], nfft, step, w)
+        psds[i:i + batch] = _Density(total, count, fs, nfft, w)
+    return psds, np.fft.rfftfreq(nfft, 1 / fs)
+
+# Length of the FFT segments to resolve the lowest band edge with about four
+# bins, but at most the window.
+def SegmentLength(fs, bands, window_samples):
+    fmin = min(lo for lo, hi in bands.values())
+    nfft = 1 << int(np.ceil(np.log2(max(4 * fs / fmin, 256))))
+    return min(nfft, window_samples)
+
+################################################################################
+# Band integration.
+
+# Standard seismic bands of noise_models.py, as (fmin, fmax) in Hz.
+def SeismicBands():
+    from noise_models import standard_bands
+    return {name: (1.0 / long, 1.0 / short) for name, (short, long) in
+        standard_bands.items()}
+
+# Cumulative integral of PSDs (..., frequencies) over frequency, from 0 at the
+# first bin.
+def CumulativePower(psd, freqs):
+    from scipy.integrate import cumulative_trapezoid
+    return cumulative_trapezoid(psd, freqs, axis=-1, initial=0)
+
+# Value of cumulative (..., frequencies) at frequencies f, interpolated
+# linearly between bins. Returns (..., len(f)).
+def _AtFrequencies(cumulative, freqs, f):
+    f = np.clip(f, freqs[0], freqs[-1])
+    i = np.clip(np.searchsorted(freqs, f), 1, len(freqs) - 1)
+    frac = (f - freqs[i - 1]) / (freqs[i] - freqs[i - 1])
+    lower = cumulative[..., i - 1]
+    return lower + (cumulative[..., i] - lower) * frac
+
+# Power in each band of PSDs (..., frequencies), e.g. Pa^2 for a PSD in
+# Pa^2/Hz. bands is a dict of name: (fmin, fmax) in Hz. Bands are clipped to
+# the frequencies of the PSD. Returns a dict of name: power, with the shape of
+# the PSDs without the frequency axis.
+def BandPower(psd, freqs, bands, cumulative=None):
+    freqs = np.asarray(freqs, dtype=np.float64)
+    if cumulative is None:
+        cumulative = CumulativePower(np.asarray(psd, dtype=np.float64), freqs)
+    edges = np.array(list(bands.values()), dtype=np.float64).reshape(-1, 2)
+    lo = _AtFrequencies(cumulative, freqs, edges[:, 0])
+    hi = _AtFrequencies(cumulative, freqs, edges[:, 1])
+    power = np.maximum(hi - lo, 0.0)
+    return {name: power[..., i] for i, name in enumerate(bands)}
+
+# RMS amplitude in each band, e.g. Pa for a PSD in Pa^2/Hz.
+def BandRms(psd, freqs, bands, cumulative=None):
+    return {name: np.sqrt(p) for name, p in BandPower(psd, freqs, bands,
+        cumulative).items()}
+
+################################################################################
+# Band RMS of the archive.
+
+# Rolling PSDs of each whole window of one day of a channel
+# ('NET.STA.LOC.CHAN'). Windows start at multiples of window seconds from
+# midnight. units converts counts to physical units (e.g. m/s per count); with
+# acceleration, velocity PSDs are converted to acceleration. The FFT segments
+# are nfft long, or long enough for frequencies down to fmin. Returns a list of
+# (window start times, psds, freqs), one per contiguous trace.
+def DayRollingPsds(seed_id, day, window=window, units=1.0, acceleration=False,
+        path=None, nfft=None, fmin=0.01):
+    from obspy import UTCDateTime
+    from obspy_helpers import GetLocalDataRange
+    day = UTCDateTime(day)
+    net, station, loc, chan = seed_id.split('.')
+    st = GetLocalDataRange(net, station, loc, chan, day, day + 86400, path)
+    st = st.merge().split().trim(day, day + 86400)
+    result = []
+    for tr in st:
+        fs = tr.stats.sampling_rate
+        n = int(round(window * fs))
+        # First window boundary at or after the start of the trace.
+        offset = tr.stats.starttime - day
+        first = np.ceil(offset / window - 1e-9) * window
+        i0 = int(round((first - offset) * fs))
+        if tr.stats.npts - i0 < n:
+            continue
+        size = nfft or SegmentLength(fs, {'': (fmin, fs / 2)}, n)
+        psds, freqs = RollingPsd(tr.data[i0:] * units, fs, n, size)
+        if acceleration:
+            psds *= (2 * np.pi * freqs) ** 2
+        result.append(([day + first + k * window for k in range(len(psds))],
+            psds, freqs))
+    return result
+
+# Band RMS of each whole window of one day of a channel, see
+# DayRollingPsds(). Returns (window start times, dict of band: values).
+def DayBandRms(seed_id, day, bands, window=window, units=1.0,
+        acceleration=False, path=None, nfft=None):
+    fmin = min(lo for lo, hi in bands.values())
+    times = []
+    values = {name: [] for name in bands}
+    for t, psds, freqs in DayRollingPsds(seed_id, day, window, units,
+            acceleration, path, nfft, fmin):
+        for name, v in BandRms(psds, freqs, bands).items():
+            values[name].extend(v)
+        times.extend(t)
+    order = np.argsort([t.timestamp for t in times])
+    return [times[k] for k in order], {name: np.asarray(v)[order] for name, v
+        in values.items()}
+
+def _DayBandRms(job):
+    try:
+        return job[1], DayBandRms(*job)
+    except Exception as e:
+        print('Failed %s: %r' % (job[1].date, e))
+        return job[1], ([], {})
+
+def ReadTable(filename):
+    table = {}
+    if not os.path.exists(filename):
+        return table
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            table[row['time']] = row
+    return table
+
+def WriteTable(filename, table, bands):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=['time'] + list(bands))
+        w.writeheader()
+        for key in sorted(table):
+            w.writerow({k: ('%.6g' % v if isinstance(v, float) else v)
+                for k, v in table[key].items() if k in w.fieldnames})
+    os.replace(tmp, filename)
+
+# Compute the band RMS of a channel from starttime to endtime and add it to a
+# CSV table. Days already in the table are skipped, except the last one,
+# which may have been partial. Returns the table, a dict keyed by the window
+# start time.
+def ArchiveBandRms(filename, seed_id, starttime, endtime, bands,
+        window=window, units=1.0, acceleration=False, path=None, nfft=None,
+        processes=None):
+    table = ReadTable(filename)
+    done = set(key[:10] for key in table)
+    if done:
+        done.discard(max(done))
+    days = [day for day in _Days(starttime, endtime) if str(day.date) not in
+        done]
+    jobs = [(seed_id, day, bands, window, units, acceleration, path, nfft)
+        for day in days]
+    if not jobs:
+        return table
+    print('Computing %d days' % len(jobs))
+    if processes == 1 or len(jobs) == 1:
+        results = [_DayBandRms(job) for job in jobs]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_DayBandRms, jobs)
+    for day, (times, values) in results:
+        for i, t in enumerate(times):
+            row = {'time': str(t)[:19]}
+            row.update({name: float(values[name][i]) for name in bands})
+            table[row['time']] = row
+    WriteTable(filename, table, bands)
+    return table
+
+def _Days(starttime, endtime):
+    from obspy import UTCDateTime
+    import archive
+    return [UTCDateTime(year=y, julday=d) for y, d in
+        archive.Days(starttime, endtime)]
+
+################################################################################
+
+if __name__ == '__main__':
+    from obspy import UTCDateTime
+    import archive
+    desc = 'RMS amplitude in frequency bands, per window, of a channel in ' \
+        'the MiniSEED archive.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--channel', required=True,
+        help='Channel, e.g. AM.BCCWA.01.BHZ.')
+    parser.add_argument('--path', default=archive.path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--starttime', required=True,
+        help='First day.')
+    parser.add_argument('--endtime', default=None,
+        help='Last day (default now).')
+    parser.add_argument('--band', nargs=3, action='append', default=None,
+        metavar=('NAME', 'FMIN', 'FMAX'),
+        help='Frequency band in Hz. May be repeated (default the seismic '
+        'noise bands).')
+    parser.add_argument('--window', type=float, default=window,
+        help='Seconds per value (default %(default)s).')
+    parser.add_argument('--nfft', type=int, default=None,
+        help='FFT segment length (default from the lowest band).')
+    parser.add_argument('--units', type=float, default=1.0,
+        help='Physical units per count (default counts).')
+    parser.add_argument('--acceleration', action='store_true',
+        help='Convert velocity to acceleration.')
+    parser.add_argument('--table', default=None,
+        help='CSV table to update, one per set of bands (default '
+        'band_rms_NET_STA_LOC_CHAN.csv).')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of days to compute in parallel (default number of '
+        'CPUs).')
+    args = parser.parse_args()
+
+    if args.band:
+        bands = {name: (float(lo), float(hi)) for name, lo, hi in args.band}
+    else:
+        bands = SeismicBands()
+    table_file = args.table or 'band_rms_%s.csv' % args.channel.replace('.',
+        '_')
+    endtime = UTCDateTime(args.endtime) if args.endtime else UTCDateTime()
+    table = ArchiveBandRms(table_file, args.channel,
+        UTCDateTime(args.starttime), endtime, bands, args.window, args.units,
+        args.acceleration, args.path, args.nfft, args.processes)
+    print('%d windows in %s' % (len(table), table_file))
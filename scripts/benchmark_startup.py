@@ -0,0 +1,92 @@
+# Measure the startup cost of obspy_helpers, which every plotting script
+# imports, and fail if it goes over budget.
+#
+# Each measurement imports the module in a fresh interpreter. The time to
+# import obspy and numpy by themselves is measured the same way, and the
+# difference is the overhead of obspy_helpers. The check fails (exit code 1) if
+# the overhead is over budget, or if any of the modules that obspy_helpers is
+# supposed to load on first use were imported at startup.
+#
+# Example: python benchmark_startup.py --repeat 5 --overhead 0.1
+
+import argparse
+import json
+import subprocess
+import sys
+
+# These are imported on first use by the functions that need them.
+lazy_modules = [
+    'matplotlib',
+    'matplotlib.pyplot',
+    'obspy.clients.fdsn',
+    'obspy.clients.seedlink',
+    'obspy.taup',
+]
+
+# Defaults
+repeat = 5
+overhead = 0.1      # seconds, over the cost of importing obspy and numpy
+budget = None       # seconds, total import time
+
+# Python code run in a fresh interpreter. Prints the import time and the list
+# of loaded modules as JSON.
+probe = '''
+import json, sys, time
+sys.path.insert(0, '.')
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+print(json.dumps({{'time': t, 'modules': sorted(sys.modules.keys())}}))
+'''
+
+# Import a module in a fresh interpreter. Returns (seconds, loaded modules).
+def time_import(module):
+    out = subprocess.run([sys.executable, '-c', probe.format(module=module)],
+        check=True, capture_output=True, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    return result['time'], result['modules']
+
+# Fastest of several runs, to reduce noise from the rest of the system.
+def best_import_time(module, repeat):
+    times = []
+    modules = []
+    for i in range(repeat):
+        t, modules = time_import(module)
+        times.append(t)
+    return min(times), modules
+
+if __name__ == '__main__':
+    desc = 'Check that importing obspy_helpers stays within a startup budget.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--repeat', type=int, default=repeat,
+        help='Number of times to import each module (default {}).'.format(
+        repeat))
+    parser.add_argument('--overhead', type=float, default=overhead,
+        help='Maximum seconds over the cost of importing obspy and numpy '
+        '(default {}).'.format(overhead))
+    parser.add_argument('--budget', type=float, default=budget,
+        help='Maximum total seconds to import obspy_helpers (default none).')
+    args = parser.parse_args()
+
+    base, _ = best_import_time('obspy, numpy', args.repeat)
+    helpers, modules = best_import_time('obspy_helpers', args.repeat)
+    print('import obspy, numpy:  %.3f sec' % base)
+    print('import obspy_helpers: %.3f sec (%.3f sec overhead, budget %.3f)' %
+        (helpers, helpers - base, args.overhead))
+
+    failed = False
+    if helpers - base > args.overhead:
+        print('FAIL: obspy_helpers import overhead is over budget.')
+        failed = True
+    if args.budget is not None and helpers > args.budget:
+        print('FAIL: obspy_helpers import time is over the %.3f sec budget.' %
+            args.budget)
+        failed = True
+    eager = [m for m in lazy_modules if m in modules]
+    if eager:
+        print('FAIL: modules imported at startup:', ', '.join(eager))
+        failed = True
+
+    if not failed:
+        print('OK')
+    exit(1 if failed else 0)
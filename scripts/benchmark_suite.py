@@ -0,0 +1,259 @@
+# Benchmark the data and plotting helpers end to end on synthetic data, and
+# fail if any stage got slower or bigger than a stored baseline.
+#
+# Synthetic day files are written once (see synthetic_data.py) for each
+# sampling rate, in the archive layout NET.STA.LOC.CHAN.YEAR.DOY.mseed. Each
+# stage then runs in a fresh interpreter, so that the peak RSS is for that
+# stage alone. Setup, such as reading the input data, isn't timed. Stages:
+#   read_local     GetLocalDataRange() of two day files
+#   get_data       GetData() from a local Seedlink stand-in, 24 hours
+#   helicorder     broadband Helicorder() of a day
+#   spectrogram    broadband all-day Spectrogram()
+#   ppsd           PPSD of a day, 1 hour segments, with the AM_BCCWA.xml response
+#   filter_events  EventDistances() and FilterEvents() on 5000 events
+#
+# The baseline is machine specific. Record it on the machine that runs the
+# plots with --save-baseline, then run without it to check for regressions.
+#
+# Example: python benchmark_suite.py --rate 100 --rate 200 --save-baseline
+#          python benchmark_suite.py
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Defaults
+data_path = os.path.join(tempfile.gettempdir(), 'seismo_benchmark')
+baseline_file = 'benchmark_baseline.json'
+rates = [100.0, 200.0]
+tolerance = 0.25        # fractional increase in time or memory
+min_change = 0.05       # seconds, ignore smaller changes in time
+start = '2025-06-01'    # within the AM_BCCWA.xml epoch
+net, station, loc, chan = 'AM', 'BCCWA', '01', 'BHZ'
+
+stages = ['read_local', 'get_data', 'helicorder', 'spectrogram', 'ppsd',
+    'filter_events']
+
+# Directory of the synthetic data for a sampling rate.
+def rate_path(path, rate):
+    return os.path.join(path, '%g' % rate)
+
+# Write the synthetic day files, unless they already exist.
+def make_data(path, rate):
+    from obspy import UTCDateTime
+    from synthetic_data import DayFilename, WriteSyntheticDays
+    t = UTCDateTime(start)
+    path = rate_path(path, rate)
+    days = 2
+    if all(os.path.isfile(DayFilename(path, net, station, loc, chan,
+            (t + i*86400).year, (t + i*86400).julday)) for i in range(days)):
+        return
+    print('Writing synthetic data to', path)
+    WriteSyntheticDays(path, net, station, loc, chan, t, days=days,
+        sampling_rate=rate)
+
+################################################################################
+# The stages. Each one does its setup and returns the function to time.
+
+def read_day(path, t0):
+    from obspy_helpers import GetLocalDataRange
+    st = GetLocalDataRange(net, station, loc, chan, t0, t0 + 86399, path=path)
+    st.merge(method=0, fill_value='interpolate')
+    return st
+
+def stage_read_local(path, t0, work):
+    from obspy_helpers import GetLocalDataRange
+    return lambda: GetLocalDataRange(net, station, loc, chan, t0,
+        t0 + 2*86400 - 1, path=path)
+
+def stage_get_data(path, t0, work):
+    from obspy_helpers import GetData
+    from seedlink_standin import StartSeedlinkStandin
+    server = StartSeedlinkStandin(path, port=0)
+    addr = 'localhost:%d' % server.server_address[1]
+    # GetData() keeps a cache file in the current directory. Start without it.
+    os.chdir(work)
+    cache = '%s.%s.%s.%s.mseed' % (net, station, loc, chan)
+    if os.path.exists(cache):
+        os.remove(cache)
+    return lambda: GetData(addr, net, station, loc, chan, t0 + 6*3600,
+        t0 + 30*3600)
+
+def stage_helicorder(path, t0, work):
+    from obspy_helpers import Helicorder
+    st = read_day(path, t0)
+    filename = os.path.join(work, 'helicorder.png')
+    return lambda: Helicorder(st, filename, 'Benchmark', t0, 86400,
+        freqmin=0.002, freqmax=25, scale=30e-6, units=2.0e-9)
+
+def stage_spectrogram(path, t0, work):
+    from obspy_helpers import Spectrogram
+    st = read_day(path, t0)
+    filename = os.path.join(work, 'spectrogram.png')
+    return lambda: Spectrogram(st, filename, t0, 86400, freqmin=0.1,
+        freqmax=25.0, decimation=2, title='All day', wlen=30.0, per_lap=0.5)
+
+def stage_ppsd(path, t0, work):
+    from obspy import read_inventory
+    from obspy.signal import PPSD
+    st = read_day(path, t0)
+    inv = read_inventory(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), 'AM_BCCWA.xml'))
+    def run():
+        ppsd = PPSD(st[0].stats, metadata=inv, period_step_octaves=1.0/40,
+            ppsd_length=3600, overlap=0.5, skip_on_gaps=False)
+        ppsd.add(st)
+        return ppsd
+    return run
+
+def stage_filter_events(path, t0, work):
+    import numpy as np
+    from obspy.core.event import Catalog, Event, Origin, Magnitude
+    from obspy_helpers import EventDistances, FilterEvents
+    rng = np.random.default_rng(0)
+    events = Catalog()
+    for i in range(5000):
+        e = Event()
+        e.origins.append(Origin(time=t0 + rng.uniform(0, 86400),
+            latitude=rng.uniform(-90, 90), longitude=rng.uniform(-180, 180),
+            depth=rng.uniform(0, 600e3)))
+        e.magnitudes.append(Magnitude(mag=rng.uniform(2, 8)))
+        events.append(e)
+    site = (45.617450, -122.498994)
+    broadband = [(2.0, 10e3), (3.0, 100e3), (4.0, 500e3), (5.0, 5000e3),
+        (6.0, 10000e3), (7.0, float('inf'))]
+    teleseismic = [(4.0, 3000e3), (4.5, 7000e3), (5.0, 15000e3),
+        (6.0, float('inf'))]
+    def run():
+        distances = EventDistances(events, site[0], site[1])
+        FilterEvents(events, broadband, site[0], site[1], distances=distances)
+        FilterEvents(events, teleseismic, site[0], site[1],
+            distances=distances)
+    return run
+
+# Run one stage in this process and print the result as JSON.
+def run_stage(stage, path, rate, text_mode):
+    import matplotlib
+    matplotlib.use('Agg')
+    import contextlib
+    from obspy import UTCDateTime
+    from obspy_helpers import SetTextMode
+    SetTextMode(text_mode)
+    t0 = UTCDateTime(start)
+    work = tempfile.mkdtemp(prefix='benchmark_')
+    run = globals()['stage_' + stage](rate_path(path, rate), t0, work)
+    # The helpers print progress; keep stdout for the result.
+    with contextlib.redirect_stdout(sys.stderr):
+        cpu = time.process_time()
+        t = time.perf_counter()
+        run()
+        t = time.perf_counter() - t
+        cpu = time.process_time() - cpu
+    print(json.dumps({'time': t, 'cpu': cpu, 'peak_rss_mb': peak_rss_mb()}))
+
+# Peak RSS of this process in MB. On Linux ru_maxrss is inherited from the
+# parent across fork and exec, so use VmHWM, which isn't.
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Run one stage in a fresh interpreter. Returns the result dict.
+def measure(stage, path, rate, text_mode, verbose=False):
+    cmd = [sys.executable, sys.argv[0], '--run-stage', stage, '--data', path,
+        '--rate', str(rate), '--text', text_mode]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.DEVNULL, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+# Compare a result to its baseline. Returns a list of regressions.
+def regressions(result, base, tolerance):
+    failed = []
+    if result['time'] > base['time'] * (1 + tolerance) and \
+            result['time'] - base['time'] > min_change:
+        failed.append('time %.2f s (baseline %.2f s)' %
+            (result['time'], base['time']))
+    if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+        failed.append('peak RSS %.0f MB (baseline %.0f MB)' %
+            (result['peak_rss_mb'], base['peak_rss_mb']))
+    return failed
+
+if __name__ == '__main__':
+    desc = 'Time the data and plotting helpers on synthetic data.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--data', default=data_path,
+        help='Directory for the synthetic data (default %(default)s).')
+    parser.add_argument('--rate', type=float, action='append', default=None,
+        help='Sampling rate to test. Multiple rates may be given (default '
+        '{}).'.format(', '.join('%g' % r for r in rates)))
+    parser.add_argument('--stage', action='append', default=None,
+        choices=stages, help='Stage to run. Multiple stages may be given '
+        '(default all).')
+    parser.add_argument('--baseline', default=baseline_file,
+        help='Baseline file (default %(default)s).')
+    parser.add_argument('--save-baseline', action='store_true',
+        help='Save the results as the new baseline instead of comparing.')
+    parser.add_argument('--tolerance', type=float, default=tolerance,
+        help='Allowed fractional increase over the baseline (default '
+        '%(default)s).')
+    parser.add_argument('--text', default='fast', choices=['latex', 'fast'],
+        help='Text mode for the plots (default %(default)s).')
+    parser.add_argument('--run-stage', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='Show the output of the stages.')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.run_stage:
+        run_stage(args.run_stage, args.data, args.rate[0], args.text)
+        exit(0)
+
+    results = {}
+    for rate in args.rate or rates:
+        make_data(args.data, rate)
+        for stage in args.stage or stages:
+            name = '%s@%g' % (stage, rate)
+            results[name] = measure(stage, args.data, rate, args.text,
+                args.verbose)
+            r = results[name]
+            print('%-24s %8.2f s wall %8.2f s cpu %8.0f MB peak' %
+                (name, r['time'], r['cpu'], r['peak_rss_mb']))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print('Saved baseline to', args.baseline)
+        exit(0)
+
+    if not os.path.exists(args.baseline):
+        print('No baseline in %s. Run with --save-baseline first.' %
+            args.baseline)
+        exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    failed = False
+    for name, r in results.items():
+        if name not in baseline:
+            print('%s: no baseline' % name)
+            continue
+        for msg in regressions(r, baseline[name], args.tolerance):
+            print('FAIL: %s %s' % (name, msg))
+            failed = True
+    if not failed:
+        print('OK')
+    exit(1 if failed else 0)
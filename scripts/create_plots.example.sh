@@ -4,7 +4,7 @@
 # cd to the directory where the script is located.
 cd "$(dirname "$0")"
 
-/usr/bin/python3 plot_helicorders_and_spectrum.py
+/usr/bin/python3 plot_helicorders_and_spectrum.py --station OMDBO
 
 # Copy the latest helicorder files to the server.
 # SSH was previously set up for certificate authentication.
@@ -4,13 +4,9 @@
 # cd to the directory where the script is located.
 cd "$(dirname "$0")"
 
-# BCCWA
-echo "BCCWA helicorders"
-/usr/bin/python3 plot_helicorders_and_spectrum.py
-
-# GBLCO
-echo "GBLCO helicorders"
-/usr/bin/python3 plot_helicorders_and_spectrum_gblco.py
+# BCCWA and GBLCO, as listed in stations.json
+echo "Helicorders"
+/usr/bin/python3 plot_helicorders_and_spectrum.py --station BCCWA --station GBLCO
 
 # Create PPSD plots every 4 hours.
 if [ ! -f ./ppsd_AM_BCCWA_01_BHZ.png -o "$(find ./ppsd_AM_BCCWA_01_BHZ.png -mmin +240)" ]; then
@@ -108,7 +108,9 @@ class Yuma2Response:
 
     def temperature_response(self):
         # Return the response for the temperature channel.
-        # Linear output of 0.01V / deg C, from -55 to +150C
+        # Linear output of 0.01V / deg C, from -55 to +150C. StationXML
+        # polynomials give the input (deg C) as a function of the output
+        # (volts), so the coefficient is 100 deg C / V.
         return PolynomialResponseStage(
             1,
             stage_gain = 1.0,
@@ -120,7 +122,7 @@ class Yuma2Response:
             approximation_lower_bound = -55.0,
             approximation_upper_bound = 150.0,
             maximum_error = 0.5,    # in degrees?
-            coefficients = [ 0, 0.01 ],
+            coefficients = [ 0, 100.0 ],
             # Note: in StationXML file only the name of stage[0] is used.
             name = 'Yuma2 mechanical rev 4.3, electrical rev 4.0',
             input_units_description = 'Degrees Centigrade',
@@ -145,7 +147,8 @@ class Yuma2Response:
 #
 class PsnAdc24Response:
 
-    def __init__(self, divider_ratio=1/17.0):
+    # The temperature channel has no divider and the PGA gain is 1.
+    def __init__(self, divider_ratio=1/17.0, pga_gain=2.0):
         self.stages = []
 
         # Stage 1: Digitizer input voltage divider and antialiasing filter.
@@ -171,13 +174,13 @@ class PsnAdc24Response:
             input_units_description = 'Volts',
             output_units_description = 'Volts'))
 
-        # Stage 2: ADC internal PGA (programmable gain amplifier), gain = 2.
+        # Stage 2: ADC internal PGA (programmable gain amplifier).
         # Represented as a poles/zeros stage with no poles and no zeros
         # (flat frequency response) so that the name is preserved in the
         # StationXML output.  All information is in the stage gain.
         self.stages.append(PolesZerosResponseStage(
             len(self.stages)+1,
-            stage_gain = 2.0,
+            stage_gain = pga_gain,
             stage_gain_frequency = normalization_frequency,
             input_units = 'V',
             output_units = 'V',
@@ -186,7 +189,7 @@ class PsnAdc24Response:
             normalization_factor = 1.0,
             zeros = [],
             poles = [],
-            name = 'ADC internal PGA (gain only, gain=2)',
+            name = 'ADC internal PGA (gain only, gain=%g)' % pga_gain,
             input_units_description = 'Volts',
             output_units_description = 'Volts'))
 
@@ -562,7 +565,7 @@ def create_channel(channel, location, latitude, longitude, elevation, depth,
         print(digitizer_response.instrument_sensitivity)
 
         # Then scale all of the sensor coefficients by the inverse nth power of the system gain.
-        coef = sensor_resp.coefficients
+        coef = list(sensor_resp.coefficients)
         for i,c in enumerate(coef):
             coef[i] = c / (system_gain ** i)
 
@@ -780,7 +783,7 @@ def create_station_omdbo():
         elevation = sta.elevation,
         depth = 1.0,
         sensor_resp = Yuma2Response.lookup(serial_number='4').temperature_response(),
-        digitizer_resp = PsnAdc24Response().response(),
+        digitizer_resp = PsnAdc24Response(divider_ratio=1.0, pga_gain=1.0).response(),
         sample_rate = 1.0,
         input_units_str = 'degC',
         input_units_desc = 'Degrees Centigrade',
@@ -883,6 +886,8 @@ def create_station_bccwa():
         decimation_delay = averager_delay,
         decimation_correction = averager_delay)
     adc_plus_averager = PsnAdc24Response().response() + [averager_stage]
+    temperature_adc_plus_averager = PsnAdc24Response(divider_ratio=1.0,
+        pga_gain=1.0).response() + [averager_stage]
 
     # Temperature sensor (LKS)
     sta.channels.append(create_channel(
@@ -893,7 +898,7 @@ def create_station_bccwa():
         elevation = sta.elevation,
         depth = 1.0,
         sensor_resp = Yuma2Response.lookup(serial_number='4').temperature_response(),
-        digitizer_resp = adc_plus_averager,
+        digitizer_resp = temperature_adc_plus_averager,
         sample_rate = averager_output_rate,
         input_units_str = 'degC',
         input_units_desc = 'Degrees Centigrade',
@@ -1045,6 +1050,40 @@ def create_station_xxxxx():
             serial_number='79cda1')))
     return sta
 
+################################################################################
+# Conversion factors of the state of health channels, in units per count, from
+# the constants that were used before the conversion came from the StationXML
+# files. The PSN-ADC24 temperature input has no divider and a PGA gain of 1
+# (2.5 V full scale). Its centering force input has the 1/17 divider and the
+# PGA gain of 2 (1.25 V full scale) of the seismometer channel. The seiscape2
+# has a 1/8 divider and 2.5 V full scale. The LM35 gives 0.01 V/degC.
+soh_reference = {
+    'AM.BCCWA.01.LKS': 2.5 / 0.01 / 2**23,
+    'AM.BCCWA.01.LMZ': 1.25 * 17 / 2**23,
+    'AM.OMDBO.01.LKS': 2.5 / 0.01 / 2**23,
+    'AM.OMDBO.01.LMZ': 1.25 * 17 / 2**23,
+    'AM.GBLCO.01.EKS': 2.5 * 8 / 0.01 / 2**23,
+    'AM.GBLCO.01.EMZ': 2.5 * 8 / 2**23,
+    'AM.XXXXX.01.EKS': 2.5 * 8 / 0.01 / 2**23,
+    'AM.XXXXX.01.EMZ': 2.5 * 8 / 2**23,
+}
+
+# Compare the conversion of each state of health channel in the StationXML
+# files with soh_reference. Returns True if all agree within tolerance.
+def check_soh_conversion(tolerance=1e-3):
+    from obspy_helpers import GetStationResponse, ResponsePolynomial
+    ok = True
+    for seed_id, reference in sorted(soh_reference.items()):
+        net, station, loc, chan = seed_id.split('.')
+        inv = GetStationResponse(net, station)
+        factor = ResponsePolynomial(inv, seed_id, inv[0][0].start_date + 1)[1]
+        error = factor / reference - 1
+        ok &= abs(error) < tolerance
+        print('%-16s %.6g per count, reference %.6g, %+.3f%% %s' % (seed_id,
+            factor, reference, 100 * error,
+            'OK' if abs(error) < tolerance else 'FAILED'))
+    return ok
+
 def create_response_files():
     def create_inv_net():
         inv = Inventory(
@@ -1103,4 +1142,14 @@ def create_response_files():
 
 
 if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Write the StationXML '
+        'files of the stations.')
+    parser.add_argument('--check', action='store_true',
+        help='Check the state of health conversion factors of the existing '
+        'files against the old constants, and exit.')
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check_soh_conversion() else 1)
     create_response_files()
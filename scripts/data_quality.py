@@ -0,0 +1,211 @@
+# Data quality metrics of the MiniSEED archive, per channel per day.
+#
+# Each day file (flat or SDS layout, see archive.py) is read once, and the
+# metrics are computed from the trace start and end times and the samples:
+#   availability    fraction of the day covered by data
+#   gaps, overlaps  number of gaps and overlaps between records, and the
+#   max_gap         longest gap in seconds (including the ends of the day)
+#   clipped         samples at or beyond the clip level in counts
+#   mean, rms       DC offset, and the rms about it, in counts
+#   min, max        extremes in counts
+# The files are scanned in parallel. The results are kept in a CSV table with
+# one row per file, and files that are already there with the same size and
+# modification time are not read again, so an update only reads the new days.
+#
+# Example: python data_quality.py --path /data/seismometer_data/mseed
+#              --table data_quality.csv --station BCCWA --days 30
+
+import argparse
+import csv
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+from obspy import UTCDateTime, read
+
+sys.path.append('.')
+import archive
+
+# Defaults
+path = '/data/seismometer_data/mseed'
+table_file = 'data_quality.csv'
+clip_level = 2**23 - 1      # 24 bit ADC
+
+metrics = ['npts', 'sampling_rate', 'availability', 'gaps', 'overlaps',
+    'max_gap', 'clipped', 'mean', 'rms', 'min', 'max']
+columns = ['file', 'signature', 'net', 'station', 'loc', 'chan', 'day'] + \
+    metrics
+
+################################################################################
+
+# Identify a file, so that changed files are scanned again.
+def _Signature(filename):
+    try:
+        s = os.stat(filename)
+        return '%d:%d' % (s.st_size, int(s.st_mtime))
+    except OSError:
+        return '-'
+
+# Gaps, overlaps, availability and the longest gap from the start and end
+# times of the traces, within the day from t0 to t1 (POSIX seconds).
+def Coverage(starts, ends, delta, t0, t1):
+    order = np.argsort(starts)
+    starts = np.asarray(starts, dtype=np.float64)[order]
+    ends = np.asarray(ends, dtype=np.float64)[order] + delta
+    # The end of the data covered so far, before each trace.
+    covered = np.maximum.accumulate(ends)
+    step = starts[1:] - covered[:-1]
+    gaps = int(np.sum(step > 0.5 * delta))
+    overlaps = int(np.sum(step < -0.5 * delta))
+    # Union of the intervals, clipped to the day.
+    s = np.clip(starts, t0, t1)
+    e = np.clip(ends, t0, t1)
+    previous = np.concatenate([[t0], np.maximum.accumulate(e)[:-1]])
+    available = np.sum(np.maximum(e - np.maximum(s, previous), 0.0))
+    holes = np.concatenate([[s[0] - t0], np.maximum(s[1:] - previous[1:],
+        0.0), [t1 - max(e.max(), t0)]])
+    return available / (t1 - t0), gaps, overlaps, float(holes.max())
+
+# Metrics of one day file. Returns a dict of the table columns, or None if the
+# file can't be read.
+def FileMetrics(filename, clip=clip_level):
+    net, station, loc, chan, year, doy = archive.ParseDayFilename(filename)
+    t0 = UTCDateTime(year=year, julday=doy)
+    row = {'file': os.path.basename(filename),
+        'signature': _Signature(filename), 'net': net, 'station': station,
+        'loc': loc, 'chan': chan, 'day': str(t0.date)}
+    try:
+        st = read(filename)
+    except Exception as e:
+        print('Unable to read %s: %r' % (filename, e))
+        return None
+    st = [tr for tr in st if tr.stats.npts > 0]
+    if not st:
+        row.update({k: 0 for k in metrics})
+        row['max_gap'] = 86400.0
+        for k in ('mean', 'rms', 'min', 'max'):
+            row[k] = np.nan
+        return row
+
+    delta = st[0].stats.delta
+    starts = [tr.stats.starttime.timestamp for tr in st]
+    ends = [tr.stats.endtime.timestamp for tr in st]
+    availability, gaps, overlaps, max_gap = Coverage(starts, ends, delta,
+        t0.timestamp, t0.timestamp + 86400)
+
+    # Sums of the samples, trace by trace, so there is no merged copy.
+    n = 0
+    total = 0.0
+    squares = 0.0
+    clipped = 0
+    lo, hi = np.inf, -np.inf
+    for tr in st:
+        data = tr.data
+        n += len(data)
+        total += np.sum(data, dtype=np.float64)
+        squares += np.dot(data.astype(np.float64), data)
+        clipped += int(np.count_nonzero(np.abs(data) >= clip))
+        lo = min(lo, data.min())
+        hi = max(hi, data.max())
+    mean = total / n
+    rms = np.sqrt(max(squares / n - mean * mean, 0.0))
+    row.update({'npts': n, 'sampling_rate': st[0].stats.sampling_rate,
+        'availability': availability, 'gaps': gaps, 'overlaps': overlaps,
+        'max_gap': max_gap, 'clipped': clipped, 'mean': mean, 'rms': rms,
+        'min': float(lo), 'max': float(hi)})
+    return row
+
+def _FileMetrics(job):
+    return FileMetrics(*job)
+
+################################################################################
+# Metrics table.
+
+def ReadTable(filename):
+    table = {}
+    if not os.path.exists(filename):
+        return table
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            table[row['file']] = row
+    return table
+
+def WriteTable(filename, table):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=columns)
+        w.writeheader()
+        for key in sorted(table):
+            w.writerow({k: ('%.6g' % v if isinstance(v, float) else v)
+                for k, v in table[key].items()})
+    os.replace(tmp, filename)
+
+# Day files in path, in the flat or SDS layout, optionally only those
+# matching a glob pattern of the flat file name (e.g. 'AM.BCCWA.*') and on or
+# after a day.
+def ArchiveFiles(path, pattern='*', since=None):
+    files = archive.ArchiveFiles(path, pattern)
+    if since is not None:
+        files = [f for f in files if archive.ParseDayFilename(f)[4:] >=
+            (since.year, since.julday)]
+    return files
+
+# Scan the new and changed files and add them to the table file. Returns the
+# table.
+def UpdateTable(filename, files, clip=clip_level, processes=None):
+    table = ReadTable(filename)
+    todo = [f for f in files if os.path.basename(f) not in table or
+        table[os.path.basename(f)]['signature'] != _Signature(f)]
+    if not todo:
+        return table
+    print('Scanning %d of %d files' % (len(todo), len(files)))
+    jobs = [(f, clip) for f in todo]
+    if processes == 1 or len(jobs) == 1:
+        rows = [_FileMetrics(job) for job in jobs]
+    else:
+        with Pool(processes) as pool:
+            rows = pool.map(_FileMetrics, jobs, chunksize=4)
+    for row in rows:
+        if row:
+            table[row['file']] = row
+    WriteTable(filename, table)
+    return table
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Availability, gaps, clipping, offset and rms of the day files ' \
+        'in a MiniSEED archive.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--path', default=path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--table', default=table_file,
+        help='Metrics table (default %(default)s).')
+    parser.add_argument('--station', default='*',
+        help='Only this station (default all).')
+    parser.add_argument('--channel', default='*',
+        help='Only this channel, e.g. BHZ (default all).')
+    parser.add_argument('--days', type=int, default=None,
+        help='Only the last number of days (default all).')
+    parser.add_argument('--clip', type=float, default=clip_level,
+        help='Clip level in counts (default %(default)s).')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of files to scan in parallel (default number of CPUs).')
+    args = parser.parse_args()
+
+    since = UTCDateTime() - (args.days - 1) * 86400 if args.days else None
+    pattern = '*.%s.*.%s.*' % (args.station, args.channel)
+    files = ArchiveFiles(args.path, pattern, since)
+    table = UpdateTable(args.table, files, args.clip, args.processes)
+
+    names = set(os.path.basename(f) for f in files)
+    print('%-20s %-10s %7s %5s %5s %8s %7s %12s %10s' % ('channel', 'day',
+        'avail', 'gaps', 'ovl', 'max gap', 'clip', 'mean', 'rms'))
+    for key in sorted(names & set(table)):
+        r = table[key]
+        print('%-20s %-10s %6.1f%% %5d %5d %8.0f %7d %12.1f %10.1f' % (
+            '.'.join([r['net'], r['station'], r['loc'], r['chan']]), r['day'],
+            100 * float(r['availability']), int(r['gaps']),
+            int(r['overlaps']), float(r['max_gap']), int(r['clipped']),
+            float(r['mean']), float(r['rms'])))
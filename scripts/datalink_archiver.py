@@ -0,0 +1,376 @@
+# Archive the data streams of a ringserver to the MiniSEED day files.
+#
+# Connects to the ringserver's DataLink port (archive.local:16000, fed by
+# ew2ringserver), streams the MiniSEED packets of the channels that match a
+# regular expression, and appends each 512 byte record unchanged to its day
+# file NET.STA.LOC.CHAN.YEAR.DOY.mseed, by the record's start time. Only the
+# fixed header of each record is parsed, so all channels at 200 sps cost very
+# little CPU.
+#
+# Records are buffered per day file and written with one write and one fsync
+# per file when flush_interval seconds have passed or flush_bytes are
+# buffered. After each flush the last packet id is saved to the state file,
+# so after a restart or a lost connection the stream resumes where the files
+# end, without gaps or duplicates. If the ring no longer holds the saved
+# packet, it resumes at the first packet after it, and reports the gap.
+#
+# Example: python datalink_archiver.py --server archive.local:16000
+#              --path /data/seismometer_data/mseed --match '^AM_.*/MSEED$'
+# Test against a replay of day files: see datalink_standin.py.
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.append('.')
+from archive import ArchiveLayout, DayFilename
+
+# Defaults
+server = 'archive.local:16000'
+path = '/data/seismometer_data/mseed'
+match = '.*/MSEED$'
+flush_interval = 10.0       # seconds
+flush_bytes = 1 << 20       # buffered bytes in all files
+idle_close = 600.0          # close day files not written for this long
+reconnect_interval = 10.0   # seconds
+client_id = 'datalink_archiver'
+
+################################################################################
+
+# An ERROR reply from the server, e.g. to a position that is no longer in the
+# ring. The connection is still usable.
+class DataLinkError(ConnectionError):
+    pass
+
+# Minimal DataLink client: ID, MATCH, POSITION and STREAM, as used by
+# ringserver. Each packet is 'DL', a one byte header length, an ASCII header
+# and the data. The socket is read into the client's own buffer, and a packet
+# is only taken from it once it is complete, so a read timeout in the middle
+# of a packet loses nothing. (A file from socket.makefile() can't be read
+# again after a timeout.) Socket errors are raised as ConnectionError, so they
+# can be told apart from the errors of writing the files.
+class DataLinkClient:
+    def __init__(self, host, port, timeout=30.0):
+        try:
+            self.sock = socket.create_connection((host, port),
+                timeout=timeout)
+        except OSError as e:
+            raise ConnectionError('Unable to connect to %s:%s: %s' % (host,
+                port, e)) from e
+        self.buffer = bytearray()
+        self.chunk = bytearray(1 << 16)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def send(self, header, data=b''):
+        header = header.encode('ascii')
+        try:
+            self.sock.sendall(b'DL' + bytes([len(header)]) + header + data)
+        except OSError as e:
+            raise ConnectionError(str(e)) from e
+
+    # Read until the buffer has at least n bytes. Raises socket.timeout, with
+    # the buffer unchanged, if nothing arrives within the socket's timeout.
+    def _fill(self, n):
+        while len(self.buffer) < n:
+            try:
+                count = self.sock.recv_into(self.chunk)
+            except socket.timeout:
+                raise
+            except OSError as e:
+                raise ConnectionError(str(e)) from e
+            if count == 0:
+                raise ConnectionError('Connection closed by the server')
+            self.buffer += memoryview(self.chunk)[:count]
+
+    # Read one packet. Returns (header words, data).
+    def receive(self):
+        self._fill(3)
+        if self.buffer[:2] != b'DL':
+            raise ConnectionError('Bad DataLink packet %r' %
+                bytes(self.buffer[:3]))
+        end = 3 + self.buffer[2]
+        self._fill(end)
+        words = self.buffer[3:end].decode('ascii').split()
+        size = 0
+        if words[0] == 'PACKET':
+            size = int(words[6])
+        elif words[0] in ('OK', 'ERROR'):
+            size = int(words[2])
+        self._fill(end + size)
+        data = bytes(self.buffer[end:end + size])
+        del self.buffer[:end + size]
+        return words, data
+
+    # Send a command and return the reply message. Raises DataLinkError on
+    # ERROR.
+    def command(self, header, data=b''):
+        self.send(header, data)
+        try:
+            words, message = self.receive()
+        except socket.timeout:
+            raise ConnectionError('%s: no reply' % header)
+        if words[0] == 'ERROR':
+            raise DataLinkError('%s: %s' % (header,
+                message.decode('ascii', 'replace')))
+        return words, message
+
+    def identify(self, name=client_id):
+        return self.command('ID %s' % name)
+
+    def match(self, pattern):
+        pattern = pattern.encode('ascii')
+        return self.command('MATCH %d' % len(pattern), pattern)
+
+    # Position the reader at a packet id, or 'EARLIEST' or 'LATEST'.
+    def position(self, pktid, pkttime=None):
+        if pkttime is None:
+            return self.command('POSITION SET %s' % pktid)
+        return self.command('POSITION SET %s %s' % (pktid, pkttime))
+
+    # Position the reader at the first packet after a packet time.
+    def position_after(self, pkttime):
+        return self.command('POSITION AFTER %s' % pkttime)
+
+    # Stream packets. Yields (stream id, packet id, packet time, data), or
+    # None every 'timeout' seconds without data, so the caller can flush.
+    def stream(self, timeout=1.0):
+        self.send('STREAM')
+        self.sock.settimeout(timeout)
+        while True:
+            try:
+                words, data = self.receive()
+            except socket.timeout:
+                yield None
+                continue
+            if words[0] == 'PACKET':
+                yield words[1], int(words[2]), words[3], data
+            elif words[0] == 'ENDSTREAM':
+                return
+
+################################################################################
+
+# Network, station, location, channel, year and day of the year of a MiniSEED
+# 2 record, from its fixed header.
+def RecordDay(record):
+    station = record[8:13].decode('ascii').strip()
+    loc = record[13:15].decode('ascii').strip()
+    chan = record[15:18].decode('ascii').strip()
+    net = record[18:20].decode('ascii').strip()
+    year, doy = struct.unpack('>HH', record[20:24])
+    if not 1900 <= year <= 2100:
+        year, doy = struct.unpack('<HH', record[20:24])
+    return net, station, loc, chan, year, doy
+
+# Start time of a MiniSEED 2 record, in POSIX seconds.
+def RecordStart(record):
+    order = '>' if 1900 <= struct.unpack('>H', record[20:22])[0] <= 2100 \
+        else '<'
+    year, doy, hour, minute, second, _, fract = struct.unpack(order +
+        'HHBBBBH', record[20:30])
+    days = (year - 1970) * 365 + (year - 1969) // 4 - (year - 1901) // 100 + \
+        (year - 1601) // 400 + doy - 1
+    return days * 86400 + hour * 3600 + minute * 60 + second + fract * 1e-4
+
+# Appends records to the day files with batched writes and fsyncs. The files
+# of the previous day are closed when they go idle. layout is 'flat' or 'sds'
+# (see archive.py).
+class DayFileWriter:
+    def __init__(self, path, flush_interval=flush_interval,
+            flush_bytes=flush_bytes, layout='flat'):
+        self.path = path
+        self.layout = layout
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.buffers = {}       # filename -> list of records
+        self.files = {}         # filename -> [file, time of last write]
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.failed = False     # a flush failed, so don't write again
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, record):
+        filename = DayFilename(self.path, *RecordDay(record),
+            layout=self.layout)
+        self.buffers.setdefault(filename, []).append(record)
+        self.buffered += len(record)
+
+    def due(self):
+        return self.buffered >= self.flush_bytes or (self.buffered and
+            time.monotonic() - self.last_flush >= self.flush_interval)
+
+    def flush(self):
+        now = time.monotonic()
+        try:
+            for filename, records in self.buffers.items():
+                if filename not in self.files:
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    self.files[filename] = [open(filename, 'ab'), now]
+                f = self.files[filename]
+                f[0].write(b''.join(records))
+                f[0].flush()
+                os.fsync(f[0].fileno())
+                f[1] = now
+                self.records += len(records)
+        except OSError:
+            self.failed = True
+            raise
+        self.buffers = {}
+        self.buffered = 0
+        self.last_flush = now
+        for filename, (f, last) in list(self.files.items()):
+            if now - last > idle_close:
+                f.close()
+                del self.files[filename]
+
+    # Flush and close the files. After a failed flush the buffered records
+    # are dropped; they are after the saved state, so they are sent again.
+    def close(self):
+        if not self.failed:
+            self.flush()
+        for f, _ in self.files.values():
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.files = {}
+
+################################################################################
+
+# Last archived packet: (packet id, packet time), or None.
+def ReadState(filename):
+    try:
+        with open(filename) as f:
+            pktid, pkttime = f.read().split()
+            return int(pktid), pkttime
+    except (OSError, ValueError):
+        return None
+
+def WriteState(filename, pktid, pkttime):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('%d %s\n' % (pktid, pkttime))
+    os.replace(tmp, filename)
+
+# A DataLink packet time (microseconds) as an ISO time, for messages.
+def _PacketTime(pkttime):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ',
+        time.gmtime(int(pkttime) / 1e6))
+
+# Archive the streams from a DataLink server until it ends the stream, or
+# forever, reconnecting when the connection is lost. start is 'EARLIEST' or
+# 'LATEST', for when there is no saved state. If the saved packet is no longer
+# in the ring (e.g. after a long outage), the stream resumes at the first
+# packet after its time, or at start, and the gap is reported. layout is the
+# archive layout, by default that of the files already in path. Returns the
+# number of records.
+def Archive(address, path, match=match, state_file=None, start='LATEST',
+        flush_interval=flush_interval, flush_bytes=flush_bytes,
+        reconnect=True, layout=None):
+    host, port = address.rsplit(':', 1)
+    if state_file is None:
+        state_file = os.path.join(path, '.datalink_archiver.state')
+    layout = layout or ArchiveLayout(path)
+    writer = DayFileWriter(path, flush_interval, flush_bytes, layout)
+    state = ReadState(state_file)
+    after = None            # packet time to resume after, without a state
+    gap = None              # packet time before a gap in the archive
+    try:
+        while True:
+            last = None
+            client = None
+            try:
+                client = DataLinkClient(host, int(port))
+                client.identify()
+                client.match(match)
+                if state:
+                    try:
+                        client.position(*state)
+                    except DataLinkError as e:
+                        print('Packet %d (%s) is no longer in the ring: %s' %
+                            (state[0], _PacketTime(state[1]), e))
+                        after = gap = state[1]
+                        state = None
+                if not state and after:
+                    try:
+                        client.position_after(after)
+                    except DataLinkError as e:
+                        print('No packets after %s: %s' % (_PacketTime(after),
+                            e))
+                        after = None
+                if not state and not after:
+                    client.position(start)
+                for packet in client.stream():
+                    if packet is not None:
+                        streamid, pktid, pkttime, data = packet
+                        # A resumed stream may start with the saved packet.
+                        if state and pktid == state[0]:
+                            continue
+                        if gap:
+                            print('Gap in the archive from %s to %s' %
+                                (_PacketTime(gap), _PacketTime(pkttime)))
+                            gap = None
+                        writer.add(data)
+                        last = (pktid, pkttime)
+                    if writer.due():
+                        writer.flush()
+                        if last:
+                            state = last
+                            WriteState(state_file, *state)
+                writer.flush()
+                if last:
+                    WriteState(state_file, *last)
+                return writer.records
+            except ConnectionError as e:
+                # Flushed data is in the state; the rest is sent again. Errors
+                # writing the files are not caught, and end the archiver.
+                writer.flush()
+                if last:
+                    state = last
+                    WriteState(state_file, *state)
+                if not reconnect:
+                    raise
+                print('DataLink connection to %s lost: %s. Reconnecting in '
+                    '%g s.' % (address, e, reconnect_interval))
+            finally:
+                if client:
+                    client.close()
+            time.sleep(reconnect_interval)
+    finally:
+        writer.close()
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Archive the MiniSEED streams of a ringserver to day files.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--server', default=server,
+        help='DataLink server host:port (default %(default)s).')
+    parser.add_argument('--path', default=path,
+        help='Directory of the day files (default %(default)s).')
+    parser.add_argument('--match', default=match,
+        help='Regular expression of the stream ids to archive, e.g. '
+        '^AM_BCCWA_01_.*/MSEED$ (default %(default)s).')
+    parser.add_argument('--state', default=None,
+        help='State file with the last archived packet (default '
+        'PATH/.datalink_archiver.state).')
+    parser.add_argument('--start', default='LATEST',
+        choices=['EARLIEST', 'LATEST'],
+        help='Where to start without a state file (default %(default)s).')
+    parser.add_argument('--flush-interval', type=float, default=flush_interval,
+        help='Seconds between writes to the files (default %(default)s).')
+    parser.add_argument('--layout', default=None, choices=['flat', 'sds'],
+        help='Archive layout (default: that of the files in PATH, or flat).')
+    args = parser.parse_args()
+
+    n = Archive(args.server, args.path, args.match, args.state, args.start,
+        flush_interval=args.flush_interval, layout=args.layout)
+    print('Archived %d records' % n)
@@ -0,0 +1,271 @@
+# A minimal local DataLink server, for testing datalink_archiver.py without a
+# ringserver.
+#
+# It replays the day files of an archive (flat or SDS, see archive.py) as the
+# 512 byte MiniSEED packets that ew2ringserver would send, in the order of
+# their start times across all of the channels, with packet ids from 1. It
+# supports what the archiver uses: ID, MATCH, POSITION SET and AFTER, and
+# STREAM. ring is the index of the first packet still in the ring; setting the
+# position to an earlier packet, or to a packet with another time, is an
+# error, as when a ringserver has overwritten the packet.
+# Unlike a ringserver, it sends ENDSTREAM at the end of the replay, so tests
+# finish. speed is the replay rate relative to real time; 0 sends the packets
+# as fast as possible. pause stops the replay for that many seconds half way
+# through, like a quiet link, e.g. to test the archiver's idle timeouts.
+#
+# --check replays the files at speed with a pause longer than the archiver's
+# read timeout, archives the stream with datalink_archiver.Archive() and
+# checks that every record was written once. It then resumes from a saved
+# packet that is no longer in the ring, and checks that the archiver goes on
+# from the start of the ring.
+#
+# Example: python datalink_standin.py --path /tmp/mseed --port 16000
+# Then:    python datalink_archiver.py --server localhost:16000 --path /tmp/out
+#              --start EARLIEST
+
+import argparse
+import io
+import re
+import socketserver
+import sys
+import threading
+import time
+
+from obspy import read
+
+sys.path.append('.')
+from archive import ArchiveFiles
+from datalink_archiver import RecordStart
+
+# Defaults
+port = 16000
+record_length = 512
+
+# The packets of the day files in path: a list of (stream id, start time,
+# end time, record), sorted by start time. Times are in microseconds.
+def ReplayPackets(path, pattern='*'):
+    packets = []
+    for f in ArchiveFiles(path, pattern + '.mseed'):
+        for tr in read(f):
+            buf = io.BytesIO()
+            tr.write(buf, format='MSEED', reclen=record_length)
+            data = buf.getvalue()
+            streamid = '%s_%s_%s_%s/MSEED' % (tr.stats.network,
+                tr.stats.station, tr.stats.location, tr.stats.channel)
+            for i in range(0, len(data), record_length):
+                record = data[i:i+record_length]
+                start = int(round(RecordStart(record) * 1e6))
+                packets.append((streamid, start, start, record))
+    packets.sort(key=lambda p: p[1])
+    # The end time of a packet is the start of the next one of its stream.
+    last = {}
+    for i in reversed(range(len(packets))):
+        streamid, start, _, record = packets[i]
+        packets[i] = (streamid, start, last.get(streamid, start), record)
+        last[streamid] = start
+    return packets
+
+class DataLinkHandler(socketserver.StreamRequestHandler):
+    def send(self, header, data=b''):
+        header = header.encode('ascii')
+        self.wfile.write(b'DL' + bytes([len(header)]) + header + data)
+        self.wfile.flush()
+
+    def reply(self, ok, value, message=''):
+        message = message.encode('ascii')
+        self.send('%s %d %d' % ('OK' if ok else 'ERROR', value, len(message)),
+            message)
+
+    # Read one packet. Returns (header words, data), or None at the end.
+    def receive(self):
+        preamble = self.rfile.read(3)
+        if len(preamble) < 3 or preamble[:2] != b'DL':
+            return None
+        words = self.rfile.read(preamble[2]).decode('ascii').split()
+        size = int(words[1]) if words[0] in ('MATCH', 'REJECT') and \
+            len(words) > 1 else 0
+        return words, self.rfile.read(size)
+
+    def handle(self):
+        packets = self.server.packets
+        pattern = None
+        position = 0            # index of the next packet
+        while True:
+            request = self.receive()
+            if request is None:
+                return
+            words, data = request
+            action = words[0].upper()
+            if action == 'ID':
+                self.send('ID DataLink 2018.078 :: DLPROTO:1.0 '
+                    'PACKETSIZE:%d' % record_length)
+            elif action == 'MATCH':
+                try:
+                    pattern = re.compile(data.decode('ascii'))
+                    self.reply(True, 0, 'Matching streams')
+                except re.error as e:
+                    self.reply(False, 0, 'Bad pattern: %s' % e)
+            elif action == 'POSITION' and len(words) >= 3:
+                value = self.position(words[1].upper(), words[2:])
+                if value is None:
+                    self.reply(False, 0, 'Packet not found')
+                else:
+                    position = value
+                    self.reply(True, position + 1, 'Positioned')
+            elif action == 'STREAM':
+                self.stream(position, pattern)
+                return
+            else:
+                self.reply(False, 0, 'Unsupported command')
+
+    # The index of the next packet for POSITION SET or AFTER, or None if the
+    # packet is not in the ring.
+    def position(self, how, values):
+        packets = self.server.packets
+        ring = self.server.ring
+        value = values[0].upper()
+        if how == 'AFTER':
+            after = int(value)
+            for i in range(ring, len(packets)):
+                if packets[i][1] > after:
+                    return i
+            return None
+        if value == 'EARLIEST':
+            return ring
+        if value == 'LATEST':
+            return len(packets)
+        # Packet ids are the index + 1. Start after the packet.
+        i = int(value) - 1
+        if not ring <= i < len(packets) or (len(values) > 1 and
+                int(values[1]) != packets[i][1]):
+            return None
+        return i + 1
+
+    def stream(self, position, pattern):
+        packets = self.server.packets
+        speed = self.server.speed
+        t0 = time.monotonic()
+        first = packets[position][1] if position < len(packets) else 0
+        pause = self.server.pause
+        for i in range(position, len(packets)):
+            streamid, start, end, record = packets[i]
+            if pattern and not pattern.search(streamid):
+                continue
+            if pause and i >= len(packets) // 2:
+                time.sleep(pause)
+                t0 += pause
+                pause = 0.0
+            if speed:
+                delay = (start - first) / 1e6 / speed - (time.monotonic() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+            self.send('PACKET %s %d %d %d %d %d' % (streamid, i + 1, start,
+                start, end, len(record)), record)
+        self.send('ENDSTREAM')
+
+class DataLinkStandin(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, path, host='localhost', port=port, speed=0.0,
+            pattern='*', pause=0.0):
+        self.packets = ReplayPackets(path, pattern)
+        self.speed = speed
+        self.pause = pause
+        self.ring = 0
+        super().__init__((host, port), DataLinkHandler)
+
+# Start a server in a background thread. Returns the server; call shutdown()
+# to stop it. Use port 0 to pick any free port, then see server_address.
+def StartDataLinkStandin(path, host='localhost', port=port, speed=0.0,
+        pattern='*', pause=0.0):
+    server = DataLinkStandin(path, host, port, speed, pattern, pause)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+# The records in the day files under path, in any order.
+def _ArchivedRecords(path):
+    records = []
+    for f in ArchiveFiles(path):
+        with open(f, 'rb') as fp:
+            data = fp.read()
+        records += [data[i:i+record_length] for i in range(0, len(data),
+            record_length)]
+    return records
+
+# Replay the files in path in about duration seconds, with a pause longer than
+# the archiver's read timeout half way through, and archive the stream to a
+# temporary directory. Then resume from a saved packet that the ring no longer
+# holds. Returns True if each record was archived once, and the resumed
+# archive has the records from the start of the ring.
+def CheckArchiver(path, pattern='*', duration=2.0, pause=2.5):
+    import os
+    import shutil
+    import tempfile
+    from datalink_archiver import Archive, WriteState
+    server = StartDataLinkStandin(path, port=0, pattern=pattern, pause=pause)
+    address = 'localhost:%d' % server.server_address[1]
+    packets = server.packets
+    server.speed = max((packets[-1][1] - packets[0][1]) / 1e6 / duration,
+        1.0) if packets else 1.0
+    out = tempfile.mkdtemp()
+    resumed = tempfile.mkdtemp()
+    try:
+        n = Archive(address, out, start='EARLIEST', reconnect=False)
+        archived = _ArchivedRecords(out)
+        print('Replayed %d packets at speed %g with a %g s pause, archived '
+            '%d records' % (len(packets), server.speed, pause, n))
+
+        # The ring has lost the first half, and the saved packet with it.
+        server.speed = 0.0
+        server.pause = 0.0
+        server.ring = len(packets) // 2
+        saved = server.ring // 2
+        WriteState(os.path.join(resumed, '.datalink_archiver.state'),
+            saved + 1, packets[saved][1])
+        n = Archive(address, resumed, start='LATEST', reconnect=False)
+        lost = _ArchivedRecords(resumed)
+        print('Resumed from packet %d with the ring from packet %d, archived '
+            '%d records' % (saved + 1, server.ring + 1, n))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(out)
+        shutil.rmtree(resumed)
+    return sorted(archived) == sorted(p[3] for p in packets) and \
+        sorted(lost) == sorted(p[3] for p in packets[server.ring:])
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Replay MiniSEED day files as a DataLink stream.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--path', required=True,
+        help='Directory of the day files.')
+    parser.add_argument('--files', default='*',
+        help='Glob pattern of the day files to replay, without .mseed '
+        '(default all).')
+    parser.add_argument('--host', default='localhost',
+        help='Address to listen on (default %(default)s).')
+    parser.add_argument('--port', type=int, default=port,
+        help='Port to listen on (default %(default)s).')
+    parser.add_argument('--speed', type=float, default=0.0,
+        help='Replay speed relative to real time (default as fast as '
+        'possible).')
+    parser.add_argument('--check', action='store_true',
+        help='Archive a replay with a pause, and a resume from a packet that '
+        'is no longer in the ring, using datalink_archiver.py, check the '
+        'records and exit.')
+    args = parser.parse_args()
+
+    if args.check:
+        ok = CheckArchiver(args.path, args.files)
+        print('OK' if ok else 'FAILED')
+        sys.exit(0 if ok else 1)
+
+    with DataLinkStandin(args.path, args.host, args.port, args.speed,
+            args.files) as server:
+        print('Replaying %d packets from %s on port %d' % (len(server.packets),
+            args.path, server.server_address[1]))
+        server.serve_forever()
@@ -0,0 +1,180 @@
+# Filter designs shared by the plotting scripts.
+#
+# Each filter is designed once for a given set of parameters and cached, in
+# memory for the life of the process and on disk across runs, so every script
+# that asks for e.g. an 8 pole 0.07 Hz low-pass at 100 sps gets exactly the same
+# coefficients. Long FIR filters in particular are slow to design.
+#
+# The disk cache is in ~/.cache/seismo/filters, or $SEISMO_CACHE_DIR/filters.
+# Entries never go stale since they are keyed by all of the design parameters
+# (and the scipy version), so the directory can be deleted at any time.
+
+import hashlib
+import os
+import numpy as np
+
+# In memory cache of designs, keyed by the design parameters.
+_designs = {}
+
+# Directory for the on-disk cache.
+def CacheDir():
+    base = os.environ.get('SEISMO_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'seismo'))
+    return os.path.join(base, 'filters')
+
+# Return the cached design for key, or call design() to create it. The design
+# is a tuple of numpy arrays, shared by all callers, so don't modify them.
+# (They aren't made read-only because sosfilt() won't accept that.)
+def _Cached(key, design):
+    if key in _designs:
+        return _designs[key]
+
+    import scipy
+    name = hashlib.sha1(repr((key, scipy.__version__)).encode()).hexdigest()
+    fname = os.path.join(CacheDir(), name + '.npz')
+    result = None
+    try:
+        with np.load(fname) as f:
+            result = tuple(f['arr_%d' % i] for i in range(len(f.files)))
+    except Exception:
+        pass
+
+    if result is None:
+        result = design()
+        try:
+            # Write to a temporary file and rename, so that other processes
+            # never read a partial file.
+            os.makedirs(CacheDir(), exist_ok=True)
+            tmp = '%s.%d.tmp.npz' % (fname[:-4], os.getpid())
+            np.savez(tmp, *result)
+            os.replace(tmp, fname)
+        except OSError as e:
+            print('Unable to cache filter design:', e)
+
+    _designs[key] = result
+    return result
+
+################################################################################
+
+# Design a Butterworth filter the same way obspy's filter() does. Returns the
+# second order sections and the normalized corner frequencies.
+# type is 'bandpass', 'highpass' or 'lowpass', df is the sampling rate.
+def ButterworthSos(type, df, corners=4, freq=None, freqmin=None, freqmax=None):
+    fe = 0.5 * df
+    if type == 'bandpass':
+        low = freqmin / fe
+        high = freqmax / fe
+        if high - 1.0 > -1e-6:
+            print('Selected high corner frequency (%s) of bandpass is at or '
+                  'above Nyquist (%s). Applying a high-pass instead.' %
+                  (freqmax, fe))
+            return ButterworthSos('highpass', df, corners, freq=freqmin)
+        if low > 1:
+            raise ValueError('Selected low corner frequency is above Nyquist.')
+        wn = (low, high)
+    elif type == 'highpass':
+        wn = freq / fe
+        if wn > 1:
+            raise ValueError('Selected corner frequency is above Nyquist.')
+    elif type == 'lowpass':
+        wn = freq / fe
+        if wn > 1:
+            wn = 1.0
+            print('Selected corner frequency is above Nyquist. Setting '
+                  'Nyquist as high corner.')
+    else:
+        raise ValueError('Unsupported filter type: %s' % type)
+
+    def design():
+        from scipy.signal import iirfilter, zpk2sos
+        z, p, k = iirfilter(corners, wn, btype=type, ftype='butter',
+            output='zpk')
+        return zpk2sos(z, p, k), np.atleast_1d(wn)
+    return _Cached(('butter', type, corners, wn), design)
+
+# Design a linear phase FIR filter with the window method. Give lowpass and/or
+# highpass corners in Hz; with both, the result is a bandpass filter. numtaps
+# must be odd. fs is the sampling rate.
+def FirFilter(numtaps, fs, lowpass=None, highpass=None,
+        window='blackmanharris'):
+    if not lowpass and not highpass:
+        raise ValueError('Need a lowpass and/or highpass corner.')
+    if numtaps % 2 == 0:
+        raise ValueError('FIR filters need an odd number of taps.')
+
+    def design():
+        from scipy.signal import firwin
+        n = numtaps
+        delta = np.zeros(n)
+        delta[n//2] = 1.0
+        a = np.zeros(n)
+        b = np.zeros(n)
+        # Lowpass filter
+        if lowpass:
+            a = firwin(n, cutoff=lowpass/(fs/2), window=window)
+        # Highpass filter with spectral inversion
+        if highpass:
+            b = delta - firwin(n, cutoff=highpass/(fs/2), window=window)
+        if lowpass and highpass:
+            # Combine into a bandpass filter
+            return (delta - (a+b),)
+        return (a+b,)
+    return _Cached(('fir', numtaps, fs, lowpass, highpass, window), design)[0]
+
+# FIR lowpass filter to apply before decimating by factor. The corner is at
+# 90% of the new Nyquist frequency.
+def DecimationFir(factor, numtaps, window='blackmanharris'):
+    def design():
+        from scipy.signal import firwin
+        return (firwin(numtaps, cutoff=0.9/factor, window=window),)
+    return _Cached(('decimate', factor, numtaps, window), design)[0]
+
+# FIR lowpass filter for resampling by up/down with a polyphase filter, with
+# taps_per_phase taps in each of the up phases. The corner is at 90% of the
+# lower of the two Nyquist frequencies, and the gain is up.
+def ResamplingFir(up, down, taps_per_phase=16, window='blackmanharris'):
+    def design():
+        from scipy.signal import firwin
+        numtaps = taps_per_phase * up + 1
+        return (up * firwin(numtaps, cutoff=0.9/max(up, down),
+            window=window),)
+    return _Cached(('resample', up, down, taps_per_phase, window), design)[0]
+
+################################################################################
+
+# Frequency response of a filter, either second order sections (from
+# ButterworthSos) or FIR coefficients. Returns (frequency in Hz, complex
+# response). With zerophase, the response of the filter applied forwards and
+# backwards, as the plotting scripts do.
+def FrequencyResponse(coef, fs, n=4096, zerophase=False):
+    from scipy.signal import freqz, sosfreqz
+    coef = np.asarray(coef)
+    if coef.ndim == 2:
+        w, h = sosfreqz(coef, worN=n, fs=fs)
+    else:
+        w, h = freqz(coef, 1, worN=n, fs=fs)
+    if zerophase:
+        h = np.abs(h)**2 + 0j
+    return w, h
+
+# Plot frequency and phase response
+def PlotResponse(coef, fs, n=4096, zerophase=False, title=None):
+    import matplotlib.pyplot as plt
+    w, h = FrequencyResponse(coef, fs, n=n, zerophase=zerophase)
+    with np.errstate(divide='ignore'):
+        h_dB = 20 * np.log10(np.abs(h))
+    fig = plt.figure()
+    plt.subplot(211)
+    plt.plot(w, h_dB)
+    plt.ylim(-150, 5)
+    plt.ylabel('Magnitude (db)')
+    plt.xlabel('Frequency (Hz)')
+    plt.title(title if title else 'Frequency response')
+    plt.subplot(212)
+    h_Phase = np.unwrap(np.angle(h))
+    plt.plot(w, h_Phase)
+    plt.ylabel('Phase (radians)')
+    plt.xlabel('Frequency (Hz)')
+    plt.title('Phase response')
+    plt.subplots_adjust(hspace=0.5)
+    return fig
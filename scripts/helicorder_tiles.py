@@ -0,0 +1,597 @@
+# Zoomable helicorder and spectrogram tiles, and a local viewer.
+#
+# Each day of a channel is drawn as a map of 256 x 256 pixel PNG tiles, like
+# a slippy map: zoom z has 2^z x 2^z tiles, each zoom doubling the resolution.
+#   helicorder views    24 lines of one hour (like Helicorder()), filtered as
+#                       in plot_helicorders_and_spectrum.py and scaled by the
+#                       station's scale per line in stations.json
+#   spectrogram view    time of day across, frequency up
+# The tiles are drawn from a summary of each day and view, not from the data:
+# the minimum and maximum of the filtered data under each pixel column at
+# every zoom (in units of the line spacing), or the spectrogram in dB. A
+# summary is made once per day file change. Tiles up to prerender_zoom are
+# drawn when the summary is made; deeper tiles are drawn on request by the
+# server and kept. When a day changes (e.g. today), only the tiles whose part
+# of the summary changed are drawn again.
+#
+# Layout: TILES/NET.STA.LOC.CHAN/YYYY-MM-DD/summary_VIEW.npz
+#         TILES/NET.STA.LOC.CHAN/YYYY-MM-DD/VIEW/Z/X/Y.png
+#
+# Example: python helicorder_tiles.py --station BCCWA --days 3 --serve
+# Then open http://localhost:8000/ in a browser. Drag to pan, scroll to zoom.
+
+import argparse
+import http.server
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import urllib.parse
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append('.')
+import archive
+
+# Defaults
+tiles_path = '/data/seismometer_data/tiles'
+config_file = 'stations.json'
+port = 8000
+tile_size = 256
+max_zoom = 7            # 0.11 s per pixel
+prerender_zoom = 3      # 85 tiles per view and day
+rows_per_day = 24       # helicorder lines of one hour
+reach = 2.0             # helicorder traces are clipped at 2 line spacings
+
+# Views, with the filters of plot_helicorders_and_spectrum.py. scale is the
+# key of the scale per line in the station config.
+views = {
+    'broadband': {'type': 'helicorder', 'freqmin': 0.002, 'freqmax': 25.0,
+        'scale': 'scale_broadband_helicorder_line'},
+    'microseism': {'type': 'helicorder', 'freqmin': 0.15, 'freqmax': 0.5,
+        'scale': 'scale_microseism_helicorder_line'},
+    'teleseismic': {'type': 'helicorder', 'freqmin': 0.015, 'freqmax': 0.07,
+        'scale': 'scale_teleseismic_helicorder_line'},
+    'spectrogram': {'type': 'spectrogram', 'freqmin': 0.1, 'freqmax': 25.0,
+        'wlen': 30.0},
+}
+
+# Line colors, as obspy's dayplot.
+colors = np.array([(0, 0, 0), (255, 0, 0), (0, 0, 255), (0, 128, 0)],
+    dtype=np.uint8)
+missing_color = (224, 224, 224)
+
+################################################################################
+# Summaries.
+
+# Identify the day files of a day, so that changed days are summarised again.
+def _Signature(files):
+    signature = []
+    for f in files:
+        s = os.stat(f)
+        signature.append('%s:%d:%d' % (os.path.basename(f), s.st_size,
+            int(s.st_mtime)))
+    return ' '.join(signature)
+
+def _DayDir(tiles, seed_id, day):
+    return os.path.join(tiles, seed_id, str(day.date))
+
+def _SummaryFile(tiles, seed_id, day, view):
+    return os.path.join(_DayDir(tiles, seed_id, day), 'summary_%s.npz' % view)
+
+def _TileFile(tiles, seed_id, day, view, z, x, y):
+    return os.path.join(_DayDir(tiles, seed_id, day), view, str(z), str(x),
+        '%d.png' % y)
+
+def LoadSummary(filename):
+    try:
+        with np.load(filename) as f:
+            return {k: f[k] for k in f.files}
+    except (OSError, ValueError):
+        return None
+
+def _Save(filename, write):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, filename)
+
+# Minimum and maximum of the filtered data of a day under each pixel column,
+# at each zoom, in units of counts_per_line. Returns a dict of 'minZ', 'maxZ'
+# arrays (rows_per_day * tile_size * 2^Z) of float16, NaN where there is no
+# data.
+def HelicorderSummary(st, day, freqmin, freqmax, counts_per_line):
+    from obspy_helpers import FilterData
+    width = rows_per_day * (tile_size << max_zoom)
+    seconds = 86400.0 / width               # per column at max_zoom
+    lo = np.full(width, np.nan)
+    hi = np.full(width, np.nan)
+    for tr in st:
+        # As Helicorder(): demean, 2nd order high-pass, 8th order low-pass.
+        fs = tr.stats.sampling_rate
+        data = tr.data - tr.data.mean(dtype=np.float64)
+        data = FilterData(data, 'highpass', fs, freq=freqmin, corners=2,
+            zerophase=True, dtype=np.float64)
+        if freqmax < fs / 2:
+            data = FilterData(data, 'lowpass', fs, freq=freqmax, corners=8,
+                zerophase=True, dtype=np.float64)
+        t = (tr.stats.starttime - day) + np.arange(len(data)) / fs
+        inside = (t >= 0) & (t < 86400)
+        if not inside.any():
+            continue
+        columns = (t[inside] / seconds).astype(np.int64)
+        data = data[inside] / counts_per_line
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(columns)) + 1])
+        c = columns[starts]
+        lo[c] = np.fmin(lo[c], np.minimum.reduceat(data, starts))
+        hi[c] = np.fmax(hi[c], np.maximum.reduceat(data, starts))
+    summary = {}
+    for z in range(max_zoom, -1, -1):
+        summary['min%d' % z] = np.clip(lo, -1000, 1000).astype(np.float16)
+        summary['max%d' % z] = np.clip(hi, -1000, 1000).astype(np.float16)
+        # Pairs of columns are in the same line, since the width is even.
+        with np.errstate(invalid='ignore'):
+            lo = np.fmin(lo[0::2], lo[1::2])
+            hi = np.fmax(hi[0::2], hi[1::2])
+    return summary
+
+# Spectrogram of a day in dB, one column per wlen seconds, and the color
+# range. Returns a dict of 'db' (columns, frequencies) float16, 'freqs',
+# 'range'.
+def SpectrogramSummary(seed_id, day, freqmin, freqmax, wlen, path):
+    from band_power import DayRollingPsds
+    columns = int(round(86400 / wlen))
+    db = None
+    # A lowest frequency of 4 / wlen makes the FFT one window long.
+    for times, psds, freqs in DayRollingPsds(seed_id, day, wlen, path=path,
+            fmin=4.0 / wlen):
+        keep = (freqs >= freqmin) & (freqs <= freqmax)
+        if db is None:
+            f = freqs[keep]
+            db = np.full((columns, len(f)), np.nan, dtype=np.float32)
+        if keep.sum() != db.shape[1]:
+            continue        # a different sampling rate
+        i = np.array([int(round((t - day) / wlen)) for t in times])
+        with np.errstate(divide='ignore'):
+            db[i] = 10 * np.log10(psds[:, keep])
+    if db is None:
+        return None
+    finite = db[np.isfinite(db)]
+    color_range = np.percentile(finite, [2, 99.8]) if len(finite) else \
+        np.array([0.0, 1.0])
+    return {'db': db.astype(np.float16), 'freqs': f, 'range': color_range}
+
+################################################################################
+# Tiles.
+
+# The part of a summary that a tile shows, for drawing it and for finding
+# out whether it changed.
+def TileData(summary, view, z, x, y):
+    w = tile_size << z
+    if views[view]['type'] == 'helicorder':
+        h = w / rows_per_day            # line spacing in pixels
+        first = max(int((y * tile_size - reach * h) // h), 0)
+        last = min(int(((y + 1) * tile_size + reach * h) // h),
+            rows_per_day - 1)
+        columns = slice(x * tile_size, (x + 1) * tile_size)
+        lo = summary['min%d' % z].reshape(rows_per_day, w)
+        hi = summary['max%d' % z].reshape(rows_per_day, w)
+        return (np.array(first), lo[first:last + 1, columns],
+            hi[first:last + 1, columns])
+    db = summary['db']
+    freqs = summary['freqs']
+    # Time columns of the spectrogram, and frequency rows from the top.
+    pixels = np.arange(tile_size) + 0.5
+    c = ((x * tile_size + pixels) * db.shape[0] / w).astype(int)
+    f = freqs[-1] - (y * tile_size + pixels) / w * (freqs[-1] - freqs[0])
+    r = np.clip(np.searchsorted(freqs, f), 0, len(freqs) - 1)
+    return (db[c][:, r].T, summary['range'])
+
+def _Changed(old, new):
+    return any(a.shape != b.shape or not np.array_equal(a, b, equal_nan=True)
+        for a, b in zip(old, new))
+
+# Draw a tile. Returns an RGB array (tile_size, tile_size, 3).
+def DrawTile(view, z, y, data):
+    image = np.empty((tile_size, tile_size, 3), dtype=np.uint8)
+    if views[view]['type'] == 'helicorder':
+        first, lo, hi = data
+        image[:] = 255
+        h = (tile_size << z) / rows_per_day
+        rows = np.arange(tile_size)[:, None] + y * tile_size
+        for i in range(lo.shape[0]):
+            line = int(first) + i
+            center = (line + 0.5) * h
+            top = np.floor(center - np.clip(hi[i].astype(float), -reach,
+                reach) * h)
+            bottom = np.floor(center - np.clip(lo[i].astype(float), -reach,
+                reach) * h)
+            image[(rows >= top) & (rows <= bottom)] = colors[line %
+                len(colors)]
+        return image
+    db, (vmin, vmax) = data
+    level = np.clip((db.astype(float) - vmin) / (vmax - vmin), 0, 1)
+    image[:] = _Colormap()[np.nan_to_num(level * 255).astype(int)]
+    image[~np.isfinite(db)] = missing_color
+    return image
+
+_colormap = None
+def _Colormap():
+    global _colormap
+    if _colormap is None:
+        import matplotlib
+        _colormap = (matplotlib.colormaps['viridis'](np.linspace(0, 1, 256))
+            [:, :3] * 255).astype(np.uint8)
+    return _colormap
+
+# Encode an RGB array as PNG.
+def EncodePng(image):
+    h, w, _ = image.shape
+    raw = np.zeros((h, w * 3 + 1), dtype=np.uint8)    # filter byte 0
+    raw[:, 1:] = image.reshape(h, w * 3)
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + \
+            struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    return b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b'')
+
+def _WriteTile(filename, image):
+    png = EncodePng(image)
+    _Save(filename, lambda f: f.write(png))
+    return png
+
+################################################################################
+# Updating the tiles.
+
+# Make the summary of one day and view of a station if its day files changed,
+# and draw the tiles that changed. Returns the number of tiles drawn.
+def UpdateDay(tiles, station, day, view, path=None):
+    from obspy import UTCDateTime
+    from obspy_helpers import GetLocalDataRange, FilterPadding
+    path = path or archive.path
+    day = UTCDateTime(day)
+    net, sta, loc, chan = (station['net'], station['station'], station['loc'],
+        station['chan'])
+    seed_id = '%s.%s.%s.%s' % (net, sta, loc, chan)
+    files = archive.DayFiles(net, sta, loc, chan, day, day, path)
+    if not files:
+        return 0
+    filename = _SummaryFile(tiles, seed_id, day, view)
+    signature = _Signature(files)
+    old = LoadSummary(filename)
+    if old is not None and str(old['signature']) == signature:
+        return 0
+
+    v = views[view]
+    if v['type'] == 'helicorder':
+        padding = FilterPadding(v['freqmin'], v['freqmax'])
+        st = GetLocalDataRange(net, sta, loc, chan, day - padding,
+            day + 86400 + padding, path).merge().split()
+        summary = HelicorderSummary(st, day, v['freqmin'], v['freqmax'],
+            station[v['scale']] / station['units'])
+    else:
+        summary = SpectrogramSummary(seed_id, day, v['freqmin'],
+            v['freqmax'], v['wlen'], path)
+    if summary is None:
+        return 0
+    summary['signature'] = np.array(signature)
+    _Save(filename, lambda f: np.savez(f, **summary))
+
+    drawn = 0
+    for z in range(prerender_zoom + 1):
+        for x in range(1 << z):
+            for y in range(1 << z):
+                data = TileData(summary, view, z, x, y)
+                tile = _TileFile(tiles, seed_id, day, view, z, x, y)
+                if old is None or not os.path.exists(tile) or \
+                        _Changed(TileData(old, view, z, x, y), data):
+                    _WriteTile(tile, DrawTile(view, z, y, data))
+                    drawn += 1
+    # Deeper tiles are drawn again when they are next requested.
+    for z in range(prerender_zoom + 1, max_zoom + 1):
+        directory = os.path.join(_DayDir(tiles, seed_id, day), view, str(z))
+        if old is None:
+            shutil.rmtree(directory, ignore_errors=True)
+            continue
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                x = int(os.path.basename(root))
+                y = int(name.split('.')[0])
+                if _Changed(TileData(old, view, z, x, y),
+                        TileData(summary, view, z, x, y)):
+                    os.remove(os.path.join(root, name))
+    return drawn
+
+def _UpdateDay(job):
+    try:
+        return UpdateDay(*job)
+    except Exception as e:
+        print('Failed %s %s %s: %r' % (job[1]['name'], job[2].date, job[3],
+            e))
+        return 0
+
+# Update the tiles of the stations for the days from starttime to endtime.
+def UpdateTiles(tiles, stations, starttime, endtime, view_names=None,
+        path=None, processes=None):
+    from obspy import UTCDateTime
+    jobs = []
+    for s in stations:
+        for year, doy in archive.Days(starttime, endtime):
+            for view in view_names or views:
+                jobs.append((tiles, s, UTCDateTime(year=year, julday=doy),
+                    view, path))
+    if processes == 1 or len(jobs) <= 1:
+        return sum(map(_UpdateDay, jobs))
+    with Pool(processes) as pool:
+        return sum(pool.imap_unordered(_UpdateDay, jobs))
+
+################################################################################
+# Viewer.
+
+_summaries = {}         # summary file -> (mtime, summary)
+
+# PNG of a tile, drawn if it isn't there yet. Returns None if there is no
+# such tile.
+def TileBytes(tiles, seed_id, view, date, z, x, y):
+    from obspy import UTCDateTime
+    if view not in views or not 0 <= z <= max_zoom or \
+            not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        return None
+    day = UTCDateTime(date)
+    tile = _TileFile(tiles, seed_id, day, view, z, x, y)
+    try:
+        with open(tile, 'rb') as f:
+            return f.read()
+    except OSError:
+        pass
+    filename = _SummaryFile(tiles, seed_id, day, view)
+    try:
+        mtime = os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+    if filename not in _summaries or _summaries[filename][0] != mtime:
+        if len(_summaries) >= 8:
+            _summaries.pop(next(iter(_summaries)))
+        _summaries[filename] = (mtime, LoadSummary(filename))
+    summary = _summaries[filename][1]
+    if summary is None:
+        return None
+    return _WriteTile(tile, DrawTile(view, z, y, TileData(summary, view, z,
+        x, y)))
+
+# The channels in the tile directory, with their views and days.
+def TileIndex(tiles):
+    index = {'tile_size': tile_size, 'max_zoom': max_zoom,
+        'rows_per_day': rows_per_day, 'views': views, 'channels': {}}
+    try:
+        channels = sorted(os.listdir(tiles))
+    except OSError:
+        channels = []
+    for seed_id in channels:
+        days = sorted(d for d in os.listdir(os.path.join(tiles, seed_id))
+            if re.match(r'^\d{4}-\d{2}-\d{2}$', d))
+        if days:
+            index['channels'][seed_id] = days
+    return index
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    tile_pattern = re.compile(r'^/tiles/([\w.-]+)/(\w+)/(\d{4}-\d{2}-\d{2})/'
+        r'(\d+)/(\d+)/(\d+)\.png$')
+
+    def send(self, data, content_type, cache=False):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if cache:
+            self.send_header('Cache-Control', 'max-age=60')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path in ('/', '/index.html'):
+            self.send(viewer_html.encode('utf-8'), 'text/html; charset=utf-8')
+            return
+        if path == '/index.json':
+            self.send(json.dumps(TileIndex(self.server.tiles)).encode(),
+                'application/json')
+            return
+        m = self.tile_pattern.match(path)
+        png = None
+        if m:
+            seed_id, view, date = m.group(1, 2, 3)
+            z, x, y = (int(g) for g in m.group(4, 5, 6))
+            png = TileBytes(self.server.tiles, seed_id, view, date, z, x, y)
+        if png is None:
+            self.send_error(404)
+        else:
+            self.send(png, 'image/png', cache=True)
+
+    def log_message(self, format, *args):
+        pass
+
+class TileServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tiles, host='localhost', port=port):
+        self.tiles = tiles
+        super().__init__((host, port), TileHandler)
+
+viewer_html = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Helicorders</title>
+<style>
+body { margin: 0; font-family: sans-serif; font-size: 14px; }
+#bar { height: 32px; padding: 4px 8px; box-sizing: border-box;
+  background: #eee; }
+#map { position: absolute; top: 32px; bottom: 0; left: 0; right: 0;
+  overflow: hidden; cursor: grab; background: #f8f8f8; }
+#map img { position: absolute; width: 256px; height: 256px;
+  user-select: none; -webkit-user-drag: none; }
+</style></head>
+<body>
+<div id="bar">
+<select id="channel"></select> <select id="view"></select>
+<select id="day"></select> <span id="status"></span>
+</div>
+<div id="map"></div>
+<script>
+var index, tiles = {}, zoom = 0, left = 0, top_ = 0, drag = null;
+var map = document.getElementById('map');
+var channel = document.getElementById('channel');
+var view = document.getElementById('view');
+var day = document.getElementById('day');
+var status_ = document.getElementById('status');
+
+function options(select, values) {
+  var current = select.value;
+  select.innerHTML = '';
+  values.forEach(function(v) { select.add(new Option(v, v)); });
+  if (values.indexOf(current) >= 0) select.value = current;
+  else if (select === day) select.value = values[values.length - 1];
+}
+
+function draw() {
+  var size = index.tile_size, n = 1 << zoom, keep = {};
+  var prefix = '/tiles/' + channel.value + '/' + view.value + '/' +
+    day.value + '/' + zoom + '/';
+  for (var y = Math.max(Math.floor(top_ / size), 0); y < n &&
+      y * size < top_ + map.clientHeight; y++) {
+    for (var x = Math.max(Math.floor(left / size), 0); x < n &&
+        x * size < left + map.clientWidth; x++) {
+      var url = prefix + x + '/' + y + '.png';
+      var img = tiles[url];
+      if (!img) {
+        img = new Image();
+        img.src = url;
+        map.appendChild(img);
+      }
+      img.style.left = (x * size - left) + 'px';
+      img.style.top = (y * size - top_) + 'px';
+      keep[url] = img;
+    }
+  }
+  for (var url in tiles)
+    if (!keep[url]) map.removeChild(tiles[url]);
+  tiles = keep;
+}
+
+function reset() {
+  options(day, index.channels[channel.value] || []);
+  zoom = 0; left = -Math.max((map.clientWidth - index.tile_size) / 2, 0);
+  top_ = 0;
+  draw();
+}
+
+// Time (and frequency) under the mouse.
+function describe(px, py) {
+  var w = index.tile_size << zoom, x = left + px, y = top_ + py;
+  if (x < 0 || y < 0 || x >= w || y >= w) return '';
+  var v = index.views[view.value], seconds, text = '';
+  if (v.type == 'helicorder') {
+    var line = Math.floor(y / (w / index.rows_per_day));
+    seconds = (line + x / w) * 86400 / index.rows_per_day;
+  } else {
+    seconds = x / w * 86400;
+    text = ' ' + (v.freqmax - y / w * (v.freqmax - v.freqmin)).toFixed(2) +
+      ' Hz';
+  }
+  return new Date(Date.parse(day.value + 'T00:00:00Z') + seconds * 1000)
+    .toISOString().substr(11, 11) + ' UTC' + text;
+}
+
+map.onmousedown = function(e) {
+  drag = [e.clientX, e.clientY]; map.style.cursor = 'grabbing';
+};
+window.onmouseup = function() { drag = null; map.style.cursor = 'grab'; };
+map.onmousemove = function(e) {
+  var r = map.getBoundingClientRect();
+  status_.textContent = describe(e.clientX - r.left, e.clientY - r.top);
+  if (!drag) return;
+  left -= e.clientX - drag[0]; top_ -= e.clientY - drag[1];
+  drag = [e.clientX, e.clientY];
+  draw();
+};
+map.onwheel = function(e) {
+  e.preventDefault();
+  var z = Math.min(Math.max(zoom + (e.deltaY < 0 ? 1 : -1), 0),
+    index.max_zoom);
+  if (z == zoom) return;
+  var r = map.getBoundingClientRect(), f = Math.pow(2, z - zoom);
+  var px = e.clientX - r.left, py = e.clientY - r.top;
+  left = (left + px) * f - px; top_ = (top_ + py) * f - py;
+  zoom = z;
+  draw();
+};
+window.onresize = draw;
+channel.onchange = reset;
+view.onchange = day.onchange = function() { draw(); };
+
+fetch('/index.json').then(function(r) { return r.json(); }).then(
+  function(i) {
+    index = i;
+    options(channel, Object.keys(index.channels));
+    options(view, Object.keys(index.views));
+    reset();
+  });
+</script>
+</body></html>
+'''
+
+################################################################################
+
+if __name__ == '__main__':
+    from obspy import UTCDateTime
+    from plot_helicorders_and_spectrum import LoadStations
+    desc = 'Draw zoomable helicorder and spectrogram tiles of the stations ' \
+        'in the station config file, and serve them to a browser.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--config', default=config_file,
+        help='Station config file (default %(default)s).')
+    parser.add_argument('--station', action='append', default=None,
+        help='Station name in the config file. May be repeated (default all '
+        'enabled stations).')
+    parser.add_argument('--path', default=archive.path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--tiles', default=tiles_path,
+        help='Directory of the tiles (default %(default)s).')
+    parser.add_argument('--view', action='append', default=None,
+        choices=list(views),
+        help='View to draw. May be repeated (default all).')
+    parser.add_argument('--days', type=int, default=1,
+        help='Number of days up to today to update (default %(default)s).')
+    parser.add_argument('--starttime', default=None,
+        help='First day to update, instead of --days.')
+    parser.add_argument('--endtime', default=None,
+        help='Last day to update (default today).')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of days to draw in parallel (default number of CPUs).')
+    parser.add_argument('--serve', action='store_true',
+        help='Serve the tiles and the viewer.')
+    parser.add_argument('--no_update', action='store_true',
+        help='Only serve the tiles that are there.')
+    parser.add_argument('--host', default='localhost',
+        help='Address to serve on (default %(default)s).')
+    parser.add_argument('--port', type=int, default=port,
+        help='Port to serve on (default %(default)s).')
+    args = parser.parse_args()
+
+    if not args.no_update:
+        config, stations = LoadStations(args.config, args.station)
+        endtime = UTCDateTime(args.endtime) if args.endtime else UTCDateTime()
+        starttime = UTCDateTime(args.starttime) if args.starttime else \
+            endtime - (args.days - 1) * 86400
+        n = UpdateTiles(args.tiles, stations, starttime, endtime, args.view,
+            args.path, args.processes)
+        print('Drew %d tiles' % n)
+
+    if args.serve:
+        with TileServer(args.tiles, args.host, args.port) as server:
+            print('Serving %s on http://%s:%d/' % (args.tiles, args.host,
+                server.server_address[1]))
+            server.serve_forever()
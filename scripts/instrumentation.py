@@ -0,0 +1,201 @@
+# Per-stage timing and memory instrumentation for the plotting scripts.
+#
+# The helpers in obspy_helpers are decorated with @Traced, and code can mark
+# its own stages with 'with Stage(name):'. When tracing is enabled, each stage
+# appends one JSON line to the trace file with:
+#   run, pid        the run id (shared by the worker processes) and process
+#   stage, label    the stage name, and e.g. the plot filename
+#   start           UTC start time
+#   wall, cpu       seconds. cpu includes finished child processes.
+#   peak_rss_mb     peak resident memory during the stage, in MB
+#   parent          the enclosing stage, if any
+# plus stage specific counts such as traces, samples, bytes and events, and
+# error if the stage raised an exception.
+#
+# Tracing is off unless StartTrace() is called, or $SEISMO_TRACE names the
+# trace file. When off, the decorators cost one function call.
+#
+# Summarize a trace: python instrumentation.py trace.jsonl
+
+import functools
+import json
+import os
+import resource
+import time
+
+_trace_file = None
+_run = None
+_stack = []         # open stages in this process
+
+# Start appending stage records to filename. The run id defaults to the start
+# time and pid. Child processes inherit the settings through the environment.
+def StartTrace(filename, run=None):
+    global _trace_file, _run
+    if run is None:
+        run = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()) + \
+            '-%d' % os.getpid()
+    _trace_file = filename
+    _run = run
+    os.environ['SEISMO_TRACE'] = filename
+    os.environ['SEISMO_TRACE_RUN'] = run
+
+def TraceEnabled():
+    return _trace_file is not None
+
+if os.environ.get('SEISMO_TRACE'):
+    StartTrace(os.environ['SEISMO_TRACE'], os.environ.get('SEISMO_TRACE_RUN'))
+
+# Current peak RSS (VmHWM) in kB, or ru_maxrss if /proc isn't available.
+def _PeakRss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Reset the peak RSS to the current RSS, so the next stage measures its own
+# peak (Linux only; elsewhere the peak is for the process so far).
+def _ResetPeakRss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+# Fold the peak since the last checkpoint into all of the open stages.
+def _Checkpoint():
+    peak = _PeakRss()
+    for s in _stack:
+        s['peak'] = max(s['peak'], peak)
+    _ResetPeakRss()
+
+def _Cpu():
+    me = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return me.ru_utime + me.ru_stime + children.ru_utime + children.ru_stime
+
+def _Write(record):
+    line = json.dumps(record, default=str) + '\n'
+    try:
+        # Open for each record, so that forked workers can share the file.
+        with open(_trace_file, 'a') as f:
+            f.write(line)
+    except OSError as e:
+        print('Unable to write trace:', e)
+
+# Record a stage. Use as 'with Stage(name, label=...) as fields:', and add
+# counts to fields inside the block.
+class Stage:
+    def __init__(self, name, label=None, **fields):
+        self.name = name
+        self.fields = dict(fields)
+        if label is not None:
+            self.fields['label'] = label
+
+    def __enter__(self):
+        if not TraceEnabled():
+            return self.fields
+        _Checkpoint()
+        self.state = {'peak': 0}
+        self.parent = _stack[-1]['name'] if _stack else None
+        self.state['name'] = self.name
+        _stack.append(self.state)
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = _Cpu()
+        return self.fields
+
+    def __exit__(self, exc_type, exc, tb):
+        if not TraceEnabled() or not hasattr(self, 'state'):
+            return False
+        wall = time.perf_counter() - self.wall
+        cpu = _Cpu() - self.cpu
+        _Checkpoint()
+        # By identity: nested stages of the same name have equal states.
+        for i in reversed(range(len(_stack))):
+            if _stack[i] is self.state:
+                del _stack[i]
+                break
+        record = {
+            'run': _run,
+            'pid': os.getpid(),
+            'stage': self.name,
+            'start': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                time.gmtime(self.start)),
+            'wall': round(wall, 4),
+            'cpu': round(cpu, 4),
+            'peak_rss_mb': round(self.state['peak'] / 1024, 1),
+        }
+        if self.parent:
+            record['parent'] = self.parent
+        record.update(self.fields)
+        if exc_type is not None:
+            record['error'] = repr(exc)
+        _Write(record)
+        return False
+
+# Counts for the result of a stage.
+def StreamCounts(st):
+    if st is None:
+        return {}
+    return {'traces': len(st),
+        'samples': sum(tr.stats.npts for tr in st),
+        'bytes': sum(tr.data.nbytes for tr in st)}
+
+def EventCounts(events):
+    if events is None:
+        return {}
+    return {'events': len(events)}
+
+# Decorator to record each call of a function as a stage. counts(result)
+# returns a dict of counts to record. label(*args, **kwargs) returns a label
+# for the call, e.g. the output filename.
+def Traced(name=None, counts=None, label=None):
+    def decorator(function):
+        stage = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TraceEnabled():
+                return function(*args, **kwargs)
+            with Stage(stage, label(*args, **kwargs) if label else None) \
+                    as fields:
+                result = function(*args, **kwargs)
+                if counts:
+                    fields.update(counts(result))
+            return result
+        return wrapper
+    return decorator
+
+################################################################################
+
+# Print the total wall time, CPU time and the peak memory of each stage, for
+# each run in a trace file.
+def Summarize(filename):
+    runs = {}
+    with open(filename) as f:
+        for line in f:
+            r = json.loads(line)
+            stages = runs.setdefault(r['run'], {})
+            s = stages.setdefault(r['stage'], {'calls': 0, 'wall': 0.0,
+                'cpu': 0.0, 'peak_rss_mb': 0.0, 'errors': 0})
+            s['calls'] += 1
+            s['wall'] += r['wall']
+            s['cpu'] += r['cpu']
+            s['peak_rss_mb'] = max(s['peak_rss_mb'], r['peak_rss_mb'])
+            s['errors'] += 'error' in r
+    for run, stages in runs.items():
+        print(run)
+        for name, s in sorted(stages.items(), key=lambda i: -i[1]['wall']):
+            print('  %-20s %5d calls %9.2f s wall %9.2f s cpu %8.0f MB peak%s'
+                % (name, s['calls'], s['wall'], s['cpu'], s['peak_rss_mb'],
+                '  %d errors' % s['errors'] if s['errors'] else ''))
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 2:
+        print('Usage: python %s trace.jsonl' % sys.argv[0])
+        exit(1)
+    Summarize(sys.argv[1])
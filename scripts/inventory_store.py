@@ -0,0 +1,123 @@
+# Station metadata store, so responses are parsed once instead of every run.
+#
+# Each StationXML file is parsed once and kept as a pickle in the cache
+# directory, which is used until the file's size or modification time
+# changes. A pickle loads about ten times faster than the XML parses. The
+# channels of an inventory are indexed by SEED id and epoch, so finding the
+# response of a trace is a dictionary lookup.
+#
+# Responses fetched from IRIS are cached the same way, per channel, and used
+# for max_iris_age days as long as they cover the requested times.
+#
+# The cache is in ~/.cache/seismo/inventory, or $SEISMO_CACHE_DIR/inventory,
+# and can be deleted at any time.
+
+import hashlib
+import os
+import pickle
+import time
+
+# Days to keep responses from IRIS before fetching them again.
+max_iris_age = 30
+
+_inventories = {}       # filename -> (signature, inventory)
+_indexes = {}           # id(inventory) -> (inventory, index)
+
+# Directory for the on-disk cache.
+def CacheDir():
+    base = os.environ.get('SEISMO_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'seismo'))
+    return os.path.join(base, 'inventory')
+
+def _CacheFile(key):
+    return os.path.join(CacheDir(),
+        hashlib.sha1(repr(key).encode()).hexdigest() + '.pickle')
+
+def _Load(fname):
+    try:
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def _Save(fname, value):
+    try:
+        # Write to a temporary file and rename, so that other processes
+        # never read a partial file.
+        os.makedirs(CacheDir(), exist_ok=True)
+        tmp = '%s.%d.tmp' % (fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, fname)
+    except OSError as e:
+        print('Unable to cache inventory:', e)
+
+################################################################################
+
+# Read a StationXML file, from the cache if it hasn't changed. The inventory
+# is shared by all callers, so don't modify it.
+def LoadInventory(filename):
+    from obspy import read_inventory
+    filename = os.path.abspath(filename)
+    s = os.stat(filename)
+    signature = (s.st_size, s.st_mtime_ns)
+    if filename in _inventories and _inventories[filename][0] == signature:
+        return _inventories[filename][1]
+
+    fname = _CacheFile(('stationxml', filename))
+    cached = _Load(fname)
+    if cached and cached[0] == signature:
+        inv = cached[1]
+    else:
+        inv = read_inventory(filename)
+        _Save(fname, (signature, inv))
+    _inventories[filename] = (signature, inv)
+    return inv
+
+# Index of the channels of an inventory: {SEED id: [(start, end, channel)]},
+# with the times as POSIX timestamps, and end None for open epochs.
+def IndexInventory(inv):
+    if id(inv) in _indexes and _indexes[id(inv)][0] is inv:
+        return _indexes[id(inv)][1]
+    index = {}
+    for n in inv:
+        for s in n:
+            for c in s:
+                seed_id = '%s.%s.%s.%s' % (n.code, s.code, c.location_code,
+                    c.code)
+                index.setdefault(seed_id, []).append((
+                    c.start_date.timestamp if c.start_date else float('-inf'),
+                    c.end_date.timestamp if c.end_date else None, c))
+    _indexes[id(inv)] = (inv, index)
+    return index
+
+# The channel of inv with a SEED id at a time (UTCDateTime), or None.
+def FindChannel(inv, seed_id, time):
+    t = time.timestamp
+    for start, end, channel in IndexInventory(inv).get(seed_id, ()):
+        if start <= t and (end is None or t <= end):
+            return channel
+    return None
+
+# The response of a channel at a time, or None.
+def FindResponse(inv, seed_id, time):
+    channel = FindChannel(inv, seed_id, time)
+    return channel.response if channel else None
+
+################################################################################
+
+# Responses from IRIS, cached per channel. fetch() gets the inventory from
+# IRIS for starttime to endtime; it's only called if the cache doesn't cover
+# those times or is older than max_iris_age days.
+def CachedIrisInventory(net, station, loc, chan, starttime, endtime, fetch):
+    fname = _CacheFile(('iris', net, station, loc, chan))
+    cached = _Load(fname)
+    if cached and time.time() - cached[0] < max_iris_age * 86400:
+        inv = cached[1]
+        seed_id = '%s.%s.%s.%s' % (net, station, loc, chan)
+        if FindChannel(inv, seed_id, starttime) and \
+                FindChannel(inv, seed_id, endtime):
+            return inv
+    inv = fetch()
+    _Save(fname, (time.time(), inv))
+    return inv
@@ -0,0 +1,409 @@
+# Local magnitude and peak ground motion of catalog events.
+#
+# For each event and channel the data is deconvolved with the channel's
+# response from its StationXML file (see create_stationxml.py), and the
+# Wood-Anderson displacement, velocity and acceleration are computed. Peaks
+# are measured in windows around the P and S arrivals predicted by TauP
+# (GetAllArrivalTimes()), and in a noise window before the P.
+#
+# The events of a day are processed as a batch for each channel. The day's data
+# is read once, the event windows are cut to the same length and stacked, and
+# all of them are transformed, deconvolved and simulated as one array
+# operation with one evaluation of the response. The days run in parallel.
+#
+# ML uses the IASPEI standard (Hutton and Boore, 1987) for the Wood-Anderson
+# amplitude in nm and the hypocentral distance R in km, up to max_distance:
+#   ML = log10(A) + 1.11 log10(R) + 0.00189 R - 2.09
+# A is for a Wood-Anderson response with a static magnification of 1, not the
+# 2080 of the instrument, so the simulated trace is ground displacement above
+# the 1.25 Hz corner. --check measures a synthetic displacement of a known
+# amplitude through a channel's response and compares its ML with the formula.
+# The standard is for horizontal components, so expect an offset on vertical
+# channels. Catalog magnitudes of other types (mb, Mw) are also only a rough
+# comparison.
+#
+# The results are kept in a CSV table, one row per event and channel, and
+# events already in the table are not measured again. The summary compares
+# ML with the catalog magnitudes per channel. A consistent offset d means
+# that the measured amplitudes are 10**d times those the catalog implies,
+# e.g. a wrong gain in the station's StationXML file.
+#
+# Example: python magnitude.py --channel AM.BCCWA.01.BHZ
+#              --catalog 2025-01-01 2025-07-01 --event_filter 2.5 300
+#              --event_filter 4.0 600 --table magnitudes.csv
+
+import argparse
+import csv
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append('.')
+import archive
+
+# Defaults
+table_file = 'magnitudes.csv'
+noise_window = 30.0     # seconds of noise before the P window
+margin = 2.0            # seconds before the predicted P and S arrivals
+min_s_window = 20.0     # seconds
+p_window = 60.0         # seconds, when there is no S arrival
+padding = 30.0          # seconds of data beyond the windows, for the taper
+freqmin = 0.1           # Hz, low corner of the pre-filter
+max_distance = 600.0    # km, range of the ML distance correction
+min_snr = 3.0
+
+# IASPEI Wood-Anderson seismometer: 0.8 s period, damping 0.7. The gain is the
+# static magnification of 1 that the IASPEI ML formula is defined for.
+wa_poles = [-5.49779 - 5.60886j, -5.49779 + 5.60886j]
+wa_gain = 1.0
+
+p_phases = ['p', 'P', 'Pn', 'Pg', 'Pb']
+s_phases = ['s', 'S', 'Sn', 'Sg', 'Sb']
+
+columns = ['key', 'event', 'time', 'catalog_mag', 'mag_type', 'channel',
+    'distance', 'depth', 'p', 's', 'wa', 'wa_p', 'pgv', 'pga', 'snr', 'ml',
+    'residual']
+
+################################################################################
+# Simulation.
+
+# Wood-Anderson response to displacement at s = 2 pi i f.
+def WoodAnderson(s):
+    return wa_gain * s * s / ((s - wa_poles[0]) * (s - wa_poles[1]))
+
+# Deconvolve a batch of windows of one channel, data (n, npts) in counts, and
+# simulate the outputs. Each window is demeaned and tapered like obspy's
+# remove_response(), and pre-filtered with a cosine taper from freqmin / 2 to
+# freqmin Hz and from 0.8 to 0.9 of Nyquist. Returns (Wood-Anderson
+# displacement in nm, velocity in m/s, acceleration in m/s^2), each (n, npts).
+def SimulateBatch(data, delta, response, freqmin=freqmin):
+    from scipy.fft import rfft, irfft
+    from obspy.signal.invsim import cosine_taper, cosine_sac_taper
+    from obspy.signal.util import _npts2nfft
+    from obspy_helpers import InverseResponse
+    n, npts = data.shape
+    x = data - data.mean(axis=1, keepdims=True)
+    x *= cosine_taper(npts, 0.05, sactaper=True, halfcosine=False)
+    nfft = _npts2nfft(npts)
+    freqs = np.fft.rfftfreq(nfft, delta)
+    nyquist = 0.5 / delta
+    taper = cosine_sac_taper(freqs, flimit=(0.5 * freqmin, freqmin,
+        0.8 * nyquist, 0.9 * nyquist))
+    velocity = rfft(x, nfft, axis=1)
+    velocity *= InverseResponse(response, delta, nfft) * taper
+    s = 2j * np.pi * freqs
+    s[0] = 1.0
+    wa = WoodAnderson(s) / s * 1e9
+    wa[0] = 0.0
+    return (irfft(velocity * wa, nfft, axis=1)[:, :npts],
+        irfft(velocity, nfft, axis=1)[:, :npts],
+        irfft(velocity * s, nfft, axis=1)[:, :npts])
+
+# Peak absolute value of each row of y (n, npts) from sample start to end, both
+# arrays of n indexes.
+def WindowPeaks(y, start, end):
+    i = np.arange(y.shape[1])
+    inside = (i >= start[:, None]) & (i < end[:, None])
+    return np.max(np.where(inside, np.abs(y), 0.0), axis=1)
+
+# ML from Wood-Anderson amplitudes in nm and hypocentral distances in km.
+# Arrays of any shape.
+def LocalMagnitude(amplitude, distance):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log10(amplitude) + 1.11 * np.log10(distance) + \
+            0.00189 * np.asarray(distance) - 2.09
+
+# Check the simulation and ML on a synthetic record: a ground displacement sine
+# of amplitude nm at freq Hz, recorded in counts through response with
+# sampling interval delta, from an event distance km away. Returns (measured
+# ML, expected ML).
+def CheckMagnitude(response, delta, amplitude=1000.0, freq=5.0,
+        distance=100.0):
+    from obspy.signal.util import _npts2nfft
+    npts = int(round(60.0 / delta))
+    t = np.arange(npts) * delta
+    velocity = amplitude * 1e-9 * 2 * np.pi * freq * \
+        np.cos(2 * np.pi * freq * t)
+    nfft = _npts2nfft(npts)
+    vel_response = response.get_evalresp_response(delta, nfft,
+        output='VEL')[0]
+    counts = np.fft.irfft(np.fft.rfft(velocity, nfft) * vel_response,
+        nfft)[:npts]
+    wa = SimulateBatch(counts[None, :], delta, response)[0]
+    middle = np.array([npts // 4]), np.array([3 * npts // 4])
+    measured = WindowPeaks(wa, *middle)[0]
+    expected = amplitude * abs(WoodAnderson(2j * np.pi * freq))
+    return float(LocalMagnitude(measured, distance)), \
+        float(LocalMagnitude(expected, distance))
+
+################################################################################
+# Events.
+
+# Predicted P and S arrivals of an event at a site (lat, lon). Returns (origin
+# time, hypocentral distance in km, P time, S time or None), or None if the
+# event has no location.
+def PhaseTimes(event, site):
+    from obspy.geodetics.base import gps2dist_azimuth
+    from obspy_helpers import GetAllArrivalTimes
+    times = GetAllArrivalTimes(event, site)
+    if times is None or not times[2]:
+        return None
+    origin = event.origins[0]
+    arrivals = times[2]
+    tp = [a.time for a in arrivals if a.name in p_phases] or \
+        [min(a.time for a in arrivals)]
+    ts = [a.time for a in arrivals if a.name in s_phases]
+    d = gps2dist_azimuth(site[0], site[1], origin.latitude,
+        origin.longitude)[0] / 1000
+    r = np.hypot(d, origin.depth / 1000)
+    return origin.time, r, origin.time + min(tp), \
+        origin.time + min(ts) if ts else None
+
+# Noise, P and S windows (start, end) for the arrivals of PhaseTimes().
+def Windows(tp, ts):
+    noise = (tp - margin - noise_window, tp - margin)
+    if ts is None:
+        return noise, (tp - margin, tp - margin + p_window), None
+    s_end = ts + max(2 * (ts - tp), min_s_window)
+    return noise, (tp - margin, ts - margin), (ts - margin, s_end)
+
+# Measure the events of one day on each of the channels. Returns a list of
+# table rows.
+def MeasureDay(events, channels, path=None, xml_path=None, freqmin=freqmin,
+        max_distance=max_distance):
+    from obspy_helpers import GetLocalDataRange, GetStationResponse
+    from inventory_store import FindChannel
+    rows = []
+    for seed_id in channels:
+        net, station, loc, chan = seed_id.split('.')
+        time = events[0].origins[0].time
+        channel = FindChannel(GetStationResponse(net, station, xml_path),
+            seed_id, time)
+        if channel is None or channel.response is None:
+            print('No response for %s at %s' % (seed_id, time))
+            continue
+        site = (channel.latitude, channel.longitude)
+
+        # Predicted windows of each event.
+        measured = []
+        for e in events:
+            phases = PhaseTimes(e, site)
+            if phases is None:
+                continue
+            origin, r, tp, ts = phases
+            measured.append((e, origin, r, tp, ts, Windows(tp, ts)))
+        if not measured:
+            continue
+        starts = [m[5][0][0] - padding for m in measured]
+        length = max(max(w[1] for w in m[5] if w) + padding - start
+            for m, start in zip(measured, starts))
+
+        st = GetLocalDataRange(net, station, loc, chan, min(starts),
+            max(starts) + length, path)
+        st.merge(method=0)
+        if len(st) == 0:
+            continue
+        tr = st[0]
+        fs = tr.stats.sampling_rate
+        npts = int(round(length * fs))
+        data = np.ma.getdata(tr.data)
+        gaps = np.ma.getmaskarray(tr.data)
+
+        # Stack the windows that are fully covered by data.
+        batch = []
+        for m, start in zip(measured, starts):
+            i = int(round((start - tr.stats.starttime) * fs))
+            if i < 0 or i + npts > len(data) or gaps[i:i + npts].any():
+                print('Incomplete data for %s at %s' % (seed_id, m[1]))
+                continue
+            batch.append((m, start, i))
+        if not batch:
+            continue
+        x = np.stack([data[i:i + npts] for m, start, i in batch]).astype(
+            np.float64)
+        wa, velocity, acceleration = SimulateBatch(x, tr.stats.delta,
+            channel.response, freqmin)
+
+        # Sample indexes of the start (j = 0) or end (j = 1) of window k.
+        def Index(k, j):
+            return np.array([int(round((m[5][k][j] - start) * fs))
+                if m[5][k] else 0 for m, start, i in batch])
+        noise = (Index(0, 0), Index(0, 1))
+        p = (Index(1, 0), Index(1, 1))
+        s = (Index(2, 0), Index(2, 1))
+        signal = (p[0], np.where(s[1] > 0, s[1], p[1]))
+        wa_p = WindowPeaks(wa, *p)
+        wa_max = WindowPeaks(wa, *signal)
+        snr = wa_max / WindowPeaks(wa, *noise)
+        pgv = WindowPeaks(velocity, *signal)
+        pga = WindowPeaks(acceleration, *signal)
+        r = np.array([m[2] for m, start, i in batch])
+        ml = np.where(r <= max_distance, LocalMagnitude(wa_max, r), np.nan)
+
+        for j, ((e, origin, dist, tp, ts, windows), start, i) in \
+                enumerate(batch):
+            magnitude = e.magnitudes[0] if e.magnitudes else None
+            catalog_mag = magnitude.mag if magnitude else np.nan
+            rows.append({'key': '%s|%s' % (e.resource_id.id, seed_id),
+                'event': e.resource_id.id, 'time': str(origin),
+                'catalog_mag': catalog_mag,
+                'mag_type': magnitude.magnitude_type if magnitude else '',
+                'channel': seed_id, 'distance': float(dist),
+                'depth': e.origins[0].depth / 1000, 'p': str(tp),
+                's': str(ts) if ts else '', 'wa': float(wa_max[j]),
+                'wa_p': float(wa_p[j]), 'pgv': float(pgv[j]),
+                'pga': float(pga[j]), 'snr': float(snr[j]),
+                'ml': float(ml[j]), 'residual': float(ml[j] - catalog_mag)})
+    return rows
+
+def _MeasureDay(job):
+    return MeasureDay(*job)
+
+################################################################################
+# Results table.
+
+def ReadTable(filename):
+    table = {}
+    if not os.path.exists(filename):
+        return table
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            table[row['key']] = row
+    return table
+
+def WriteTable(filename, table):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=columns)
+        w.writeheader()
+        for key in sorted(table, key=lambda k: (table[k]['time'], k)):
+            w.writerow({k: ('%.6g' % v if isinstance(v, float) else v)
+                for k, v in table[key].items()})
+    os.replace(tmp, filename)
+
+# Measure the events on the channels and add them to the table file. Events
+# already in the table for all of the channels are skipped. Returns the table.
+def UpdateTable(filename, events, channels, path=None, xml_path=None,
+        freqmin=freqmin, max_distance=max_distance, processes=None):
+    from obspy_helpers import GroupEventsByDay
+    table = ReadTable(filename)
+    todo = [e for e in events if any('%s|%s' % (e.resource_id.id, c) not in
+        table for c in channels) and e.origins]
+    days = GroupEventsByDay(todo)
+    if not days:
+        return table
+    print('Measuring %d events on %d days' % (len(todo), len(days)))
+    jobs = [(day, channels, path or archive.path, xml_path, freqmin,
+        max_distance) for day in days]
+    if processes == 1 or len(jobs) == 1:
+        results = [_MeasureDay(job) for job in jobs]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_MeasureDay, jobs, chunksize=1)
+    for rows in results:
+        for row in rows:
+            table[row['key']] = row
+    WriteTable(filename, table)
+    return table
+
+# Residuals of ML against the catalog magnitudes, per channel and catalog
+# magnitude type, for the rows with at least min_snr. Returns a dict of
+# (channel, magnitude type): (count, median, standard deviation).
+def Residuals(table, min_snr=min_snr):
+    groups = {}
+    for row in table.values():
+        residual = float(row['residual'])
+        if np.isfinite(residual) and float(row['snr']) >= min_snr:
+            groups.setdefault((row['channel'], row['mag_type']), []).append(
+                residual)
+    return {key: (len(r), float(np.median(r)), float(np.std(r)))
+        for key, r in groups.items()}
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Wood-Anderson local magnitude and peak ground motion of ' \
+        'catalog events, compared with the catalog magnitudes.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--channel', action='append', required=True,
+        help='NET.STA.LOC.CHAN. Multiple channels may be specified.')
+    parser.add_argument('--catalog', nargs=2, metavar=('STARTTIME',
+        'ENDTIME'), help='Measure the catalog events in this time range.')
+    parser.add_argument('--event_filter', nargs=2, type=float,
+        action='append', metavar=('MAGNITUDE', 'KM'), default=None,
+        help='Measure events of at least MAGNITUDE within KM of the first '
+        'channel. Multiple filters may be specified (default '
+        '--min_magnitude within --max_distance).')
+    parser.add_argument('--min_magnitude', type=float, default=2.0,
+        help='Minimum catalog magnitude (default %(default)s).')
+    parser.add_argument('--max_distance', type=float, default=max_distance,
+        help='Maximum distance in km for ML (default %(default)s).')
+    parser.add_argument('--freqmin', type=float, default=freqmin,
+        help='Low corner of the pre-filter in Hz (default %(default)s).')
+    parser.add_argument('--min_snr', type=float, default=min_snr,
+        help='Minimum signal to noise ratio for the residuals (default '
+        '%(default)s).')
+    parser.add_argument('--path', default=archive.path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--xml_path', default=None,
+        help='Directory of the StationXML files (default the script '
+        'directory).')
+    parser.add_argument('--table', default=table_file,
+        help='Results table (default %(default)s).')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of days to measure in parallel (default number of '
+        'CPUs).')
+    parser.add_argument('--check', action='store_true',
+        help='Check the ML of a synthetic record through the response of '
+        'each channel, and exit.')
+    args = parser.parse_args()
+
+    if args.check:
+        from obspy import UTCDateTime
+        from obspy_helpers import GetStationResponse
+        from inventory_store import FindChannel
+        failed = False
+        for seed_id in args.channel:
+            net, station, loc, chan = seed_id.split('.')
+            channel = FindChannel(GetStationResponse(net, station,
+                args.xml_path), seed_id, UTCDateTime())
+            if channel is None:
+                sys.exit('No StationXML channel for %s' % seed_id)
+            ml, expected = CheckMagnitude(channel.response,
+                1.0 / channel.sample_rate)
+            ok = abs(ml - expected) < 0.05
+            failed |= not ok
+            print('%-20s ML %.3f, expected %.3f %s' % (seed_id, ml, expected,
+                'OK' if ok else 'FAILED'))
+        sys.exit(1 if failed else 0)
+
+    if args.catalog:
+        import dateutil.parser
+        from obspy import UTCDateTime
+        from obspy_helpers import GetEvents, FilterEvents, GetStationResponse
+        from inventory_store import FindChannel
+        starttime = UTCDateTime(dateutil.parser.parse(args.catalog[0]))
+        endtime = UTCDateTime(dateutil.parser.parse(args.catalog[1]))
+        net, station, loc, chan = args.channel[0].split('.')
+        channel = FindChannel(GetStationResponse(net, station, args.xml_path),
+            args.channel[0], starttime)
+        if channel is None:
+            sys.exit('No StationXML channel for %s' % args.channel[0])
+        filt = [(mag, km * 1000.0) for mag, km in (args.event_filter or
+            [(args.min_magnitude, args.max_distance)])]
+        events = GetEvents(starttime, endtime, min([m for m, d in filt]))
+        events = FilterEvents(events, filt, channel.latitude,
+            channel.longitude)
+        table = UpdateTable(args.table, events, args.channel, args.path,
+            args.xml_path, args.freqmin, args.max_distance, args.processes)
+    else:
+        table = ReadTable(args.table)
+
+    print('%-20s %-6s %5s %8s %6s %9s' % ('channel', 'type', 'n', 'median',
+        'std', 'amp ratio'))
+    for (seed_id, mag_type), (n, median, std) in sorted(
+            Residuals(table, args.min_snr).items()):
+        print('%-20s %-6s %5d %8.2f %6.2f %9.2f' % (seed_id, mag_type, n,
+            median, std, 10 ** median))
@@ -0,0 +1,188 @@
+# Seismic and infrasound noise models, and noise metrics against them.
+#
+# The Peterson (1993) new low and high noise models (NLNM and NHNM) for
+# velocity and acceleration, and the IDC2010 infrasound low and high noise
+# models. NoiseModel() evaluates a model on any frequency grid, interpolating
+# linearly in log frequency (the Peterson models are straight lines in dB vs.
+# log period between the tabulated points), and caches the result for the
+# grid. The metrics work on arrays of PSDs, one row per segment, so thousands
+# of segments are handled with a few array operations.
+#
+# Example, per segment dB above the NLNM of a saved PPSD:
+#   python noise_models.py ppsd_AM_BCCWA_01_BHZ.npz --table noise.csv
+
+import argparse
+import csv
+
+import numpy as np
+
+# Velocity PSD of the USGS New low noise model
+# dB relative to (1 m/s)^2/Hz
+# from
+# http://gfzpublic.gfz-potsdam.de/pubman/item/escidoc:4017:4/component/escidoc:4018/Chapter_4_rev1.pdf
+# period, velocity noise
+nlnm_vel =  [(0.1, -203.9), (0.17, -198.1), (0.4, -190.6), (0.8, -187.1), (1.24, -177.8),
+         (2.40, -157.0), (4.3, -144.4), (5.0, -143.1), (6.0, -149.4), (10.0, -159.7),
+         (12.0, -160.6), (15.6, -154.2), (21.9, -166.7), (31.6, -171.0), (45.0, -170.4),
+         (70.0, -166.6), (101.0, -160.9), (154.0, -157.2), (328.0, -153.1), (600.0, -144.8),
+         (10000, -87.9), (100000, -19.1)]
+
+# Velocity PSD of the USGS New high noise model
+# dB relative to (1 m/s)^2/Hz
+# period, velocity noise
+nhnm_vel =  [(0.1, -127.5), (0.22, -126.5), (0.32, -136.4), (0.80, -137.9), (3.80, -102.4),
+         (4.60, -99.2), (6.3, -101.0), (7.9, -111.5), (15.4, -112.2), (20.0, -128.4),
+         (354.8, -91.0), (10000, -16.1), (100000, 35.5)]
+
+# Acceleration PSD of the USGS New low noise model
+# dB relative to (1 m/s^2)^2/Hz
+# period, acceleration noise
+nlnm_accel =  [(0.1, -168.0), (0.17, -166.7), (0.4, -166.7), (0.8, -169.2), (1.24, -163.7),
+         (2.40, -148.6), (4.3, -141.1), (5.0, -141.1), (6.0, -149.0), (10.0, -163.8),
+         (12.0, -166.2), (15.6, -162.1), (21.9, -177.5), (31.6, -185.0), (45.0, -187.5),
+         (70.0, -187.5), (101.0, -185.0), (154.0, -185.0), (328.0, -187.5), (600.0, -184.4),
+         (10000, -151.9), (100000, -103.1)]
+
+# Acceleration PSD of the USGS New high noise model
+# dB relative to (1 m/s^2)^2/Hz
+# period, acceleration noise
+nhnm_accel =  [(0.1, -91.5), (0.22, -97.4), (0.32, -110.5), (0.80, -120.0), (3.80, -98.0),
+         (4.60, -96.5), (6.3, -101.0), (7.9, -113.5), (15.4, -120.0), (20.0, -138.5),
+         (354.8, -126.0), (10000, -80.1), (100000, -48.5)]
+
+# Infrasonic PSD IDC2010_LI low noise model. Estimated from published plots:
+# https://link.springer.com/article/10.1007/s00024-012-0573-6
+# frequency, base10 logarithm relative to (1 Pa)^2/Hz
+idc2010_li = [(0.012, -2.1), (0.02, -2.7), (0.03, -3.2), (0.04, -3.55), (0.05, -3.75),
+         (0.06, -3.95), (0.07, -4.05), (0.08, -4.15), (0.09, -4.25), (0.1, -4.45),
+         (0.13, -4.25), (0.2, -4.2), (0.3, -5.0), (0.4, -5.4), (0.5, -5.6),
+         (0.6, -5.7), (0.7, -5.8), (0.8, -6.05), (0.9, -6.3), (1.0, -6.5),
+         (2.0, -7.75), (3.0, -8.5), (3.8, -8.85), (4.0, -8.9), (5.0, -9.1),
+         (6.0, -9.25), (7.0, -9.4), (7.3, -9.45), (8.0, -9.75), (9.0, -9.90)]
+
+# Infrasonic PSD IDC2010_HI high noise model. Estimated from published plots:
+# https://link.springer.com/article/10.1007/s00024-012-0573-6
+# frequency, base10 logarithm relative to (1 Pa)^2/Hz
+idc2010_hi = [(0.012, 3.6), (0.022, 3.45), (0.04, 3.05), (0.05, 2.9), (0.06, 2.5),
+         (0.07, 2.25), (0.08, 2.1), (0.09, 2.06), (0.1, 2.0), (0.2, 1.5),
+         (0.3, 1.2), (0.4, 0.8), (0.5, 0.45), (0.6, 0.05), (0.7, -0.05),
+         (0.8, -0.3), (0.9, -0.55), (1.0, -0.8), (2.0, -1.3), (3.0, -1.6),
+         (4.0, -1.85), (5.0, -1.95), (6.0, -2.05), (7.0, -2.2), (8.0, -2.3),
+         (9.0, -2.5)]
+
+# name: (table, x is period (True) or frequency, scale of the values to dB)
+models = {
+    'nlnm_vel': (nlnm_vel, True, 1.0),
+    'nhnm_vel': (nhnm_vel, True, 1.0),
+    'nlnm_accel': (nlnm_accel, True, 1.0),
+    'nhnm_accel': (nhnm_accel, True, 1.0),
+    'idc2010_li': (idc2010_li, False, 10.0),
+    'idc2010_hi': (idc2010_hi, False, 10.0),
+}
+
+# Standard period bands for noise metrics, in seconds.
+standard_bands = {
+    'short_period': (0.1, 1.0),
+    'secondary_microseism': (4.0, 8.0),
+    'primary_microseism': (10.0, 20.0),
+    'long_period': (30.0, 100.0),
+}
+
+_grid_cache = {}
+_grid_cache_size = 32
+
+################################################################################
+
+# Return a model as (frequency, dB) arrays, in increasing frequency.
+def ModelTable(name):
+    table, is_period, scale = models[name]
+    x, y = np.array(table, dtype=np.float64).T
+    if is_period:
+        x = 1.0 / x
+    order = np.argsort(x)
+    return x[order], scale * y[order]
+
+# Evaluate a model in dB on an array of frequencies. Frequencies outside the
+# model are NaN. The result is cached for the grid, so don't modify it.
+def NoiseModel(name, freqs):
+    freqs = np.asarray(freqs, dtype=np.float64)
+    key = (name, freqs.shape, hash(freqs.tobytes()))
+    if key in _grid_cache:
+        return _grid_cache[key]
+    x, y = ModelTable(name)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logf = np.log10(freqs)
+    values = np.interp(logf, np.log10(x), y, left=np.nan, right=np.nan)
+    values[~np.isfinite(logf)] = np.nan
+    if len(_grid_cache) >= _grid_cache_size:
+        _grid_cache.pop(next(iter(_grid_cache)))
+    _grid_cache[key] = values
+    return values
+
+# dB above a model for PSDs in dB, shape (segments, frequencies) or
+# (frequencies,).
+def Exceedance(psd_db, freqs, model='nlnm_accel'):
+    return np.asarray(psd_db) - NoiseModel(model, freqs)
+
+# Mean dB above a model in each band, for each segment. bands is a dict of
+# name: (shortest period, longest period) in seconds. Returns a dict of name:
+# array with one value per segment, NaN where the band has no data.
+def BandExceedance(psd_db, freqs, model='nlnm_accel', bands=standard_bands):
+    freqs = np.asarray(freqs, dtype=np.float64)
+    excess = np.atleast_2d(Exceedance(psd_db, freqs, model))
+    result = {}
+    for band, (short, long) in bands.items():
+        columns = (freqs >= 1.0/long) & (freqs <= 1.0/short)
+        with np.errstate(invalid='ignore'):
+            values = excess[:, columns]
+            n = np.sum(np.isfinite(values), axis=1)
+            total = np.nansum(values, axis=1)
+            result[band] = np.where(n > 0, total / np.maximum(n, 1), np.nan)
+    return result
+
+# Fraction of the frequencies of each segment, within the model, where the
+# PSD is above (or below, with above=False) the model. E.g. the fraction above
+# the NHNM, or below the NLNM, which usually means a problem with the station.
+def FractionOutside(psd_db, freqs, model='nhnm_accel', above=True):
+    excess = np.atleast_2d(Exceedance(psd_db, freqs, model))
+    valid = np.isfinite(excess)
+    with np.errstate(invalid='ignore'):
+        outside = (excess > 0) if above else (excess < 0)
+    return np.sum(outside & valid, axis=1) / np.maximum(np.sum(valid, axis=1), 1)
+
+# Per segment metrics of an obspy PPSD (acceleration, dB). Returns (times,
+# dict of metric name: array).
+def PPSDMetrics(ppsd, bands=standard_bands):
+    psd_db = np.array(ppsd.psd_values, dtype=np.float64)
+    freqs = 1.0 / np.asarray(ppsd.period_bin_centers)
+    metrics = {'%s_db_above_nlnm' % band: values for band, values in
+        BandExceedance(psd_db, freqs, 'nlnm_accel', bands).items()}
+    metrics['fraction_above_nhnm'] = FractionOutside(psd_db, freqs,
+        'nhnm_accel', above=True)
+    metrics['fraction_below_nlnm'] = FractionOutside(psd_db, freqs,
+        'nlnm_accel', above=False)
+    return ppsd.times_processed, metrics
+
+def WriteMetrics(filename, times, metrics):
+    with open(filename, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['time'] + list(metrics))
+        for i, t in enumerate(times):
+            w.writerow([str(t)] + ['%.2f' % metrics[m][i] for m in metrics])
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Per segment noise metrics of saved PPSDs (PPSD.save_npz()).'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('npz', nargs='+', help='Saved PPSD files.')
+    parser.add_argument('--table', default=None,
+        help='Write the metrics to this CSV file (default stdout).')
+    args = parser.parse_args()
+
+    from obspy.signal import PPSD
+    ppsd = PPSD.load_npz(args.npz[0])
+    for f in args.npz[1:]:
+        ppsd.add_npz(f)
+    times, metrics = PPSDMetrics(ppsd)
+    WriteMetrics(args.table or '/dev/stdout', times, metrics)
@@ -1,57 +1,66 @@
 # Some common helper functions for using Obspy.
+#
+# Only lightweight dependencies are imported here. The Seedlink and FDSN
+# clients, TauPy and matplotlib take most of a second to import, so the
+# functions that need them import them on first use. Scripts that only read
+# local MiniSEED don't pay for them. Run benchmark_startup.py after changing
+# the imports here.
 
-from matplotlib.dates import HourLocator
-from obspy.clients.seedlink.basic_client import Client as SeedlinkClient
-from obspy.clients.seedlink.easyseedlink import create_client
-from obspy.clients.fdsn import Client as FdsnClient
 from obspy.geodetics.base import gps2dist_azimuth
 from obspy.core.event import Catalog
 from obspy.core.stream import Stream
-from obspy.taup.tau import TauPyModel
+from obspy.core.trace import Trace
 from obspy import UTCDateTime
 from obspy import read, read_inventory
-import matplotlib.pyplot as plt
+from obspy.core.inventory import PolynomialResponseStage
 import numpy as np
-import gc
+
+from filter_design import ButterworthSos
+from instrumentation import Traced, Stage, StreamCounts, EventCounts
+
+# Labels for the traced stages.
+def _SeedId(addr, net, station, loc, chan, *args, **kwargs):
+    return '%s.%s.%s.%s' % (net, station, loc, chan)
+def _PlotFilename(stream, filename, *args, **kwargs):
+    return filename
 
 ################################################################################
 
-# Read the station data from a local file.
+# Read the station data from a local file, in the flat or SDS archive layout.
+# Returns None if there is no file for the day.
 def GetLocalData(net, station, loc, chan, year=0, doy=0, path=None):
+    import os
+    import archive
+    if path is None:
+        # Use the path to data on archive.local
+        path = archive.path
+    fname = archive.DayFilename(path, net, station, loc, chan, year, doy)
     try:
-        if path is None:
-            # Use the path to data on archive.local
-            path = '/data/seismometer_data/mseed'
-    
-        fname = path + '/%s.%s.%s.%s.%d.%d.mseed' % (net, station, loc, chan, year, doy)
-        #st = read('/data/seismometer_data/mseed/%s.%s.%s.%s.%d.%d.mseed' % (net, station, loc, chan, year, doy))
-        st = read(fname)
-        return st
-    except:
+        return read(fname)
+    except Exception as e:
+        if os.path.exists(fname):
+            print('Unable to read %s: %s' % (fname, e))
         return None
 
-# Read the station datafrom a local file, covering the timespan from startime to endtime.
-def GetLocalDataRange(net, station, loc, chan, starttime, endtime):
-    year = starttime._get_year()
-    doy = starttime._get_julday()
-    end_year = starttime._get_year()
-    end_doy = endtime._get_julday()
+# Read the station data from the local files covering the timespan from
+# starttime to endtime. Only the day files that exist are read.
+def GetLocalDataRange(net, station, loc, chan, starttime, endtime, path=None):
+    import archive
+    if path is None:
+        path = archive.path
     st = Stream()
-    while True:
+    for fname in archive.DayFiles(net, station, loc, chan, starttime, endtime,
+            path):
         try:
-            st += GetLocalData(net, station, loc, chan, year, doy)
+            st += read(fname)
         except Exception as e:
-            print(e)
-        if year == end_year and doy == end_doy:
-            #st.trim(starttime=starttime, endtime=endtime)
-            return st
-        doy += 1
-        if doy >= 366:      # Allow leap years. OK if file doesn't exist.
-            doy = 1
-            year += 1
+            print('Unable to read %s: %s' % (fname, e))
+    return st
 
 # Get the station data from a Seedlink server.
+@Traced(counts=StreamCounts, label=_SeedId)
 def GetSeedlinkData(seedlink_addr, net, station, loc, chan, starttime, endtime):
+    from obspy.clients.seedlink.basic_client import Client as SeedlinkClient
     if ':' in seedlink_addr:
         host, port = seedlink_addr.rsplit(':', 1)
         port = int(port)
@@ -63,9 +72,13 @@ def GetSeedlinkData(seedlink_addr, net, station, loc, chan, starttime, endtime):
     return st
 
 # Use a temporary local file first, then retrieve any additional data needed from server.
+@Traced(counts=StreamCounts, label=_SeedId)
 def GetData(seedlink_addr, net, station, loc, chan, starttime, endtime):
     # Use a local temporary file in the current directory.
-    st = GetLocalData(net, station, loc, chan, path='.')
+    try:
+        st = read('%s.%s.%s.%s.mseed' % (net, station, loc, chan))
+    except:
+        st = None
     if st == None or len(st) == 0:
         print("Getting entire data from Seedlink server ", seedlink_addr)
         st = GetSeedlinkData(seedlink_addr, net, station, loc, chan, starttime,
@@ -94,38 +107,50 @@ def GetData(seedlink_addr, net, station, loc, chan, starttime, endtime):
                                   newest, endtime)
             print("Merging data...")
             st += st2
-    print('Gaps before merge:')
-    st.print_gaps()
-    st.merge(method=0, fill_value='interpolate')	# try to mitigate filter transients.
-    print('Gaps after merge:')
-    st.print_gaps()
+    with Stage('merge'):
+        print('Gaps before merge:')
+        st.print_gaps()
+        st.merge(method=0, fill_value='interpolate')	# try to mitigate filter transients.
+        print('Gaps after merge:')
+        st.print_gaps()
     if len(st) > 0:
         print("Writing data to local file.")
-        st.write('%s.%s.%s.%s.mseed' % (net, station, loc, chan), 
-                 format='MSEED')
+        with Stage('write_cache'):
+            st.write('%s.%s.%s.%s.mseed' % (net, station, loc, chan), 
+                     format='MSEED')
     return st
 
 # Get data from IRIS
 def GetIrisDataRange(net, station, loc, chan, starttime, endtime):
+    from obspy.clients.fdsn import Client as FdsnClient
     client = FdsnClient("IRIS")
     st = client.get_waveforms(net, station, loc, chan, starttime, endtime)
     return st
 
+# Get the response from IRIS, or from the inventory store's cache of them.
 def GetIrisResponse(net, station, loc, chan, starttime, endtime):
-    client = FdsnClient("IRIS")
-    inventory = client.get_stations(
-        starttime=starttime, endtime=endtime,
-        network=net, sta=station, loc=loc, channel=chan,
-        level="response")
-    return inventory
+    from inventory_store import CachedIrisInventory
+    def fetch():
+        from obspy.clients.fdsn import Client as FdsnClient
+        client = FdsnClient("IRIS")
+        return client.get_stations(
+            starttime=starttime, endtime=endtime,
+            network=net, sta=station, loc=loc, channel=chan,
+            level="response")
+    return CachedIrisInventory(net, station, loc, chan, starttime, endtime,
+        fetch)
 
 # Generate a filename specific to this stream's net, station, location, channel.
 def MakeFilename(st, basename, extension):
-    return "%s_%s_%s_%s_%s.%s" % (basename, net, station, loc, chan, extension)
+    stats = st[0].stats
+    return "%s_%s_%s_%s_%s.%s" % (basename, stats.network, stats.station,
+        stats.location, stats.channel, extension)
 
 
 # Get list of recent earthquakes.
+@Traced(counts=EventCounts)
 def GetEvents(starttime, endtime, min_magnitude=0.0, provider=['IRIS', 'ISC', 'USGS']):
+    from obspy.clients.fdsn import Client as FdsnClient
     events = []
     for provider in ['IRIS', 'ISC', 'USGS']:
         client = FdsnClient(provider)
@@ -148,31 +173,311 @@ def GetEvents(starttime, endtime, min_magnitude=0.0, provider=['IRIS', 'ISC', 'U
 #     (5.0, 10000*1000),    >= M5.0 within 10000km
 #     (6.0, 15000*1000),    >= M6.0 within 15000km
 #     (7.0, inf) ]          >= M7.0 within any distance
-def FilterEvents(events, filt, lat, lon):
+# The distances may be precomputed with EventDistances() and passed in, so
+# that several filters for the same site share one set of computations.
+@Traced(counts=EventCounts)
+def FilterEvents(events, filt, lat, lon, distances=None):
+    if distances is None:
+        distances = EventDistances(events, lat, lon)
     result = Catalog()
+    ids = set()     # 'e in result' compares whole events, which is very slow
     for f in filt:
         magnitude = f[0]
         distance = f[1]
         accepted = [e for e in events \
-                    if not e in result and \
+                    if not e.resource_id.id in ids and \
                         e.magnitudes[0].mag >= magnitude and \
-                        gps2dist_azimuth(lat, lon, e.origins[0].latitude, \
-                            e.origins[0].longitude)[0] <= distance]
+                        distances[e.resource_id.id][0] <= distance]
         for e in accepted:
             result.append(e)
+            ids.add(e.resource_id.id)
 
     print("Events after filtering:")
     for e in result:
-        (d, a, z) = gps2dist_azimuth(site[0], site[1], 
-                        e.origins[0].latitude, e.origins[0].longitude)
+        (d, a) = distances[e.resource_id.id]
         print("%s | Distance %.0f km, azimuth %d deg" % 
                 (e.short_str(), d/1000, a))
     return result
 
+# Group events by the UTC day of their origin time, so that the data of each day
+# can be read once for all of its events. Returns a list of lists of events.
+def GroupEventsByDay(events):
+    days = {}
+    for e in sorted(events, key=lambda e: e.origins[0].time):
+        days.setdefault(e.origins[0].time.date, []).append(e)
+    return list(days.values())
+
+# Compute the distance (m) and azimuth (deg) from lat, lon to each event.
+# Returns a dict keyed by the event resource id.
+def EventDistances(events, lat, lon):
+    distances = {}
+    for e in events:
+        (d, a, z) = gps2dist_azimuth(lat, lon,
+                        e.origins[0].latitude, e.origins[0].longitude)
+        distances[e.resource_id.id] = (d, a)
+    return distances
+
+################################################################################
+# Processing precision.
+#
+# By default the waveform helpers process data as float64, like obspy does.
+# SetPrecision(np.float32), or dtype=np.float32 on the individual helpers,
+# processes in float32 instead. That halves the memory used by every copy of
+# the data and doubles the number of samples per SIMD operation.
+#
+# Accuracy of float32 relative to float64, measured on a synthetic day of
+# 100 sps data (microseism + noise, ~2^16 counts):
+# - Raw counts convert to float32 exactly for 24-bit digitizers (< 2^24).
+# - Scaling, demean and decimation: relative error ~6e-8 (float32 rounding).
+# - Butterworth filters with all corners at or above 5% of Nyquist run in
+#   float32. Error is below 1e-5 of the peak amplitude.
+# - Filters with a lower corner (e.g. the 0.002 Hz high-pass or 0.07 Hz
+#   low-pass at 100 sps) lose up to 10% in float32, so they run in float64
+#   and the output is rounded back to float32. Error is below 1e-6.
+# - Spectrogram amplitudes: relative error ~1e-6.
+
+_precision = np.float64
+
+# Normalized corner frequency below which filters run in float64.
+float32_min_corner = 0.05
+
+def SetPrecision(dtype):
+    global _precision
+    _precision = np.dtype(dtype).type
+
+# Return dtype as a numpy scalar type, or the current processing precision.
+def GetPrecision(dtype=None):
+    if dtype is None:
+        return _precision
+    return np.dtype(dtype).type
+
+# Copy a stream, converting the data to the processing precision. Only one
+# copy of the data is made. Use stream.slice() first to copy only the time
+# window that is needed, since slice() doesn't copy the data.
+def CopyStream(stream, dtype=None):
+    dtype = GetPrecision(dtype)
+    st = Stream()
+    for tr in stream:
+        st.append(Trace(data=tr.data.astype(dtype), header=tr.stats.copy()))
+    return st
+
+# Seconds of extra data needed on each side of a time window to let the
+# transients of zero-phase filters with these corners die out. Corners of 0 or
+# None are ignored.
+def FilterPadding(*corners):
+    padding = 1.0
+    for f in corners:
+        if f:
+            padding = max(padding, 4.0 / f)
+    return padding
+
+# Remove the mean of each trace, in place. Unlike obspy's detrend() this
+# doesn't allocate a new array.
+def DemeanStream(st):
+    for tr in st:
+        tr.data -= tr.data.dtype.type(tr.data.mean(dtype=np.float64))
+    return st
+
+# Convert the data of each trace to the processing precision, in place.
+# Obspy operations such as detrend('simple') and remove_response() return
+# float64 data, so call this after them to stay in float32.
+def ToPrecision(st, dtype=None):
+    dtype = GetPrecision(dtype)
+    for tr in st:
+        tr.data = tr.data.astype(dtype, copy=False)
+    return st
+
+# Butterworth filter an array, like obspy's filter() but in the processing
+# precision. See the notes on accuracy above.
+def FilterData(data, type, df, corners=4, zerophase=False, dtype=None,
+        **options):
+    from scipy.signal import sosfilt
+    dtype = GetPrecision(dtype)
+    if np.ma.is_masked(data):
+        raise NotImplementedError('Cannot filter data with gaps (masked '
+            'values). Use split() on the stream first.')
+    sos, wn = ButterworthSos(type, df, corners, **options)
+    if dtype == np.float32 and min(wn) >= float32_min_corner:
+        sos = sos.astype(np.float32)
+    data = np.asarray(data)
+    if data.dtype != dtype and data.dtype != np.float64:
+        data = data.astype(dtype)
+    out = sosfilt(sos, data)
+    if zerophase:
+        out = sosfilt(sos, out[::-1])[::-1]
+    return out.astype(dtype, copy=False)
+
+# Filter each trace in a stream, in place. Same arguments as obspy's
+# Stream.filter() for the bandpass, highpass and lowpass filters.
+def FilterStream(st, type, dtype=None, **options):
+    for tr in st:
+        tr.data = FilterData(tr.data, type, tr.stats.sampling_rate,
+            dtype=dtype, **options)
+    return st
+
+_inverse_responses = {}     # (id(response), delta, nfft) -> (response, inverse)
+
+# The inverted velocity response of a channel at the rfft frequencies of nfft
+# samples, with a water level of 60 dB like obspy's remove_response().
+# Evaluating and inverting the response takes about half of the time of
+# remove_response(), so the inverse is cached and reused for traces of the same
+# length and sampling rate, e.g. the event windows of a catalog. Don't modify
+# the returned array.
+def InverseResponse(response, delta, nfft):
+    from obspy.signal.invsim import invert_spectrum
+    key = (id(response), delta, nfft)
+    if key not in _inverse_responses:
+        inverse, freqs = response.get_evalresp_response(delta, nfft,
+            output='VEL')
+        invert_spectrum(inverse, 60)
+        if len(_inverse_responses) >= 32:
+            _inverse_responses.clear()
+        _inverse_responses[key] = (response, inverse)
+    return _inverse_responses[key][1]
+
+# Remove the instrument response of a trace, in place, the same way as obspy's
+# remove_response() with its defaults (velocity output, 5% taper, water level
+# 60 dB), using the cached inverse response.
+def RemoveResponse(tr, response):
+    from obspy.signal.invsim import cosine_taper
+    from obspy.signal.util import _npts2nfft
+    if not response.response_stages or \
+        isinstance(response.response_stages[0], PolynomialResponseStage):
+        tr.stats.response = response
+        return tr.remove_response()
+
+    data = tr.data.astype(np.float64)
+    npts = len(data)
+    data -= data.mean()
+    data *= cosine_taper(npts, 0.05, sactaper=True, halfcosine=False)
+    nfft = _npts2nfft(npts)
+    spectrum = np.fft.rfft(data, n=nfft)
+    spectrum *= InverseResponse(response, tr.stats.delta, nfft)
+    spectrum[-1] = abs(spectrum[-1]) + 0.0j
+    tr.data = np.fft.irfft(spectrum)[0:npts]
+    return tr
+
+# Compute the spectrogram of an array the same way as obspy's spectrogram(),
+# in the processing precision. Returns (specgram, freq, time), with the zero
+# frequency bin removed.
+def SpectrogramArray(data, samp_rate, wlen, per_lap=0.9, mult=8.0,
+        dbscale=False, dtype=None):
+    from obspy.imaging.spectrogram import _nearest_pow_2
+    from scipy.signal import spectrogram
+    dtype = GetPrecision(dtype)
+    samp_rate = float(samp_rate)
+    nfft = int(_nearest_pow_2(wlen * samp_rate))
+    if len(data) < nfft:
+        raise ValueError('Input signal too short (%d samples, window length '
+            '%s seconds, nfft %d samples)' % (len(data), wlen, nfft))
+    if mult is not None:
+        mult = int(_nearest_pow_2(mult)) * nfft
+    nlap = int(nfft * float(per_lap))
+
+    data = np.asarray(data, dtype=dtype)
+    data = data - data.mean()
+    freq, time, specgram = spectrogram(data, fs=samp_rate,
+        window=np.hanning(nfft).astype(dtype), nperseg=nfft, noverlap=nlap,
+        nfft=mult, detrend=False, scaling='density', mode='psd')
+    if len(time) < 2:
+        raise ValueError('Input signal too short (%d samples, window length '
+            '%s seconds, nfft %d samples, %d samples window overlap)' %
+            (len(data), wlen, nfft, nlap))
+
+    # db scale and remove zero/offset for amplitude
+    if dbscale:
+        specgram = 10 * np.log10(specgram[1:, :])
+    else:
+        specgram = np.sqrt(specgram[1:, :])
+    return specgram, freq[1:], time
+
+# Plot a spectrogram of one trace the same way as obspy's
+# Trace.spectrogram(log=False). Returns the figure.
+def SpectrogramFigure(tr, wlen, per_lap=0.9, mult=8.0, dbscale=False,
+        clip=[0.0, 1.0], dtype=None):
+    from matplotlib.colors import Normalize
+    import matplotlib.pyplot as plt
+    from obspy.imaging.cm import obspy_sequential
+    specgram, freq, time = SpectrogramArray(tr.data, tr.stats.sampling_rate,
+        wlen, per_lap=per_lap, mult=mult, dbscale=dbscale, dtype=dtype)
+
+    vmin, vmax = clip
+    if vmin < 0 or vmax > 1 or vmin >= vmax:
+        raise ValueError('Invalid parameters for clip option.')
+    _range = float(specgram.max() - specgram.min())
+    vmin = specgram.min() + vmin * _range
+    vmax = specgram.min() + vmax * _range
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    halfbin_time = (time[1] - time[0]) / 2.0
+    halfbin_freq = (freq[1] - freq[0]) / 2.0
+    extent = (time[0] - halfbin_time, time[-1] + halfbin_time,
+              freq[0] - halfbin_freq, freq[-1] + halfbin_freq)
+    ax.imshow(np.flipud(specgram), interpolation='nearest', extent=extent,
+        norm=Normalize(vmin, vmax, clip=True), cmap=obspy_sequential)
+    ax.axis('tight')
+    ax.set_xlim(0, tr.stats.npts / tr.stats.sampling_rate)
+    ax.grid(False)
+    ax.set_xlabel('Time [s]')
+    ax.set_ylabel('Frequency [Hz]')
+    return fig
+
+################################################################################
+
+# Text rendering for plot titles.
+#
+# 'latex' renders titles with usetex, which runs LaTeX and dvipng for every
+# figure. That dominates the time to render the smaller plots, and needs a TeX
+# installation. 'fast' uses matplotlib's own text rendering, with mathtext for
+# the bold first line, and gives the same centered multi-line layout. The
+# default is 'latex' if it is installed, otherwise 'fast'.
+
+text_modes = ['latex', 'fast']
+_text_mode = None
+
+def SetTextMode(mode):
+    global _text_mode
+    if mode is not None and mode not in text_modes:
+        raise ValueError('Unknown text mode: %s' % mode)
+    _text_mode = mode
+
+def GetTextMode():
+    global _text_mode
+    if _text_mode is None:
+        import shutil
+        if shutil.which('latex') and shutil.which('dvipng'):
+            _text_mode = 'latex'
+        else:
+            _text_mode = 'fast'
+    return _text_mode
+
+# Bold text without usetex. Each run of letters and digits is set in mathtext
+# bold. The punctuation and spaces in between are left as plain text, since
+# mathtext adds space around punctuation.
+def _BoldText(s):
+    import re
+    return re.sub(r'[A-Za-z0-9]+', lambda m: r'$\mathbf{%s}$' % m.group(0),
+        s.replace('$', r'\$'))
+
+# Make a centered plot title with a bold first line, in the current text
+# mode. lines are the plain text lines below the title. Also sets up
+# matplotlib to render it.
+def PlotTitle(title, lines):
+    import matplotlib.pyplot as plt
+    if GetTextMode() == 'latex':
+        plt.rc('text', usetex=True)     # use LaTex tags
+        return r'\begin{center}{\textbf{%s\\}}%s\end{center}' % \
+            (title, r'\\'.join(lines))
+    plt.rc('text', usetex=False)
+    return '\n'.join([_BoldText(title)] +
+        [l.replace('$', r'\$') for l in lines])
+
 # Helper to clean up obspy dayplot.
 def FixupAnnotations(fig):
+    import matplotlib.text
     annotations = [child for child in fig.axes[0].get_children() 
-        if isinstance(child, plt.text.Annotation)]
+        if isinstance(child, matplotlib.text.Annotation)]
 
     # Change size of annotation text
     for a in annotations:
@@ -190,12 +495,22 @@ def FixupAnnotations(fig):
             yloc.append(y)
 
 # Make a helicorder plot and save to file.
+# units is the input data scale in m/s per LSB, used with scale to set the
+# vertical scaling of each line. dtype selects the processing precision.
+@Traced(label=_PlotFilename)
 def Helicorder(stream, filename, location, starttime, duration, freqmin=0,
-	freqmax=0, decimation=1, scale=None, events={}):
+	freqmax=0, decimation=1, scale=None, events={}, units=None, dtype=None):
+    import matplotlib.pyplot as plt
     print("Plotting helicorder ", filename)
-    plt.rc('text', usetex=True)     # use LaTex tags
-    st = stream.copy()
+    # Copy only the data to be plotted, plus enough to settle the filters.
+    padding = FilterPadding(freqmin, freqmax)
+    st = CopyStream(stream.slice(starttime=starttime-padding,
+        endtime=starttime+duration+padding), dtype)
+    if len(st) == 0:
+        return      # no data to plot
     timefmt = "%H:%M UTC"
+    if(not units):
+        scale = None
     if(scale and scale < 1e-6):
         scale_str = "%.0f nm/sec per line" % (scale*1e9)
         scaling = scale / units
@@ -225,120 +540,156 @@ def Helicorder(stream, filename, location, starttime, duration, freqmin=0,
     title = '%s' % st[0].id
     subtitle = '%s. %s. Yuma-2 v4.0. %sScale %s.' % \
         (starttime.date, location, filter_str, scale_str)
-    titlestr = r'\begin{center}{\textbf{%s\\}}%s\end{center}' % \
-        (title, subtitle)
+    titlestr = PlotTitle(title, [subtitle])
 
     if(freqmin != 0 and freqmax != 0):
-	# Obspy docs say data should be detrended before filtering to avoid
-	# 'massive artifacts'.
-        st.detrend(type='demean')
-        #st.detrend(type='simple')
-
-        #st.filter("bandpass", freqmin=freqmin, freqmax=freqmax, corners=4, 
-            #zerophase=True)
-	# Use 2nd order HP and 8th order LP to match filter done in WinSDR.
-        st.filter("highpass", freq=freqmin, corners=2, zerophase=True)
-        st.filter("lowpass", freq=freqmax, corners=8, zerophase=True)
+        with Stage('filter'):
+		# Obspy docs say data should be detrended before filtering to avoid
+		# 'massive artifacts'.
+            DemeanStream(st)
+            #st.detrend(type='simple')
+
+            #st.filter("bandpass", freqmin=freqmin, freqmax=freqmax, corners=4, 
+                #zerophase=True)
+		# Use 2nd order HP and 8th order LP to match filter done in WinSDR.
+            FilterStream(st, "highpass", freq=freqmin, corners=2, zerophase=True,
+                dtype=dtype)
+            FilterStream(st, "lowpass", freq=freqmax, corners=8, zerophase=True,
+                dtype=dtype)
     if(decimation > 1):
         st.decimate(decimation, no_filter=True)
 
-    fig = st.plot(type='dayplot', dpi=200, linewidth=0.15, 
-            vertical_scaling_range=scaling, size=(1600,1200), interval=60, 
-            handle=True, number_of_ticks=7, 
-            starttime=starttime, endtime=starttime+duration,
-            right_vertical_labels=False, one_tick_per_line=True, 
-            show_y_UTC_label=False, tick_format=timefmt, title=titlestr, 
-            subplots_adjust_top=0.93, subplots_adjust_bottom=0.05,
-            subplots_adjust_left=0.1, subplots_adjust_right=0.98, 
-            events=events)
-
-    fig.axes[0].set_xlabel('')
-
-    # Add any other drawing here.
-    FixupAnnotations(fig)
-
-    # Make event markers semi-transparent yellow.
-    ax = fig.gca()
-    for l in ax.lines:
-        l._markerfacecolor = (1, 1, 0, 0.7)
-        l._markeredgecolor = (1, 1, 0, 0.5)
-
-    fig.canvas.draw()
-    fig.savefig(filename, bbox_inches='tight')
-    #fig.savefig(filename)
-    plt.pyplot.clf()
-    plt.pyplot.close(fig)
+    with Stage('render'):
+        fig = st.plot(type='dayplot', dpi=200, linewidth=0.15, 
+                vertical_scaling_range=scaling, size=(1600,1200), interval=60, 
+                handle=True, number_of_ticks=7, 
+                starttime=starttime, endtime=starttime+duration,
+                right_vertical_labels=False, one_tick_per_line=True, 
+                show_y_UTC_label=False, tick_format=timefmt, title=titlestr, 
+                subplots_adjust_top=0.93, subplots_adjust_bottom=0.05,
+                subplots_adjust_left=0.1, subplots_adjust_right=0.98, 
+                events=events)
+
+        fig.axes[0].set_xlabel('')
+
+        # Add any other drawing here.
+        FixupAnnotations(fig)
+
+        # Make event markers semi-transparent yellow.
+        ax = fig.gca()
+        for l in ax.lines:
+            l._markerfacecolor = (1, 1, 0, 0.7)
+            l._markeredgecolor = (1, 1, 0, 0.5)
+
+        fig.canvas.draw()
+        fig.savefig(filename, bbox_inches='tight')
+        #fig.savefig(filename)
+    plt.clf()
+    plt.close(fig)
 
 # Make a spectrogram plot and save to file.
+@Traced(label=_PlotFilename)
 def Spectrogram(stream, filename, starttime, duration, title=None, freqmin=0, 
-        freqmax=0, decimation=1, per_lap=0.95, wlen=300.0, vline=None):
+        freqmax=0, decimation=1, per_lap=0.95, wlen=300.0, vline=None,
+        dtype=None):
+    import matplotlib.pyplot as plt
     print("Plotting spectrogram ", filename)
-    st = stream.copy()
-    # Filter first, then slice, to minimize filter startup transient.
-    if freqmin != 0:
-        st.filter("highpass", freq=freqmin, corners=2, zerophase=True)
-    if freqmax != 0:
-        st.filter("lowpass", freq=freqmax, corners=8, zerophase=True)
-    st = st.slice(starttime=starttime, endtime=starttime+duration)
+    # Copy only the time window, plus enough data on each side to filter first
+    # and then trim, to minimize filter startup transient.
+    padding = FilterPadding(freqmin, freqmax)
+    st = CopyStream(stream.slice(starttime=starttime-padding,
+        endtime=starttime+duration+padding), dtype)
+    with Stage('filter'):
+        if(freqmin != 0 or freqmax != 0):
+            # Obspy docs say data should be detrended before filtering to avoid
+            # 'massive artifacts'.
+            DemeanStream(st)
+        if freqmin != 0:
+            FilterStream(st, "highpass", freq=freqmin, corners=2,
+                zerophase=True, dtype=dtype)
+        if freqmax != 0:
+            FilterStream(st, "lowpass", freq=freqmax, corners=8,
+                zerophase=True, dtype=dtype)
+    st.trim(starttime=starttime, endtime=starttime+duration)
     if(st == None or len(st) == 0):
         return      # no data to plot
     if(decimation > 1):
         st.decimate(decimation, no_filter=True)
 
-    plt.rc('text', usetex=True)     # use LaTex tags
-    title_str = '%s' % st[0].id
-    subtitle = ''
+    subtitle = []
     if(title):
-        subtitle += title + r'\\'
-    subtitle += 't0 = ' + str(st[0].stats.starttime)
-    title_str = r'\begin{center}{\textbf{%s\\}}%s\end{center}' % \
-        (title_str, subtitle)
+        subtitle.append(title)
+    subtitle.append('t0 = ' + str(st[0].stats.starttime))
+    title_str = PlotTitle('%s' % st[0].id, subtitle)
 
     # Don't plot to file immediately. Set the ylimit and title manually.
-    fig = st.spectrogram(log=False, per_lap=per_lap, wlen=wlen, dbscale=False,
-        clip=[0, 0.05], show=False)
-    fig = fig[0]
-    ax = fig.axes[0]
-    if freqmax != 0:
-        ax.set_ylim(0, freqmax)
-    ax.set_xlim(wlen/2, duration-wlen/2)
-    ax.set_title(title_str, wrap=True)
-    if vline != None:
-        ax.axvline(x=vline, ls=(0, (5, 10)), color='white', lw=0.8, 
-            label='Expected arrival')
-        ax.legend(loc='upper right')
-    fig.canvas.draw()
-    fig.savefig(filename, bbox_inches='tight')
-    plt.pyplot.clf()
-    plt.pyplot.close(fig)
-
-# Use the earth model to estimate arrival times of events.
+    with Stage('spectrogram'):
+        fig = SpectrogramFigure(st[0], per_lap=per_lap, wlen=wlen,
+            dbscale=False, clip=[0, 0.05], dtype=dtype)
+    with Stage('render'):
+        ax = fig.axes[0]
+        if freqmax != 0:
+            ax.set_ylim(0, freqmax)
+        ax.set_xlim(wlen/2, duration-wlen/2)
+        ax.set_title(title_str, wrap=True)
+        if vline != None:
+            ax.axvline(x=vline, ls=(0, (5, 10)), color='white', lw=0.8, 
+                label='Expected arrival')
+            ax.legend(loc='upper right')
+        fig.canvas.draw()
+        fig.savefig(filename, bbox_inches='tight')
+    plt.clf()
+    plt.close(fig)
+
+# Loading the earth model is slow, so share one instance.
+_taup_model = None
+def GetTauPyModel():
+    global _taup_model
+    if _taup_model is None:
+        from obspy.taup.tau import TauPyModel
+        _taup_model = TauPyModel()
+    return _taup_model
+
+# Use the earth model to estimate the arrival times of one event at site
+# (lat, lon). Returns (event_time, desc, first_arrival, arrival_rayleigh), or
+# None if the event location is incomplete.
+def _EventArrivals(e, site):
+    if e.origins[0].depth == None or e.origins[0].longitude == None or \
+       e.origins[0].latitude == None:
+        return None
+    model = GetTauPyModel()
+    arrivals = model.get_travel_times_geo(e.origins[0].depth/1000,
+            e.origins[0].latitude, e.origins[0].longitude, site[0], site[1],
+            phase_list=["P", "S"])
+    (d, a, z) = gps2dist_azimuth(site[0], site[1],
+                    e.origins[0].latitude, e.origins[0].longitude)
+    # First arrival of any phase (taup returns sorted by time).
+    first_time = arrivals[0].time if arrivals else 0
+    desc = '%s, %.1f %s, %.0f km away' % (e.event_descriptions[0].text,
+            e.magnitudes[0].mag, e.magnitudes[0].magnitude_type, d/1000)
+    # Rayleigh travel time approxmately 4.0 km/sec
+    return (e.origins[0].time, desc, e.origins[0].time + first_time,
+            e.origins[0].time + d/1000 / 4.0)
+
+# Use the earth model to estimate arrival times of events at site (lat, lon).
 # Returns (event_time, desc, first_arrival, arrival_rayleigh)[]
-def GetArrivalTimes(events):
-    event_time = []
-    arrival_first = []
-    arrival_rayleigh = []
-    desc = []
+@Traced(counts=EventCounts)
+def GetArrivalTimes(events, site):
+    arrivals = [_EventArrivals(e, site) for e in events]
+    return [a for a in arrivals if a is not None]
+
+# Same as GetArrivalTimes(), but returns a dict keyed by the event resource id,
+# so arrivals for one site can be looked up for any subset of the events.
+@Traced(name='GetArrivalTimes', counts=EventCounts)
+def GetArrivalTable(events, site):
+    table = {}
     for e in events:
-        if e.origins[0].depth == None or e.origins[0].longitude == None or \
-           e.origins[0].latitude == None:
+        if e.resource_id.id in table:
             continue
-        model = TauPyModel()
-        arrivals = model.get_travel_times_geo(e.origins[0].depth/1000,
-                e.origins[0].latitude, e.origins[0].longitude, site[0], site[1],
-                phase_list=["P", "S"])
-        (d, a, z) = gps2dist_azimuth(site[0], site[1],
-                        e.origins[0].latitude, e.origins[0].longitude)
-        event_time.append(e.origins[0].time)
-        # First arrival of any phase (taup returns sorted by time).
-        first_time = arrivals[0].time if arrivals else 0
-        arrival_first.append(e.origins[0].time + first_time)
-        # Rayleigh travel time approxmately 4.0 km/sec
-        arrival_rayleigh.append(e.origins[0].time + d/1000 / 4.0)
-        desc.append('%s, %.1f %s, %.0f km away' %
-                (e.event_descriptions[0].text, e.magnitudes[0].mag,
-                e.magnitudes[0].magnitude_type, d/1000))
-    return zip(event_time, desc, arrival_first, arrival_rayleigh)
+        arrival = _EventArrivals(e, site)
+        if arrival is not None:
+            table[e.resource_id.id] = arrival
+    return table
 
 ## Use the earth model to estimate arrival times of event.
 ## Returns array of (event, desc, times[])
@@ -378,7 +729,7 @@ def GetAllArrivalTimes(event, site):
         event.origins[0].latitude == None:
             return None
     else:
-        model = TauPyModel()
+        model = GetTauPyModel()
         arrivals = model.get_travel_times_geo(
                 event.origins[0].depth/1000, 
                 event.origins[0].latitude, 
@@ -403,47 +754,108 @@ def GetAllArrivalTimes(event, site):
 
 ################################################################################
 
-# This hack is a direct way to convert raw values to temperature.
-def convert_raw_to_temperature(station, data):
-    # Hack - different conversion factors for different digitizers
-    if station == 'OMDBO' or station == 'BCCWA':
-        # For PSN-ADC24
-        divider = 1.0           # for temperature channel
+# Fast response for the state of health channels (temperature and centering
+# force). These are DC measurements, so the response is a polynomial in the
+# counts: the InstrumentPolynomial for temperature channels, or 1/sensitivity
+# for voltage channels. remove_response() would deconvolve the whole filter
+# chain, which is slow and not implemented for polynomial responses.
+
+# The data files of the state of health channels use older channel codes than
+# the StationXML files.
+channel_aliases = {'LEC': 'LMZ', 'EVT': 'EKS', 'EVC': 'EMZ'}
+
+_polynomials = {}       # (seed id, epoch start) -> coefficients
+
+# Read the StationXML file for a station, {net}_{station}.xml in the script
+# directory unless path is given. Cached by the inventory store.
+def GetStationResponse(net, station, path=None):
+    import os
+    from inventory_store import LoadInventory
+    if path is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+    return LoadInventory(os.path.join(path, '%s_%s.xml' % (net, station)))
+
+# Coefficients, in increasing powers, of the polynomial that converts counts
+# of a channel at a given time to its input units (e.g. degC or V).
+def ResponsePolynomial(inv, seed_id, time):
+    from inventory_store import FindChannel
+    net, station, loc, chan = seed_id.split('.')
+    chan = channel_aliases.get(chan, chan)
+    channel = FindChannel(inv, '%s.%s.%s.%s' % (net, station, loc, chan), time)
+    if channel is None:
+        raise ValueError('No response for %s at %s' % (seed_id, time))
+    key = ('%s.%s.%s.%s' % (net, station, loc, chan), str(channel.start_date))
+    if key in _polynomials:
+        return _polynomials[key]
+
+    response = channel.response
+    stages = response.response_stages
+    if response.instrument_polynomial:
+        coef = response.instrument_polynomial.coefficients
+    elif stages:
+        # The gain of the stages after a polynomial stage scales its input.
+        # Use the stage gains, rather than the sensitivity, which includes
+        # the filter roll-off at the sensitivity frequency.
+        coef = [0.0, 1.0]
+        gain = 1.0
+        for s in reversed(stages):
+            if isinstance(s, PolynomialResponseStage):
+                coef = s.coefficients
+                break
+            gain *= s.stage_gain
+        coef = [c / gain**i for i, c in enumerate(coef)]
     else:
-        # For seiscape2
-        divider = 8.0       
-    vref = 2.5                  # volts
-    temp_scale_factor = 0.01    # volts / deg C (LM35)
-    return data * vref * divider / temp_scale_factor / 2**23 
-
-# This hack is a direct way to convert raw values to voltage.
-def convert_raw_to_voltage(station, data):
-    # Hack - different conversion factors for different digitizers
-    if station == 'OMDBO' or station == 'BCCWA':
-        # For PSN-ADC24
-        divider = 17.0       
+        coef = [0.0, 1.0 / response.instrument_sensitivity.value]
+    _polynomials[key] = np.array(coef, dtype=np.float64)
+    return _polynomials[key]
+
+# Evaluate a polynomial over an array of counts, in the processing precision.
+# Masked samples stay masked.
+def ApplyPolynomial(data, coef, dtype=None):
+    dtype = GetPrecision(dtype)
+    x = np.ma.getdata(data)
+    if len(coef) == 2:
+        y = np.multiply(x, coef[1], dtype=dtype)
+        if coef[0]:
+            y += dtype(coef[0])
     else:
-        # For seiscape2
-        divider = 8.0       
-    vref = 2.5                  # volts
-    return data * vref * divider / 2**23 
+        x = x.astype(dtype)
+        y = np.full(x.shape, coef[-1], dtype=dtype)
+        for c in coef[-2::-1]:
+            y *= x
+            y += dtype(c)
+    if np.ma.isMaskedArray(data):
+        return np.ma.masked_array(y, mask=np.ma.getmaskarray(data))
+    return y
+
+# Convert the counts of each trace to physical units, in place, using the
+# response in inv. Defaults to the StationXML file of each trace's station.
+def ConvertStream(st, inv=None, dtype=None):
+    inventories = {}        # (network, station) -> inventory
+    for tr in st:
+        stats = tr.stats
+        station_inv = inv
+        if station_inv is None:
+            key = (stats.network, stats.station)
+            if key not in inventories:
+                inventories[key] = GetStationResponse(*key)
+            station_inv = inventories[key]
+        coef = ResponsePolynomial(station_inv, tr.id, stats.starttime)
+        tr.data = ApplyPolynomial(tr.data, coef, dtype)
+    return st
 
 def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, endtime):
-    # Read the response file containing the response data for this channel.         
-    #response_file = '{}_{}.xml'.format(net, station)
-    #inv = read_inventory(response_file)
-    #print('inv:', inv[0][0][0].response)
-                                          
+    from matplotlib.dates import HourLocator
+    import matplotlib.pyplot as plt
+
+    inv = GetStationResponse(net, station)
+
     st_evc = GetLocalDataRange(net, station, loc, chan_cf, starttime, endtime)
     st_evc.merge()
     st_evc.trim(starttime=starttime, endtime=endtime)
     print(st_evc.__str__(extended=True))
 
-    # This is extremely slow and PolynomialResponse not implemented yet, so
-    # just manually convert to temperature.
-    #st_evc.attach_response(inv)
-    #st_evc.remove_response(inventory=inv)
-    st_evc[0].data = convert_raw_to_voltage(station, st_evc[0].data)
+    ConvertStream(st_evc, inv)
     min_cf = min(st_evc[0].data)
     max_cf = max(st_evc[0].data)
 
@@ -458,11 +870,7 @@ def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, en
         st_evt.filter('lowpass', freq=0.1, corners=8, zerophase=True) 
     st_evt.trim(starttime=starttime+200, endtime=endtime-200)   # remove filter startup effects
 
-    # This is extremely slow and PolynomialResponse not implemented yet, so
-    # just manually convert to temperature.
-    #st_evt.attach_response(inv)
-    #st_evt.remove_response(inventory=inv)
-    st_evt[0].data = convert_raw_to_temperature(station, st_evt[0].data)
+    ConvertStream(st_evt, inv)
     min_temp = min(st_evt[0].data)
     max_temp = max(st_evt[0].data)
     hours = round((st_evt[0].stats.endtime - st_evt[0].stats.starttime) / 3600.0)
@@ -500,50 +908,10 @@ def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, en
 
 # Return a list of velocity PSD values (period / value) for the NLNM and NHNM.
 def get_nlnm_nhnm_velocity():
-
-    # Velocity PSD of the USGS New low noise model 
-    # dB relative to (1 m/s)^2/Hz
-    # from
-    # http://gfzpublic.gfz-potsdam.de/pubman/item/escidoc:4017:4/component/escidoc:4018/Chapter_4_rev1.pdf
-    # period, velocity noise
-    nlnm_vel =  	[(0.1, -203.9), (0.17, -198.1), (0.4, -190.6), (0.8, -187.1), (1.24, -177.8),
-             (2.40, -157.0), (4.3, -144.4), (5.0, -143.1), (6.0, -149.4), (10.0, -159.7),
-             (12.0, -160.6), (15.6, -154.2), (21.9, -166.7), (31.6, -171.0), (45.0, -170.4),
-             (70.0, -166.6), (101.0, -160.9), (154.0, -157.2), (328.0, -153.1), (600.0, -144.8),
-             (10000, -87.9), (100000, -19.1)]
-
-    # Velocity PSD of the USGS New high noise model 
-    # dB relative to (1 m/s)^2/Hz
-    # from
-    # http://gfzpublic.gfz-potsdam.de/pubman/item/escidoc:4017:4/component/escidoc:4018/Chapter_4_rev1.pdf
-    # period, velocity noise
-    nhnm_vel =  	[(0.1, -127.5), (0.22, -126.5), (0.32, -136.4), (0.80, -137.9), (3.80, -102.4),
-             (4.60, -99.2), (6.3, -101.0), (7.9, -111.5), (15.4, -112.2), (20.0, -128.4),
-             (354.8, -91.0), (10000, -16.1), (100000, 35.5)]
-
+    from noise_models import nlnm_vel, nhnm_vel
     return nlnm_vel, nhnm_vel
 
 # Return a list of acceleration PSD values (period / value) for the NLNM and NHNM.
 def get_nlnm_nhnm_acceleration():
-
-    # Acceleration PSD of the USGS New low noise model 
-    # dB relative to (1 m/s^2)^2/Hz
-    # from
-    # http://gfzpublic.gfz-potsdam.de/pubman/item/escidoc:4017:4/component/escidoc:4018/Chapter_4_rev1.pdf
-    # period, velocity noise
-    nlnm_accel =  [(0.1, -168.0), (0.17, -166.7), (0.4, -166.7), (0.8, -169.2), (1.24, -163.7),
-         (2.40, -148.6), (4.3, -141.1), (5.0, -141.1), (6.0, -149.0), (10.0, -163.8),
-         (12.0, -166.2), (15.6, -162.1), (21.9, -177.5), (31.6, -185.0), (45.0, -187.5),
-         (70.0, -187.5), (101.0, -185.0), (154.0, -185.0), (328.0, -187.5), (600.0, -184.4),
-         (10000, -151.9), (100000, -103.1)]
-
-    # Acceleration PSD of the USGS New high noise model 
-    # dB relative to (1 m/s^2)^2/Hz
-    # from
-    # http://gfzpublic.gfz-potsdam.de/pubman/item/escidoc:4017:4/component/escidoc:4018/Chapter_4_rev1.pdf
-    # period, velocity noise
-    nhnm_accel =  [(0.1, -91.5), (0.22, -97.4), (0.32, -110.5), (0.80, -120.0), (3.80, -98.0),
-         (4.60, -96.5), (6.3, -101.0), (7.9, -113.5), (15.4, -120.0), (20.0, -138.5),
-         (354.8, -126.0), (10000, -80.1), (100000, -48.5)]
-
+    from noise_models import nlnm_accel, nhnm_accel
     return nlnm_accel, nhnm_accel
@@ -23,50 +23,24 @@
 
 import numpy as np
 import matplotlib.pylab as plt
-import matplotlib.mlab as mlb
 import scipy.signal as signal
-import scipy.io.wavfile as wavfile
 import argparse
 import sys
-import dateutil
+import dateutil.parser
 import math
 
+sys.path.append('.')
+from filter_design import FirFilter, DecimationFir, PlotResponse
+from sonify import Sonify, ArrayChunks
 
-# Plot frequency and phase response
-def mfreqz(b,a=1):
-	w,h = signal.freqz(b,a)
-	h_dB = 20 * np.log10 (abs(h))
-	plt.subplot(211)
-	plt.plot(w/max(w),h_dB)
-	plt.ylim(-150, 5)
-	plt.ylabel('Magnitude (db)')
-	plt.xlabel(r'Normalized Frequency (x$\pi$rad/sample)')
-	plt.title(r'Frequency response')
-	plt.subplot(212)
-	h_Phase = np.unwrap(np.arctan2(np.imag(h),np.real(h)))
-	plt.plot(w/max(w),h_Phase)
-	plt.ylabel('Phase (radians)')
-	plt.xlabel(r'Normalized Frequency (x$\pi$rad/sample)')
-	plt.title(r'Phase response')
-	plt.subplots_adjust(hspace=0.5)
-
-# FIR linear phase filter
+
+# FIR linear phase filter. The filter design comes from filter_design, so it
+# is only computed once for a given order and cutoffs.
 # fixme - use a polyphase filter bank to decimate and filter
 def filter_fir(data, order, fs):
-	n = order
-	a = np.zeros(n)
-	b = np.zeros(n)
-	# Lowpass filter
-	if args.lowpass:
-		a = signal.firwin(n, cutoff = args.lowpass/(fs/2), window = 'blackmanharris')
-	# Highpass filter with spectral inversion
-	if args.highpass:
-		b = - signal.firwin(n, cutoff = args.highpass/(fs/2), window = 'blackmanharris'); 
-		b[n/2] = b[n/2] + 1
-	# Combine into a bandpass filter
-	d = - (a+b); d[n/2] = d[n/2] + 1
+	d = FirFilter(order, fs, lowpass=args.lowpass, highpass=args.highpass)
 	if args.response:
-		mfreqz(d)
+		PlotResponse(d, fs, zerophase=True, title='Filter response')
 		plt.show()
 	output_signal = signal.filtfilt(d, 1, data)	# applied forwards/backwards, linear phase, no lag
 	return output_signal
@@ -77,12 +51,11 @@ def decimate(t, data, factor, order):
 	t = t[::factor]
 	return t, data
 
-def decimate_nodelay(t, data, factor, order):
-	n = order
+def decimate_nodelay(t, data, factor, order, fs):
 	#Lowpass filter
-	b = signal.firwin(n, cutoff = 0.9/factor, window = 'blackmanharris')
+	b = DecimationFir(factor, order)
 	if args.response:
-		mfreqz(b)
+		PlotResponse(b, fs, zerophase=True, title='Decimation filter response')
 		plt.show()
 	output_signal = signal.filtfilt(b, 1, data)	# apply forward and backwards, zero phase shift
 	output_signal = output_signal[::factor]		# decimate
@@ -112,19 +85,19 @@ def count_lines(fname):
 # fromtxt took over a minute
 # this function took 46, 40, 26 seconds for slow, faster, fastest below
 def load_data(filename, delimiter):
-	print 'Counting lines...'
+	print('Counting lines...')
 	lines = count_lines(filename)			# so we can preallocate array
 	data = np.zeros((lines, 2), dtype=float)
 	n = 0
-	print 'Loading data...'
+	print('Loading data...')
 	with open(filename, "r") as file:
 		for line in file:
 			# time, value
 			#data[n] = np.fromstring(line, sep=delimiter)	# slow
 			splitline = line.split(delimiter)
 			#data[n] = np.asarray(splitline)		# faster
-			data[n,0] = np.float(splitline[0])		# fastest
-			data[n,1] = np.float(splitline[1])		# fastest
+			data[n,0] = float(splitline[0])		# fastest
+			data[n,1] = float(splitline[1])		# fastest
 			n = n + 1
 	return data[:,0], data[:,1]
 
@@ -182,14 +155,15 @@ parser.add_argument('--starttime', dest='starttime', default=date,
 	help='start time of the data. Ex: 4/25/15 00:00 UTC')
 parser.add_argument('-c', '--comment', help='Add a comment to the title')
 args = parser.parse_args()
+fs = args.fs
 
 starttime = dateutil.parser.parse(args.starttime) # nice little utility, recognizes time strings
 
 if args.verbose:
 	print(args)
-	print starttime
+	print(starttime)
 
-if args.lowpass >= args.fs/args.decimate/2:
+if args.lowpass != None and args.lowpass >= args.fs/args.decimate/2:
 	print('Lowpass cutoff must be < fs/decimate/2, in this case %.3f Hz!' % (args.fs / args.decimate / 2))
 	sys.exit(1)
 
@@ -202,7 +176,7 @@ t, data = load_data(args.filename, args.delimiter)				# faster, smaller
 # filter / decimate first. Otherwise, it's hard to get a good cutoff with the FIR filter later
 if args.decimate != None:
 	print('Decimating by %d...' % (args.decimate)) 
-	t, data = decimate_nodelay(t, data, args.decimate, args.decimation_order)	 
+	t, data = decimate_nodelay(t, data, args.decimate, args.decimation_order, fs)	 
 	fs = fs/args.decimate
 
 # scale data from ADC counts to real units, in m/sec
@@ -212,7 +186,7 @@ data =  data * args.units
 # filter here...
 if args.lowpass != None or args.highpass != None:
 	print('Applying filter...') 
-	data = filter_fir(data, bandpass_order, fs)
+	data = filter_fir(data, args.bandpass_order, fs)
 
 # scale time to minutes
 t = t / 60
@@ -229,7 +203,7 @@ time_max = index_max / fs		# in seconds
 hour_max = time_max / 3600		
 min_max = (time_max % 3600) / 60
 sec_max = (min_max - int(min_max)) * 60
-print 'Length of data: %d lines, %.2f seconds' % (len(t), t[len(t)-1]-t[0])
+print('Length of data: %d lines, %.2f seconds' % (len(t), t[len(t)-1]-t[0]))
 #print 'maximum %.3f at %.2f seconds' % (data_max, time_max)
 units, factor = nice_units(data_max)
 
@@ -288,8 +262,8 @@ else:
 	hours = int(math.ceil(len(t)/fs/3600))	# round up 
 
 for i in range(0, hours):			
-	hourly_t = t[i*3600*fs:(i+1)*3600*fs]
-	hourly_data = data[i*3600*fs:(i+1)*3600*fs]
+	hourly_t = t[int(i*3600*fs):int((i+1)*3600*fs)]
+	hourly_data = data[int(i*3600*fs):int((i+1)*3600*fs)]
 	max_i = i
 	hour = (starttime.hour+i) % 24
 
@@ -318,6 +292,7 @@ plt.ylim((-(i+1)*scale, scale))
 fig.savefig(args.outfile, dpi=dpi)
 
 # save file as WAV so we can listen to it
-#wavfile.write('output.wav', 8000, 0.95*data/data_max)	# 0.95 is largest amplitude
-wavfile.write('output.wav', 16000, 0.95*data/data_max)	# 0.95 is largest amplitude
+# Written in chunks, without a normalised copy of the data.
+Sonify(ArrayChunks(data), 'output.wav', fs, rate=16000, highpass=None,
+    peak=data_max)	# 0.95 is largest amplitude
 
@@ -1,82 +1,27 @@
 # Read data from Seedlink server and generate daily temperature plot.
 
 from matplotlib.dates import HourLocator
-from obspy.clients.seedlink.basic_client import Client as SeedlinkClient
-from obspy.clients.seedlink.easyseedlink import create_client
-from obspy.clients.fdsn import Client as FdsnClient
-from obspy.geodetics.base import gps2dist_azimuth
-from obspy.core.event import Catalog
-from obspy.core.stream import Stream
-from obspy.taup.tau import TauPyModel
 from obspy import UTCDateTime
-from obspy import read, read_inventory
+import matplotlib
+matplotlib.use('Agg')       # only writes files; skip loading a GUI backend
 import matplotlib.pyplot as plt
 import numpy as np
-import gc
+import sys
 
-################################################################################
+sys.path.append('.')
+from obspy_helpers import FilterStream, GetStationResponse, ConvertStream, \
+    GetLocalDataRange
+from thermal_regression import BlockMeans, LagStats, Fit, TempcoPpm, \
+    UpdateTable, RollingFits
 
-# Read the station data from a local file.
-def GetLocalData(net, station, loc, chan, year=0, doy=0):
-    try:
-        st = read('/data/seismometer_data/mseed/%s.%s.%s.%s.%d.%03d.mseed' % (net, station, loc, chan, year, doy))
-        return st
-    except:
-        return None
-
-def GetLocalDataRange(net, station, loc, chan, starttime, endtime):
-    year = starttime._get_year()
-    doy = starttime._get_julday()
-    end_year = starttime._get_year()
-    end_doy = endtime._get_julday()
-    st = Stream()
-    while True:
-        try:
-            st += GetLocalData(net, station, loc, chan, year, doy)
-            print(st.__str__(extended=True))
-        except Exception as e:
-            print(e)
-        if year == end_year and doy == end_doy:
-            #st.trim(starttime=starttime, endtime=endtime)
-            return st
-        doy += 1
-        if doy >= 366:      # Allow leap years. OK if file doesn't exist.
-            doy = 1
-            year += 1
+################################################################################
 
 def MakeFilename(st, basename, extension):
     return "%s_%s_%s_%s_%s.%s" % (basename, net, station, loc, chan, extension)
 
-def convert_raw_to_temperature(station, data):
-    # Hack - different conversion factors for different digitizers
-    if station == 'OMDBO' or station == 'BCCWA':
-        # For PSN-ADC24
-        # PSN-ADC24 uses 2.5V with ADC gain=1 for temperature channel.
-        divider = 1.0           # for temperature channel
-        vref = 2.5              # volts
-    else:
-        # For seiscape2
-        divider = 8.0
-        vref = 2.5              # volts
-    temp_scale_factor = 0.01    # volts / deg C (LM35)
-    return data * vref * divider / temp_scale_factor / 2**23
-
-
-def convert_raw_to_voltage(station, data):
-    # Hack - different conversion factors for different digitizers
-    if station == 'OMDBO' or station == 'BCCWA':
-        # For PSN-ADC24
-        # PSN-ADC24 uses 1.25V with ADC gain=2 for BHZ and EC channel.
-        divider = 17.0
-        vref = 1.25                 # volts
-    else:
-        # For seiscape2
-        divider = 8.0
-        vref = 2.5                  # volts
-    return data * vref * divider / 2**23
-
 def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, endtime):
     print('Plot temperature plots for {}.{}.{}'.format(net, station, loc))
+    inv = GetStationResponse(net, station)
 
     st_evc = GetLocalDataRange(net, station, loc, chan_cf, starttime, endtime)
     st_evc.merge()
@@ -92,9 +37,7 @@ def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, en
             st.decimate(factor=4, strict_length=False, no_filter=True)
             print(str(st), 'Decimated stream to', st.stats.sampling_rate, 'Hz')
 
-    # remove_response() is extremely slow and PolynomialResponse not
-    # implemented yet, so just manually convert to temperature.
-    st_evc[0].data = convert_raw_to_voltage(station, st_evc[0].data)
+    ConvertStream(st_evc, inv)
     min_cf = min(st_evc[0].data)
     max_cf = max(st_evc[0].data)
     print('after decimation min_cf:', min_cf, 'max_cf:', max_cf)
@@ -115,7 +58,7 @@ def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, en
     # LP filter the temperature to remove some noise.
     # Cannot filter if trace contains gaps (masked).
     if not np.ma.is_masked(st_evt[0].data):
-        st_evt.filter('lowpass', freq=0.1, corners=4, zerophase=True)
+        FilterStream(st_evt, 'lowpass', freq=0.1, corners=4, zerophase=True)
 
     # Remove filter startup effects. Use same times for both streams.
     start = st_evt[0].stats.starttime
@@ -131,11 +74,7 @@ def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, en
     print(st_evt)
     print(st_evc)
 
-    # This is extremely slow and PolynomialResponse not implemented yet, so
-    # just manually convert to temperature.
-    #st_evt.attach_response(inv)
-    #st_evt.remove_response(inventory=inv)
-    st_evt[0].data = convert_raw_to_temperature(station, st_evt[0].data)
+    ConvertStream(st_evt, inv)
     min_temp = min(st_evt[0].data)
     max_temp = max(st_evt[0].data)
     hours = round((st_evt[0].stats.endtime - st_evt[0].stats.starttime) / 3600.0)
@@ -144,40 +83,42 @@ def plot_temperature_and_cf(net, station, loc, chan_temp, chan_cf, starttime, en
     tr_evt = st_evt[0]
     tr_evc = st_evc[0]
 
-    # Compute temperature coefficient by fitting the data.
-    # Does not work if the data contains some Nan values (masked?).
-    # Does not work if the data contains masked values.
-    #if np.isnan(tr_evt.data).any() or np.isnan(tr_evc.data).any():
-    if np.ma.is_masked(tr_evt.data) or np.ma.is_masked(tr_evc.data):
-        print('Skipping temperature coefficient calculation due to NAN values.')
-        skip_tempco = True
-        tempco_ppm = 0
-    elif len(tr_evt.data) != len(tr_evc.data):
-        print('Unable to fit temperature coefficient due to different lengths.')
+    # Compute temperature coefficient by fitting one minute means of the data,
+    # which works with gaps and different sample rates.
+    interval = 60.0
+    nblocks = int((end - start) // interval)
+    x = BlockMeans(st_evt, start, interval, nblocks)
+    y = BlockMeans(st_evc, start, interval, nblocks)
+    slope, intercept, r, n = Fit(LagStats(x, y, [0])[0])
+    if np.isnan(slope):
+        print('Unable to fit temperature coefficient.')
         skip_tempco = True
         tempco_ppm = 0
     else:
-        # FIXME - assumes the same number of points in EVT and EVC.
-        # Won't work if they are different sample rates.
-        coef = np.polyfit(tr_evt.data, tr_evc.data, 1)
-        polynomial = np.poly1d(coef)
-        deltax = max(tr_evt.data)-min(tr_evt.data)
-        xs = np.arange(min(tr_evt.data)-0.1*deltax, max(tr_evt.data)+0.1*deltax, 0.01)
-        ys = polynomial(xs)
-        Ri = 15e3   # appx
-        Gn = 10.6   # appx
-        M0 = 0.0875 # appx
-        tempco_ppm = coef[0] / Ri * Gn / (M0 * 9.81) * 1e6
-        print('Temperature coefficient:', tempco_ppm, 'ppm/°C')
+        deltax = np.nanmax(x) - np.nanmin(x)
+        xs = np.arange(np.nanmin(x)-0.1*deltax, np.nanmax(x)+0.1*deltax, 0.01)
+        ys = slope * xs + intercept
+        tempco_ppm = TempcoPpm(slope)
+        print('Temperature coefficient:', tempco_ppm, 'ppm/°C', 'r:', r)
         skip_tempco = False
 
+    # Keep the per-day statistics up to date, for fits over longer periods.
+    try:
+        table = UpdateTable('thermal_{}_{}_{}.csv'.format(net, station, loc),
+            net, station, loc, chan_temp, chan_cf, starttime, endtime, inv=inv)
+        day, daily, rolling = RollingFits(table, 0)[-1]
+        print('%s 7 day temperature coefficient: %.0f ppm/°C r: %.3f' %
+            (day, TempcoPpm(rolling[0]), rolling[2]))
+    except Exception as e:
+        print('Unable to update the temperature statistics:', repr(e))
+
     fig, axes = plt.subplots(nrows=3, figsize=(12,9))
     fig.set_dpi(100)
     fig.autofmt_xdate()  # ticks slanted to allow for more room
     axes[0].plot(tr_evt.times('matplotlib'), tr_evt.data, color='r', label=tr_evt.id)
     axes[1].plot(tr_evc.times('matplotlib'), tr_evc.data, color='b', label=tr_evc.id)
     if not skip_tempco:
-        axes[2].plot(tr_evt.data, tr_evc.data, color='m', label='CF vs. temperature')
+        axes[2].plot(x, y, color='m', label='CF vs. temperature')
         axes[2].plot(xs, ys, color='k', linestyle='dashed')
     axes[0].set_ylabel('Degrees C')
     axes[1].set_ylabel('Volts')
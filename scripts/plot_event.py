@@ -1,8 +1,18 @@
 # Plot waveforms.
+#
+# With --catalog, plots every catalog event in a time range that passes the
+# --event_filter rules (like the station config's broadband_events). The
+# events are grouped by day and each group is plotted by a worker process:
+# the data of each channel is read once for all of the day's events, and the
+# instrument responses are looked up once per channel and day, for the
+# response epoch of the day, and evaluated once per window length (see
+# RemoveResponse()).
 
 import argparse
 import dateutil
 import datetime
+import os
+from multiprocessing import Pool
 from obspy import UTCDateTime
 from obspy.core.inventory import Inventory, Network, Station, Channel, Site
 from obspy.core.stream import Stream
@@ -11,6 +21,7 @@ from matplotlib.dates import HourLocator, MinuteLocator, SecondLocator, num2date
 import sys
 sys.path.append('.')
 from  obspy_helpers import *
+from inventory_store import LoadInventory, FindResponse
 
 ################################################################################
 
@@ -21,174 +32,48 @@ path = '/data/seismometer_data/mseed'
 outfile = 'event.png'
 dpi = 150
 
-# Parse command line arguments.
-desc = \
-'''
-Generate seismic plot covering a certain time period.
-  Methods:
-    1) specify --starttime and --endtime.
-    2) specify --eventtime and --event_search_time. Optionally --before_event and --after_event.
+################################################################################
 
-  May specify multiple channels.
+# Read the data of the channels ('NET.STA.LOC.CHAN') from starttime to endtime.
+def ReadChannels(channels, starttime, endtime, server='', path=None):
+    st = Stream()
+    for c in channels:
+        # Format is like this: AM_GBLCO_01_BHZ
+        net, station, loc, chan = c.split('.')
 
-Example: python %s --server archive.local:18000 --channel "AM.OMDBO.01.BHZ" --starttime "2024-07-31T04:30:00"
-''' % (sys.argv[0])
-
-parser = argparse.ArgumentParser(description=desc,
-    formatter_class=argparse.RawDescriptionHelpFormatter)
-parser.add_argument('--server', type=str, default='',
-    help='Seedlink server name.')
-parser.add_argument('--width', type=int, default=1400,
-    help='Width of plot in pixels.')
-parser.add_argument('--height', type=int, default=600,
-    help='Height of plot in pixels.')
-parser.add_argument('--path', dest='path', default=path,
-    help='Path to the directory of the MiniSEED files.')
-parser.add_argument('--outfile', dest='outfile', default=outfile,
-	help='Output filename (default is {}).'.format(outfile))
-parser.add_argument('--dpi', type=int, default=dpi,
-    help='Pixels per inch ({} default).'.format(dpi))
-parser.add_argument('--lowpass', type=float, dest='lowpass',
-    default=None, help='Low-pass filter corner frequency.')
-parser.add_argument('--highpass', type=float, dest='highpass',
-    default=None, help='High-pass filter corner frequency.')
-parser.add_argument('--starttime', dest='starttime', default=None,
-	help='Start time of the data. Ex: 4/25/15 00:00 UTC')
-parser.add_argument('--endtime', dest='endtime', default=None,
-	help='End time of the data. Ex: 4/26/15 00:00 UTC')
-parser.add_argument('--eventtime', dest='eventtime', default=None,
-	help='Approximate time of the event. Ex: 4/26/15 00:00 UTC')
-parser.add_argument('--before', type=float, dest='before', default=60,
-	help='Plot this number of seconds before the first event arrival.')
-parser.add_argument('--after', type=float, dest='after', default=5*60,
-	help='Plot this number of seconds after the first event arrival.')
-parser.add_argument('--search_time', type=float, dest='search_time', default=60,
-	help='Duration in seconds before and after the event to use when searching the event catalog.')
-parser.add_argument('--min_magnitude', type=float, dest='min_magnitude', default=3.0,
-	help='Minimum magnitude to use when searching the event catalog.')
-parser.add_argument('--channel', action='append', dest='channel', default=None,
-    help='NETWORK.STATION.LOCATION.CHANNEL format. Multiple channels may be specified.')
-parser.add_argument('--no_detrend', dest='no_detrend', action='store_true',
-    help='Do not detrend / demean the data.')
-parser.add_argument('--deconvolve', dest='deconvolve', action='store_true', 
-    help='Deconvolve to remove the instrument response.')
-parser.add_argument('--wavfile', dest='wavfile', default=None,
-    help='Save data to an audio WAV file.')
-parser.add_argument('--wavrate', type=float, dest='wavrate', default=8000,
-    help='Set the WAV file sample rate.')
-parser.add_argument('-v', '--verbose', action='count',
-    help='Increase verbosity.')
-args = parser.parse_args()
-
-arrivals = None
-deconvolved = False
-
-if args.verbose:
-	print(args)
-
-if args.starttime and args.endtime:
-    starttime = UTCDateTime(dateutil.parser.parse(args.starttime))
-    endtime = UTCDateTime(dateutil.parser.parse(args.endtime))
-
-elif args.eventtime:
-    search_eventtime = UTCDateTime(dateutil.parser.parse(args.eventtime))
-    start = search_eventtime - args.search_time
-    stop  = search_eventtime + args.search_time
-
-    # Find events in this time window.
-    events = GetEvents(start, stop, args.min_magnitude)
-    if events is None or len(events) == 0:
-        print('No events found near', search_eventtime)
-        exit(0)
-    print('{} events found:'.format(len(events)))
-    print(events.__str__(print_all=True))
-
-    # Choose the event with the largest magnitude.
-    index = np.argmax([e.magnitudes[0].mag for e in events])
-    print('Choosing event:', events[index])
-
-    # Get all the arrivals for this event. Choose the earliest.
-    # FIXME - these will be specific to one site. Make one per site.
-    # FIXME - get site from the channel response data instead.
-    eventtime, desc, arrivals, arrival_rayleigh  = GetAllArrivalTimes(events[index], site)
-    earliest = min([a.time for a in arrivals])
-
-    starttime = eventtime + earliest - args.before
-    endtime = eventtime + earliest + args.after
-
-else:
-    print('Must specify either (--starttime and --endtime) or --eventtime.')
-    parser.print_usage()
-    exit(1)
-
-print("Using data from startime:", starttime, "to endtime:", endtime)
-
-# If we're filtering, extend the start/end times to account for filter
-# transients which we will later trim off. We extend on both sides because the
-# filtering will be done as 'zerophase'.
-prefix = 1
-if args.lowpass is not None:
-    t = 4.0 / args.lowpass
-    if t < 1.0:
-        t = 1.0
-    if prefix < t:
-        prefix = t
-if args.highpass is not None:
-    t = 4.0 / args.highpass
-    if t < 1.0:
-        t = 1.0
-    if prefix < t:
-        prefix = t
-print('Adding', prefix, 'seconds to the requested start/end times to account for filtering.')
-
-# Add channels.
-if args.channel is None or len(args.channel) == 0:
-    print('Must provide at least one --channel.')
-    parser.print_usage()
-    exit(1)
-
-# Read the channel data.
-st = Stream()
-for c in args.channel:
-    # Format is like this: AM_GBLCO_01_BHZ
-    net, station, loc, chan = c.split('.')
-
-    # Use a seedlink server.
-    if len(args.server) > 0:
-        st += GetData(args.server, net, station, loc, chan, starttime-prefix, endtime+prefix)
-
-    # Else, use local files for our known channels.
-    elif net == 'AM' and station in ['BCCWA', 'OMDBO', 'GBLCO', 'XXXXX']:
-        st += GetLocalDataRange(net, station, loc, chan, starttime-prefix, endtime+prefix)
-
-    # Else, try to get the data from IRIS.
-    else:
-        st += GetIrisDataRange(net, station, loc, chan, starttime-prefix, endtime+prefix)
-
-
-# Clean up the trace(s).
-st.merge(method=0, fill_value='interpolate')
-st.trim(starttime=starttime-prefix, endtime=endtime+prefix)
-if not args.no_detrend:
-    st = st.detrend()
-print('Streams:\n', st.__str__(extended=True))
-
-# Read the instrument response and deconvolve:
-inv = None
-deconvolved_str = ''
-if args.deconvolve:
-    inv = Inventory()
-    for c in args.channel:
+        # Use a seedlink server.
+        if len(server) > 0:
+            st += GetData(server, net, station, loc, chan, starttime, endtime)
+
+        # Else, use local files for our known channels.
+        elif net == 'AM' and station in ['BCCWA', 'OMDBO', 'GBLCO', 'XXXXX']:
+            st += GetLocalDataRange(net, station, loc, chan, starttime,
+                endtime, path)
+
+        # Else, try to get the data from IRIS.
+        else:
+            st += GetIrisDataRange(net, station, loc, chan, starttime, endtime)
+    return st
+
+# Read the instrument responses of the channels at starttime. Returns a dict of
+# channel: response.
+def GetResponses(channels, starttime, endtime):
+    responses = {}
+    for c in channels:
         # Format is like this: AM.GBLCO.01.BHZ
         net, station, loc, chan = c.split('.')
         got_resp = False
 
-        # Try reading from local file first.
+        # Try reading from local file first. The inventory store parses each
+        # file once, and keeps it until the file changes.
         try:
             fname = '{}_{}.xml'.format(net, station)
-            inv += read_inventory(fname)
-            print('Read instrument response from local file:', fname)
-            got_resp = True
+            responses[c] = FindResponse(LoadInventory(fname), c, starttime)
+            if responses[c]:
+                print('Read instrument response from local file:', fname)
+                got_resp = True
+            else:
+                print('No response for {} in {}'.format(c, fname))
         except Exception as e:
             print('While trying to read response file:', e)
 
@@ -196,82 +81,354 @@ if args.deconvolve:
         if not got_resp:
             try:
                 print('Trying to read instrument response for {}.{}.{}.{} from IRIS.'.format(net, station, loc, chan))
-                inv_iris = GetIrisResponse(net, station, loc, chan, starttime-prefix, endtime+prefix)
+                inv_iris = GetIrisResponse(net, station, loc, chan, starttime, endtime)
                 got_resp = True
                 print('Read instrument response for {}.{}.{}.{} from IRIS.'.format(net, station, loc, chan))
                 fname = '{}_{}.xml'.format(net, station)
                 inv_iris.write(fname, format='STATIONXML')
                 print('Wrote instrument response to local file:', fname)
-                inv += inv_iris
+                responses[c] = FindResponse(inv_iris, c, starttime)
             except Exception as e:
                 print('While trying to getting response file from IRIS:', e)
+    return responses
+
+# Clean up, deconvolve (if responses are given) and filter the stream read from
+# starttime-prefix to endtime+prefix, and trim it to starttime to endtime.
+# Returns (stream, notes for the title, whether it was deconvolved).
+def ProcessStream(st, starttime, endtime, prefix, detrend=True, responses=None,
+        highpass=None, lowpass=None):
+    # Clean up the trace(s).
+    st.merge(method=0, fill_value='interpolate')
+    st.trim(starttime=starttime-prefix, endtime=endtime+prefix)
+    ToPrecision(st)
+    if detrend:
+        st = ToPrecision(st.detrend())
+    print('Streams:\n', st.__str__(extended=True))
 
     # Deconvolve.
     # FIXME - bandpass to avoid adding noise due to deconvolution?
-    for s in st:
-        try:
-            print('Removing instrument response for', s.id, '...')
-            s.remove_response(inventory=inv)
-            deconvolved = True
-            deconvolved_str = 'Deconvolved. '
-        except Exception as e:
-            print('Failed removing instrument response for', s.id)
-
-# Filter the data.
-filter_str = ''
-if args.highpass is not None:
-    print('Applying high pass filter...')
-    st.filter('highpass', freq=args.highpass, corners=4, zerophase=True)
-    filter_str = 'HP={:.3f} Hz. '.format(args.highpass)
-if args.lowpass is not None:
-    print('Applying low pass filter...')
-    st.filter('lowpass', freq=args.lowpass, corners=4, zerophase=True)
-    filter_str += 'LP={:.2f} Hz. '.format(args.lowpass)
-
-# Trim to the requested start/end time.
-st.trim(starttime=starttime, endtime=endtime)
-
-# Plot
-print('Plotting streams as {}:\n'.format(args.outfile), st.__str__(extended=True))
-fig = st.plot(show=False, size=(args.width,args.height), equal_scale=True, linewidth=1.0, color='blue')
-ax = fig.gca()
-if arrivals:
-    for ax in fig.axes:
-        ax.axvline(eventtime.datetime, linestyle='-', label='Event', alpha=0.5, linewidth=0.5, color = next(ax._get_lines.prop_cycler)['color'])
-    for a in arrivals:
-        t = eventtime + a.time
-        name = str(a.name)
+    deconvolved = False
+    deconvolved_str = ''
+    if responses is not None:
+        for s in st:
+            try:
+                print('Removing instrument response for', s.id, '...')
+                RemoveResponse(s, responses[s.id])
+                ToPrecision([s])
+                deconvolved = True
+                deconvolved_str = 'Deconvolved. '
+            except Exception as e:
+                print('Failed removing instrument response for', s.id)
+
+    # Filter the data.
+    filter_str = ''
+    if highpass is not None:
+        print('Applying high pass filter...')
+        FilterStream(st, 'highpass', freq=highpass, corners=4, zerophase=True)
+        filter_str = 'HP={:.3f} Hz. '.format(highpass)
+    if lowpass is not None:
+        print('Applying low pass filter...')
+        FilterStream(st, 'lowpass', freq=lowpass, corners=4, zerophase=True)
+        filter_str += 'LP={:.2f} Hz. '.format(lowpass)
+
+    # Trim to the requested start/end time.
+    st.trim(starttime=starttime, endtime=endtime)
+    return st, filter_str + deconvolved_str, deconvolved
+
+# Plot the stream to outfile. For an event, mark the event time and the
+# arrivals (from GetAllArrivalTimes()) and add a title with its description.
+def PlotStream(st, outfile, width, height, notes='', deconvolved=False,
+        eventtime=None, desc=None, arrivals=None):
+    import matplotlib.pyplot as plt
+    print('Plotting streams as {}:\n'.format(outfile), st.__str__(extended=True))
+    fig = st.plot(show=False, size=(width,height), equal_scale=True, linewidth=1.0, color='blue')
+    ax = fig.gca()
+    if arrivals:
+        # One color per line, the same in each axes.
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
         for ax in fig.axes:
-            # Skip arrivals that are outside the plot boundaries.
-            # Compare matplot dates to UTCDateTime
-            xlim = num2date(ax.get_xlim())
-            if t.datetime.replace(tzinfo=datetime.timezone.utc) < xlim[0] or \
-               t.datetime.replace(tzinfo=datetime.timezone.utc) > xlim[1]:
-                print('skipping arrival at', t)
-                continue
-            ax.axvline(t.datetime, linestyle='--', label=name, alpha=0.5, linewidth=0.5, color = next(ax._get_lines.prop_cycler)['color'])
-            ax.grid(which='minor', linestyle='dashed')
-            ax.grid(which='major')
-            #ax.xaxis.set_minor_locator(SecondLocator(range(0, 60, 10)))
-            #ax.xaxis.set_major_locator(MinuteLocator(range(0, 60, 1)))
-    title_str = desc + '\nEvent time: ' + eventtime.datetime.isoformat() + '. '
-    title_str += filter_str + deconvolved_str
-    fig.suptitle(title_str)
-    ax.legend(loc='upper right')
-
-for ax in fig.axes:
-    ax.grid()
-
-if deconvolved:
-    for ax in fig.axes:
-        ax.set_ylabel('m/sec')
-else:
+            ax.axvline(eventtime.datetime, linestyle='-', label='Event', alpha=0.5, linewidth=0.5, color = colors[0])
+        for i, a in enumerate(arrivals):
+            t = eventtime + a.time
+            name = str(a.name)
+            for ax in fig.axes:
+                # Skip arrivals that are outside the plot boundaries.
+                # Compare matplot dates to UTCDateTime
+                xlim = num2date(ax.get_xlim())
+                if t.datetime.replace(tzinfo=datetime.timezone.utc) < xlim[0] or \
+                   t.datetime.replace(tzinfo=datetime.timezone.utc) > xlim[1]:
+                    print('skipping arrival at', t)
+                    continue
+                ax.axvline(t.datetime, linestyle='--', label=name, alpha=0.5, linewidth=0.5, color = colors[(i + 1) % len(colors)])
+                ax.grid(which='minor', linestyle='dashed')
+                ax.grid(which='major')
+                #ax.xaxis.set_minor_locator(SecondLocator(range(0, 60, 10)))
+                #ax.xaxis.set_major_locator(MinuteLocator(range(0, 60, 1)))
+        title_str = desc + '\nEvent time: ' + eventtime.datetime.isoformat() + '. '
+        title_str += notes
+        fig.suptitle(title_str)
+        ax.legend(loc='upper right')
+
     for ax in fig.axes:
-        ax.set_ylabel('counts')
+        ax.grid()
 
-fig.savefig(args.outfile, bbox_inches='tight')
+    if deconvolved:
+        for ax in fig.axes:
+            ax.set_ylabel('m/sec')
+    else:
+        for ax in fig.axes:
+            ax.set_ylabel('counts')
 
-if args.wavfile:
-    st.write(args.wavfile, format='WAV', framerate=args.wavrate, rescale=True, width=2)
+    fig.savefig(outfile, bbox_inches='tight')
+    plt.close(fig)
 
-exit(0)
+################################################################################
+# Catalog mode.
+
+_batch = {}             # options, set in each worker
+
+def _InitBatch(options):
+    _batch['options'] = options
+    if options['float32']:
+        SetPrecision(np.float32)
+
+# Plot the events of one day. The data of the channels is read once, for the
+# span of all of the plot windows, and the responses are those of the day, so
+# gain or instrument changes during the catalog are followed. Returns the plot
+# files.
+def PlotEventsOfDay(events):
+    o = _batch['options']
+    windows = []
+    for e in events:
+        times = GetAllArrivalTimes(e, site)
+        if times is None or not times[2]:
+            continue
+        eventtime, desc, arrivals, arrival_rayleigh = times
+        earliest = min([a.time for a in arrivals])
+        windows.append((eventtime, desc, arrivals,
+            eventtime + earliest - o['before'], eventtime + earliest + o['after']))
+    if not windows:
+        return []
+
+    prefix = FilterPadding(o['lowpass'], o['highpass'])
+    first = min(w[3] for w in windows)
+    last = max(w[4] for w in windows)
+    data = ReadChannels(o['channels'], first - prefix, last + prefix,
+        o['server'], o['path'])
+    responses = None
+    if o['deconvolve']:
+        responses = GetResponses(o['channels'], first, last)
+    files = []
+    for eventtime, desc, arrivals, starttime, endtime in windows:
+        st = data.slice(starttime-prefix, endtime+prefix).copy()
+        if len(st) == 0:
+            print('No data for', desc)
+            continue
+        st, notes, deconvolved = ProcessStream(st, starttime, endtime, prefix,
+            not o['no_detrend'], responses, o['highpass'],
+            o['lowpass'])
+        outfile = os.path.join(o['outdir'], 'event_{}.png'.format(
+            str(eventtime)[:19].replace(':', '_')))
+        PlotStream(st, outfile, o['width'], o['height'], notes, deconvolved,
+            eventtime, desc, arrivals)
+        files.append(outfile)
+    return files
+
+def _PlotEventsOfDay(events):
+    try:
+        return PlotEventsOfDay(events)
+    except Exception as e:
+        print('Failed plotting events of', events[0].origins[0].time.date, repr(e))
+        return []
+
+# Plot all of the events from starttime to endtime that pass the filter, a list
+# of (magnitude, distance in m) as for FilterEvents(). Returns the plot files.
+def PlotCatalog(starttime, endtime, filt, options, processes=None):
+    events = GetEvents(starttime, endtime, min([m for m, d in filt]))
+    events = FilterEvents(events, filt, site[0], site[1])
+    days = GroupEventsByDay(events)
+    print('Plotting {} events on {} days'.format(len(events), len(days)))
+    if not days:
+        return []
+    os.makedirs(options['outdir'], exist_ok=True)
+    if processes == 1 or len(days) == 1:
+        _InitBatch(options)
+        results = [_PlotEventsOfDay(day) for day in days]
+    else:
+        with Pool(processes, _InitBatch, (options,)) as pool:
+            results = pool.map(_PlotEventsOfDay, days, chunksize=1)
+    return [f for files in results for f in files]
+
+################################################################################
+
+if __name__ == '__main__':
+    # Parse command line arguments.
+    desc = \
+'''
+Generate seismic plot covering a certain time period.
+  Methods:
+    1) specify --starttime and --endtime.
+    2) specify --eventtime and --event_search_time. Optionally --before_event and --after_event.
+    3) specify --catalog STARTTIME ENDTIME to plot every event in the catalog,
+       optionally with --event_filter rules. Plots go to --outdir.
+
+  May specify multiple channels.
+
+Example: python %s --server archive.local:18000 --channel "AM.OMDBO.01.BHZ" --starttime "2024-07-31T04:30:00"
+         python %s --channel AM.GBLCO.01.BHZ --catalog 2024-01-01 2025-01-01 --event_filter 4.0 500 --event_filter 6.0 inf --deconvolve --outdir events
+''' % (sys.argv[0], sys.argv[0])
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', type=str, default='',
+        help='Seedlink server name.')
+    parser.add_argument('--width', type=int, default=1400,
+        help='Width of plot in pixels.')
+    parser.add_argument('--height', type=int, default=600,
+        help='Height of plot in pixels.')
+    parser.add_argument('--path', dest='path', default=path,
+        help='Path to the directory of the MiniSEED files.')
+    parser.add_argument('--outfile', dest='outfile', default=outfile,
+        help='Output filename (default is {}).'.format(outfile))
+    parser.add_argument('--dpi', type=int, default=dpi,
+        help='Pixels per inch ({} default).'.format(dpi))
+    parser.add_argument('--lowpass', type=float, dest='lowpass',
+        default=None, help='Low-pass filter corner frequency.')
+    parser.add_argument('--highpass', type=float, dest='highpass',
+        default=None, help='High-pass filter corner frequency.')
+    parser.add_argument('--starttime', dest='starttime', default=None,
+        help='Start time of the data. Ex: 4/25/15 00:00 UTC')
+    parser.add_argument('--endtime', dest='endtime', default=None,
+        help='End time of the data. Ex: 4/26/15 00:00 UTC')
+    parser.add_argument('--eventtime', dest='eventtime', default=None,
+        help='Approximate time of the event. Ex: 4/26/15 00:00 UTC')
+    parser.add_argument('--before', type=float, dest='before', default=60,
+        help='Plot this number of seconds before the first event arrival.')
+    parser.add_argument('--after', type=float, dest='after', default=5*60,
+        help='Plot this number of seconds after the first event arrival.')
+    parser.add_argument('--search_time', type=float, dest='search_time', default=60,
+        help='Duration in seconds before and after the event to use when searching the event catalog.')
+    parser.add_argument('--min_magnitude', type=float, dest='min_magnitude', default=3.0,
+        help='Minimum magnitude to use when searching the event catalog.')
+    parser.add_argument('--channel', action='append', dest='channel', default=None,
+        help='NETWORK.STATION.LOCATION.CHANNEL format. Multiple channels may be specified.')
+    parser.add_argument('--no_detrend', dest='no_detrend', action='store_true',
+        help='Do not detrend / demean the data.')
+    parser.add_argument('--deconvolve', dest='deconvolve', action='store_true', 
+        help='Deconvolve to remove the instrument response.')
+    parser.add_argument('--wavfile', dest='wavfile', default=None,
+        help='Save data to an audio WAV file.')
+    parser.add_argument('--wavrate', type=int, dest='wavrate', default=8000,
+        help='Set the WAV file sample rate.')
+    parser.add_argument('--wavspeedup', type=float, dest='wavspeedup', default=None,
+        help='Time compression of the audio, resampled to the WAV sample rate '
+        '(default: play the samples at the WAV sample rate).')
+    parser.add_argument('--float32', dest='float32', action='store_true',
+        help='Process the data in float32 instead of float64, to save memory.')
+    parser.add_argument('-v', '--verbose', action='count',
+        help='Increase verbosity.')
+    parser.add_argument('--catalog', nargs=2, metavar=('STARTTIME', 'ENDTIME'),
+        default=None, help='Plot every catalog event in this time range.')
+    parser.add_argument('--event_filter', nargs=2, type=float, action='append',
+        metavar=('MAGNITUDE', 'KM'), default=None,
+        help='With --catalog, plot events of at least MAGNITUDE within KM of the '
+        'site. Multiple filters may be specified (default --min_magnitude at any '
+        'distance).')
+    parser.add_argument('--outdir', dest='outdir', default='.',
+        help='With --catalog, the directory of the event plots.')
+    parser.add_argument('--processes', type=int, default=None,
+        help='With --catalog, the number of days to plot in parallel (default '
+        'number of CPUs).')
+    args = parser.parse_args()
+
+    arrivals = None
+
+    if args.verbose:
+        print(args)
+
+    if args.float32:
+        SetPrecision(np.float32)
+
+    # Add channels.
+    if args.channel is None or len(args.channel) == 0:
+        print('Must provide at least one --channel.')
+        parser.print_usage()
+        exit(1)
+
+    if args.catalog:
+        starttime = UTCDateTime(dateutil.parser.parse(args.catalog[0]))
+        endtime = UTCDateTime(dateutil.parser.parse(args.catalog[1]))
+        filt = [(mag, km * 1000.0) for mag, km in
+            (args.event_filter or [(args.min_magnitude, np.inf)])]
+        options = {'channels': args.channel, 'server': args.server,
+            'path': args.path, 'before': args.before, 'after': args.after,
+            'lowpass': args.lowpass, 'highpass': args.highpass,
+            'no_detrend': args.no_detrend, 'deconvolve': args.deconvolve,
+            'width': args.width, 'height': args.height, 'outdir': args.outdir,
+            'float32': args.float32}
+        files = PlotCatalog(starttime, endtime, filt, options, args.processes)
+        print('Wrote {} plots to {}'.format(len(files), args.outdir))
+        exit(0)
+
+    if args.starttime and args.endtime:
+        starttime = UTCDateTime(dateutil.parser.parse(args.starttime))
+        endtime = UTCDateTime(dateutil.parser.parse(args.endtime))
+
+    elif args.eventtime:
+        search_eventtime = UTCDateTime(dateutil.parser.parse(args.eventtime))
+        start = search_eventtime - args.search_time
+        stop  = search_eventtime + args.search_time
+
+        # Find events in this time window.
+        events = GetEvents(start, stop, args.min_magnitude)
+        if events is None or len(events) == 0:
+            print('No events found near', search_eventtime)
+            exit(0)
+        print('{} events found:'.format(len(events)))
+        print(events.__str__(print_all=True))
+
+        # Choose the event with the largest magnitude.
+        index = np.argmax([e.magnitudes[0].mag for e in events])
+        print('Choosing event:', events[index])
+
+        # Get all the arrivals for this event. Choose the earliest.
+        # FIXME - these will be specific to one site. Make one per site.
+        # FIXME - get site from the channel response data instead.
+        eventtime, desc, arrivals, arrival_rayleigh  = GetAllArrivalTimes(events[index], site)
+        earliest = min([a.time for a in arrivals])
+
+        starttime = eventtime + earliest - args.before
+        endtime = eventtime + earliest + args.after
+
+    else:
+        print('Must specify either (--starttime and --endtime) or --eventtime.')
+        parser.print_usage()
+        exit(1)
+
+    print("Using data from startime:", starttime, "to endtime:", endtime)
+
+    # If we're filtering, extend the start/end times to account for filter
+    # transients which we will later trim off. We extend on both sides because the
+    # filtering will be done as 'zerophase'.
+    prefix = FilterPadding(args.lowpass, args.highpass)
+    print('Adding', prefix, 'seconds to the requested start/end times to account for filtering.')
+
+    # Read the channel data.
+    st = ReadChannels(args.channel, starttime-prefix, endtime+prefix, args.server,
+        args.path)
+
+    # Read the instrument response, deconvolve and filter.
+    responses = None
+    if args.deconvolve:
+        responses = GetResponses(args.channel, starttime, endtime)
+    st, notes, deconvolved = ProcessStream(st, starttime, endtime, prefix,
+        not args.no_detrend, responses, args.highpass, args.lowpass)
+
+    # Plot
+    PlotStream(st, args.outfile, args.width, args.height, notes, deconvolved,
+        eventtime if arrivals else None, desc if arrivals else None, arrivals)
+
+    if args.wavfile:
+        from sonify import SonifyStream
+        SonifyStream(st, args.wavfile, rate=args.wavrate, speedup=args.wavspeedup)
+
+    exit(0)
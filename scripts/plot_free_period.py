@@ -1,14 +1,31 @@
 # Using the oscilloscope data for free period measurement, calculate the free
 # period and the damping ratio. Generate plots.
 #
+# Fit one or more captures, or all of the captures (*.csv) in a directory, in
+# parallel, and write a table of the results with their uncertainties:
+#   python plot_free_period.py --table free_period.csv captures/
+# With no arguments, fit the Yuma #1 and #3 captures.
+#
+import argparse
+import csv
+import glob
+import os
+from multiprocessing import Pool
+
 import numpy as np
 from scipy.optimize import curve_fit
-import matplotlib.pylab as plt
-import matplotlib.mlab as mlb
+from scipy.signal import detrend, find_peaks
+
+# Columns of the results table.
+columns = ['filename', 'unit', 'start', 'end', 'samples', 'period',
+    'period_err', 'zeta', 'zeta_err', 'natural_frequency',
+    'natural_frequency_err', 'undamped_period', 'undamped_period_err',
+    'rms_residual']
 
 class free_period():
     def __init__(self, filename, unit_name):
         # Read data from a CVS file recorded by the MSOX3054A scope.
+        self.filename = filename
         self.unit_name = unit_name
         self.plot_filename = filename.replace('.csv', '.png')
         self.data = np.loadtxt(filename, delimiter=',', skiprows=2)
@@ -22,28 +39,111 @@ class free_period():
     def trim(self, earliest_time, latest_time):
         # Trim the data.
         # Data at the start of the capture may be clipped. Remove it.
-        # Data at the end may start drifting. 
+        # Data at the end may start drifting.
         self.earliest = earliest_time
         self.latest = latest_time
-        trimmed = [(tp,yp) for (tp,yp) in zip(self.t,self.y) if tp >= earliest_time and tp <= latest_time]
-        self.t, self.y = list(zip(*trimmed))
-        self.t = np.array(self.t)
-        self.y = np.array(self.y)
+        keep = (self.t >= earliest_time) & (self.t <= latest_time)
+        self.t = self.t[keep]
+        self.y = self.y[keep]
+
+    def auto_trim(self, min_amplitude=0.1):
+        # Trim clipped data at the start, and the end of the capture after
+        # the oscillation has decayed below min_amplitude of its first peak
+        # and drift takes over.
+        freq = self.fft_frequency()
+        period = 1.0 / freq
+        earliest = self.t[0]
+        for extreme in (self.y.max(), self.y.min()):
+            # Clipping shows as runs of samples at the extreme value that are
+            # longer than the flat top of a sinusoid.
+            at = np.flatnonzero(self.y == extreme)
+            runs = np.split(at, np.flatnonzero(np.diff(at) > 1) + 1)
+            for r in runs:
+                if (len(r) - 1) / self.fs > 0.05 * period:
+                    earliest = max(earliest, self.t[r[-1]] + 0.05 * period)
+        latest = self.t[-1]
+        keep = self.t >= earliest
+        peaks, amplitudes = self.envelope(self.t[keep], self.y[keep], freq)
+        if len(peaks) > 2:
+            large = np.flatnonzero(amplitudes >= min_amplitude * amplitudes[0])
+            latest = min(latest, self.t[keep][peaks[large[-1]]] + 0.25 * period)
+        self.trim(earliest, latest)
+
+    def fft_frequency(self, t=None, y=None):
+        # Frequency of the largest peak in the spectrum, interpolated
+        # between the FFT bins. Drift is removed first, and periods longer
+        # than half the capture are ignored.
+        t = self.t if t is None else t
+        y = self.y if y is None else y
+        n = 8 * len(y)
+        spectrum = np.abs(np.fft.rfft(detrend(y) * np.hanning(len(y)), n))
+        lowest = 2 * 8 + 1          # bins, for 2 cycles in the capture
+        i = np.argmax(spectrum[lowest:-1]) + lowest
+        a, b, c = np.log(spectrum[i-1:i+2] + 1e-30)
+        offset = 0.5 * (a - c) / (a - 2*b + c)
+        return (i + offset) * self.fs / n
 
-    def damped_harmonic_oscillator(self, t, amplitude, decay_rate, f, phi, offset):
+    def envelope(self, t, y, freq):
+        # Indices and amplitudes of the peaks of the oscillation.
+        peaks, _ = find_peaks(np.abs(y - np.median(y)),
+            distance=max(1, int(0.35 * self.fs / freq)))
+        return peaks, np.abs(y[peaks] - np.median(y))
+
+    def initial_guess(self):
+        # Seed the fit: the frequency from the FFT peak, the decay rate from
+        # the logarithmic decrement of the peaks, then the amplitude, phase
+        # and offset from a linear least squares fit with those fixed.
+        t = self.t - self.t[0]
+        freq = self.fft_frequency()
+        peaks, amplitudes = self.envelope(self.t, self.y, freq)
+        if len(peaks) >= 3:
+            slope, _ = np.polyfit(t[peaks], np.log(amplitudes), 1)
+            decay_rate = max(-slope, 0.0)
+        else:
+            decay_rate = 0.0
+        e = np.exp(-decay_rate * t)
+        w = 2 * np.pi * freq * t
+        a = np.column_stack([e * np.sin(w), e * np.cos(w), np.ones_like(t)])
+        (s, c, offset), *_ = np.linalg.lstsq(a, self.y, rcond=None)
+        # Amplitude and phase at t = 0 of the original time base.
+        amplitude = np.hypot(s, c) * np.exp(decay_rate * self.t[0])
+        phi = np.angle(np.exp(1j * (np.arctan2(c, s) -
+            2 * np.pi * freq * self.t[0])))
+        return [amplitude, decay_rate, freq, phi, offset]
+
+    @staticmethod
+    def damped_harmonic_oscillator(t, amplitude, decay_rate, f, phi, offset):
         return amplitude * np.exp(-decay_rate*t) * np.sin(2*np.pi*f*t + phi) + offset
 
     def curve_fit(self):
         # https://en.wikipedia.org/wiki/Damping
-        popt, pcov = curve_fit(self.damped_harmonic_oscillator, self.t, self.y)
+        popt, pcov = curve_fit(self.damped_harmonic_oscillator, self.t, self.y,
+            p0=self.initial_guess())
         self.y_fit = self.damped_harmonic_oscillator(self.t, *popt)
+        self.rms_residual = np.sqrt(np.mean((self.y - self.y_fit)**2))
         decay_rate = popt[1]
         freq = np.abs(popt[2])
         omega = 2*np.pi*freq
         self.period = 1.0/freq
         #self.zeta = decay_rate / omega  # appx
         self.zeta = decay_rate / np.sqrt(decay_rate**2 + omega**2) #exact
-        self.undamped_period = 1 / self.undamped_frequency(freq, self.zeta)
+        self.natural_frequency = self.undamped_frequency(freq, self.zeta)
+        self.undamped_period = 1 / self.natural_frequency
+
+        # Propagate the uncertainties of the decay rate and frequency, with
+        # their covariance. The natural frequency is sqrt(f^2 + (d/2pi)^2).
+        cov = pcov[1:3, 1:3]
+        def err(gradient):
+            gradient = np.array(gradient)
+            return np.sqrt(max(gradient @ cov @ gradient, 0.0))
+        fn = self.natural_frequency
+        wn2 = decay_rate**2 + omega**2
+        self.period_err = err([0, 1/freq**2])
+        self.zeta_err = err([omega**2 / wn2**1.5,
+            -decay_rate * omega * 2*np.pi / wn2**1.5])
+        self.natural_frequency_err = err([decay_rate / (4*np.pi**2 * fn),
+            freq / fn])
+        self.undamped_period_err = self.natural_frequency_err / fn**2
         print('period, zeta:', self.period, self.zeta)
 
     def undamped_frequency(self, frequency, zeta):
@@ -51,7 +151,20 @@ class free_period():
         # wdamped = wnatural * sqrt(1-zeta^2)
         return frequency / np.sqrt(1 - zeta**2)
 
-    def plot(self, plot_filename=''):
+    def results(self):
+        # One row of the results table.
+        return {'filename': self.filename, 'unit': self.unit_name,
+            'start': self.t[0], 'end': self.t[-1], 'samples': len(self.t),
+            'period': self.period, 'period_err': self.period_err,
+            'zeta': self.zeta, 'zeta_err': self.zeta_err,
+            'natural_frequency': self.natural_frequency,
+            'natural_frequency_err': self.natural_frequency_err,
+            'undamped_period': self.undamped_period,
+            'undamped_period_err': self.undamped_period_err,
+            'rms_residual': self.rms_residual}
+
+    def plot(self, plot_filename='', show=True):
+        import matplotlib.pylab as plt
         if plot_filename == '':
             plot_filename = self.plot_filename
         fig, ax1 = plt.subplots()
@@ -64,15 +177,91 @@ class free_period():
                   (self.unit_name, self.period, self.undamped_period, self.zeta))
         if plot_filename:
             plt.savefig(plot_filename)
-        plt.show()
-
-# Yuma #1
-p = free_period('free_period_yuma1.csv', 'Yuma #1')
-p.curve_fit()
-p.plot()
-
-# Yuma #3
-p = free_period('free_period_yuma3.csv', 'Yuma #3')
-p.trim(0.85, 6.85)
-p.curve_fit()
-p.plot()
+        if show:
+            plt.show()
+        plt.close(fig)
+
+# Fit one capture. job is (filename, unit name, (earliest, latest) or None for
+# automatic trimming, plot). Returns the results, or None if the fit failed.
+def fit_capture(job):
+    filename, unit_name, trim, plot = job
+    try:
+        p = free_period(filename, unit_name)
+        if trim:
+            p.trim(*trim)
+        else:
+            p.auto_trim()
+        p.curve_fit()
+        if plot:
+            p.plot(show=False)
+        return p.results()
+    except Exception as e:
+        print('Failed fitting %s: %r' % (filename, e))
+        return None
+
+# Fit the captures in parallel. Returns the list of results.
+def fit_captures(jobs, processes=None):
+    if processes == 1 or len(jobs) == 1:
+        return [fit_capture(job) for job in jobs]
+    with Pool(processes) as pool:
+        return pool.map(fit_capture, jobs, chunksize=1)
+
+def write_table(filename, results):
+    with open(filename, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=columns)
+        w.writeheader()
+        for r in results:
+            if r:
+                w.writerow({k: ('%.6g' % v if isinstance(v, float) else v)
+                    for k, v in r.items()})
+
+if __name__ == '__main__':
+    desc = 'Fit the free period and damping of oscilloscope captures.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('captures', nargs='*',
+        help='Capture CSV files, or directories of them.')
+    parser.add_argument('--trim', type=float, nargs=2, default=None,
+        metavar=('EARLIEST', 'LATEST'),
+        help='Fit only this time range (default: trim clipping at the start '
+        'and the decayed end automatically).')
+    parser.add_argument('--table', default=None,
+        help='Write the results to this CSV file.')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of fits to run in parallel (default: number of CPUs).')
+    parser.add_argument('--no-plot', action='store_true',
+        help="Don't plot the fits.")
+    args = parser.parse_args()
+
+    if not args.captures:
+        # Yuma #1 and #3
+        p = free_period('free_period_yuma1.csv', 'Yuma #1')
+        p.curve_fit()
+        p.plot()
+
+        p = free_period('free_period_yuma3.csv', 'Yuma #3')
+        p.trim(0.85, 6.85)
+        p.curve_fit()
+        p.plot()
+        exit(0)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    files = []
+    for c in args.captures:
+        if os.path.isdir(c):
+            files += sorted(glob.glob(os.path.join(c, '*.csv')))
+        else:
+            files.append(c)
+    jobs = [(f, os.path.splitext(os.path.basename(f))[0], args.trim,
+        not args.no_plot) for f in files]
+    results = fit_captures(jobs, args.processes)
+
+    for r in results:
+        if r:
+            print('%-30s period %.4f +/- %.4f s, zeta %.4f +/- %.4f, '
+                'undamped %.4f +/- %.4f s' % (r['unit'], r['period'],
+                r['period_err'], r['zeta'], r['zeta_err'],
+                r['undamped_period'], r['undamped_period_err']))
+    if args.table:
+        write_table(args.table, results)
+        print('Wrote', args.table)
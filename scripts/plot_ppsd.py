@@ -7,17 +7,13 @@ import matplotlib.pylab as plt
 import matplotlib.mlab as mlb
 import numpy as np
 from obspy import read, read_inventory, Stream, UTCDateTime
-from obspy.clients.seedlink.basic_client import Client as SeedlinkClient
-from obspy.io.xseed import Parser
 from obspy.signal import PPSD
 import os
-import pylab as pyl
-import scipy as sy
-import scipy.fftpack as syfp
 import sys
 
 sys.path.append('.')
 from  obspy_helpers import *
+from inventory_store import LoadInventory
 
 # Defaults
 width = 1200
@@ -75,6 +71,9 @@ parser.add_argument('-v', '--verbose', action='count',
     help='Increase verbosity.')
 parser.add_argument('--rotate', type=int, default=None,
     help='Rotate output files and keep this number of old copies.')
+parser.add_argument('--metrics', default=None,
+    help='Write per segment noise metrics (dB above the NLNM in standard '
+    'bands) to this CSV file.')
 args = parser.parse_args()
 
 if args.verbose:
@@ -122,6 +121,7 @@ else:
         # Write data to a local file.
         st.write('{}.{}.{}.{}.copy.mseed'.format(net, station, loc, chan))
     elif args.server:
+        from obspy.clients.seedlink.basic_client import Client as SeedlinkClient
         print('Use Seedlink server:', args.server)
         net, station, loc, chan = args.channel.split('.')
         print('Attempting to retrieve {}.{}.{}.{}...'.format(net, station, loc, chan))
@@ -131,20 +131,10 @@ else:
         # Write data to a local file
         st.write('{}.{}.{}.{}.copy.mseed'.format(net, station, loc, chan))
     else:
-        st = Stream()
-        t = starttime
-        while t < (endtime + timedelta(days=1)):
-            year = t.timetuple().tm_year
-            doy = t.timetuple().tm_yday
-
-            fname = '{}/{}.{}.{:03d}.mseed'.format(args.path, args.channel, year, doy)
-            print('Attempting to open file "{}"...'.format(fname))
-            try:
-                st += read(fname)
-            except Exception as e:
-                print(e)
-                print('Attempting to continue...')
-            t += timedelta(days=1)
+        # Read the day files that exist, in the flat or SDS archive layout.
+        net, station, loc, chan = args.channel.split('.')
+        st = GetLocalDataRange(net, station, loc, chan, UTCDateTime(starttime),
+            UTCDateTime(endtime), path=args.path)
 
 # Merge and trim the streams.
 st.merge()      # allow gaps
@@ -158,7 +148,7 @@ if not st or len(st) == 0 or len(st[0].data) == 0:
        exit(1)
 
 # Read the response file containing the response data for this channel.
-inv = read_inventory(args.response_file)
+inv = LoadInventory(args.response_file)
 if args.verbose:
     print('inv:', inv[0][0][0].response)
 
@@ -174,6 +164,10 @@ ppsd = PPSD(
     overlap=float(args.segment_overlap),
     skip_on_gaps=False)
 ppsd.add(st)
+if args.metrics:
+    from noise_models import PPSDMetrics, WriteMetrics
+    WriteMetrics(args.metrics, *PPSDMetrics(ppsd))
+    print('Wrote', args.metrics)
 fig = ppsd.plot(
     show=False,
     period_lim=(1.0/(st[0].stats.sampling_rate/2), 1.0/0.002))
@@ -7,7 +7,6 @@ import scipy as sy
 import scipy.fftpack as syfp
 import pylab as pyl
 import matplotlib.pylab as plt
-import matplotlib.mlab as mlb
 from matplotlib.offsetbox import AnchoredText
 
 # Sample rate.
@@ -34,102 +33,30 @@ ch_noise = noise[:,1]
 # ch_data = np.array([1.0, 1.0, 2.0, 3.0])
 # ch_noise = np.array([1.0, 1.0, 2.0, 3.0])
 
-# Infrasonic PSD IDC2010_LI low noise model. Estimated from published plots:
-# https://link.springer.com/article/10.1007/s00024-012-0573-6
-# Base10 logarithm relative to (1 Pa)^2/Hz
-idc2010_li = [
-        (0.012, -2.1),
-        (0.02, -2.7),
-        (0.03, -3.2),
-        (0.04, -3.55),
-        (0.05, -3.75),
-        (0.06, -3.95),
-        (0.07, -4.05),
-        (0.08, -4.15),
-        (0.09, -4.25),
-        (0.1, -4.45),
-        (0.13, -4.25),
-        (0.2, -4.2),
-        (0.3, -5.0),
-        (0.4, -5.4),
-        (0.5, -5.6),
-        (0.6, -5.7),
-        (0.7, -5.8),
-        (0.8, -6.05),
-        (0.9, -6.3),
-        (1.0, -6.5),
-        (2.0, -7.75),
-        (3.0, -8.5),
-        (3.8, -8.85),
-        (4.0, -8.9),
-        (5.0, -9.1),
-        (6.0, -9.25),
-        (7.0, -9.4),
-        (7.3, -9.45),
-        (8.0, -9.75),
-        (9.0, -9.90)
-]
-
-# Infrasonic PSD IDC2010_HI high noise model. Estimated from published plots:
-# https://link.springer.com/article/10.1007/s00024-012-0573-6
-# Base10 logarithm relative to (1 Pa)^2/Hz
-idc2010_hi = [
-        (0.012, 3.6),
-        (0.022, 3.45),
-        (0.04, 3.05),
-        (0.05, 2.9),
-        (0.06, 2.5),
-        (0.07, 2.25),
-        (0.08, 2.1),
-        (0.09, 2.06),
-        (0.1, 2.0),
-        (0.2, 1.5),
-        (0.3, 1.2),
-        (0.4, 0.8),
-        (0.5, 0.45),
-        (0.6, 0.05),
-        (0.7, -0.05),
-        (0.8, -0.3),
-        (0.9, -0.55),
-        (1.0, -0.8),
-        (2.0, -1.3),
-        (3.0, -1.6),
-        (4.0, -1.85),
-        (5.0, -1.95),
-        (6.0, -2.05),
-        (7.0, -2.2),
-        (8.0, -2.3),
-        (9.0, -2.5)
-]
-
-# Transpose for plotting.
-idc2010_li_x,idc2010_li_y = np.array(idc2010_li).T
-idc2010_hi_x,idc2010_hi_y = np.array(idc2010_hi).T
-
-# Convert to dB.
-idc2010_li_y = 10 * idc2010_li_y
-idc2010_hi_y = 10 * idc2010_hi_y
+# IDC2010 infrasonic low and high noise models, in frequency and dB
+from noise_models import ModelTable
+idc2010_li_x, idc2010_li_y = ModelTable('idc2010_li')
+idc2010_hi_x, idc2010_hi_y = ModelTable('idc2010_hi')
 
 # Scale capacitance to Pascals.
 ch_data = ch_data * units
 ch_noise = ch_noise * units
 
 # Get the PSD in Pa^2/Hz.
-psd_data, f_data = plt.mlab.psd(ch_data, Fs=fs, detrend=mlb.detrend_mean, NFFT=32768)
-psd_noise, f_noise = plt.mlab.psd(ch_noise, Fs=fs, detrend=mlb.detrend_mean, NFFT=32768)
+from band_power import WelchPsd, BandRms
+psd_data, f_data = WelchPsd(ch_data, fs, 32768)
+psd_noise, f_noise = WelchPsd(ch_noise, fs, 32768)
 
 # Noise in Pa^2/Hz at 1Hz.
 noise_1hz = psd_noise[np.argmax(f_noise >= 1.0)] 
 
 # Bandlimited noise 0.5 Hz to 2.0 Hz.
-# Bandlimited noise 0.1 Hz to 50.0 Hz.
-# Integrate bandlimited PSD to get noise power.
-noise_nb = np.sum([psd*1.0/fs for psd,f in zip(psd_noise,f_noise) if f >= 0.5 and f <= 2.0])
-noise_wb = np.sum([psd*1.0/fs for psd,f in zip(psd_noise,f_noise) if f >= 0.1 and f <= 50.0])
-
-# Convert noise power to noise pressure (Pa^2 to Pa).
-noise_nb = np.sqrt(noise_nb)
-noise_wb = np.sqrt(noise_wb)
+# Bandlimited noise 0.1 Hz to 50.0 Hz (up to the Nyquist frequency).
+# Integrate bandlimited PSD to get noise power, and convert noise power to
+# noise pressure (Pa^2 to Pa).
+noise_rms = BandRms(psd_noise, f_noise, {'nb': (0.5, 2.0), 'wb': (0.1, 50.0)})
+noise_nb = noise_rms['nb']
+noise_wb = noise_rms['wb']
 
 # Convert to dB log scale.
 psd_data = 10 * np.log10(psd_data)
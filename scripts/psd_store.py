@@ -0,0 +1,333 @@
+# Long-term store of hourly PSDs, and spectral trend plots.
+#
+# The PSD of each hour of a channel is computed once from the day files (see
+# band_power.py), averaged over half an octave around each frequency of a
+# fixed grid with 1/8 octave steps (like obspy's PPSD), and kept in dB as
+# float16 (resolution better than 0.13 dB). The store has one directory per
+# channel, NET.STA.LOC.CHAN, with:
+#   YEAR.npy    array (8784, frequencies), one row per hour of the year
+#               ((doy - 1) * 24 + hour), NaN where there is no data
+#   meta.json   the grid, the units, and the size and modification time of
+#               the day files of each stored day
+# The year files are written in place with memory maps, so an update only
+# touches the rows of the new or changed days, and reading months of PSDs is
+# a few MB. A year of one channel is 1.9 MB.
+#
+# Plots, from the store only:
+#   --trend     power in frequency bands over time
+#   --image     spectral image, frequency vs. day (median of each day's hours)
+#
+# Example: python psd_store.py --channel AM.BCCWA.01.BHZ --units 2e-9
+#              --acceleration --starttime 2025-01-01 --trend trend.png
+#              --image psd_image.png
+
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append('.')
+import archive
+from band_power import DayRollingPsds, BandPower, SeismicBands
+
+# Defaults
+store_path = '/data/seismometer_data/psd'
+fmin = 0.01             # Hz, lowest frequency of the grid
+fmax = 100.0
+per_octave = 8          # frequencies per octave
+smoothing = 0.5         # octaves averaged around each frequency
+hours_per_year = 366 * 24
+dpi = 150
+
+################################################################################
+# Store.
+
+# Frequencies of the grid, fmin * 2^(k / per_octave) up to fmax.
+def FrequencyGrid(fmin=fmin, fmax=fmax, per_octave=per_octave):
+    n = int(np.floor(np.log2(fmax / fmin) * per_octave + 1e-9)) + 1
+    return fmin * 2.0 ** (np.arange(n) / per_octave)
+
+# Average PSDs (..., frequencies) over smoothing octaves around each frequency
+# of grid. Frequencies beyond the PSD are NaN.
+def GridPsd(psds, freqs, grid, smoothing=smoothing):
+    half = 2.0 ** (smoothing / 2)
+    bands = {i: (f / half, f * half) for i, f in enumerate(grid)}
+    power = BandPower(psds, freqs, bands)
+    width = grid * (half - 1 / half)
+    values = np.stack([power[i] for i in range(len(grid))], axis=-1) / width
+    values[..., grid * half > freqs[-1]] = np.nan
+    return values
+
+def _ChannelDir(store, seed_id):
+    return os.path.join(store, seed_id)
+
+def _YearFile(store, seed_id, year):
+    return os.path.join(_ChannelDir(store, seed_id), '%d.npy' % year)
+
+def ReadMeta(store, seed_id):
+    try:
+        with open(os.path.join(_ChannelDir(store, seed_id), 'meta.json')) as f:
+            return json.load(f)
+    except OSError:
+        return None
+
+def WriteMeta(store, seed_id, meta):
+    filename = os.path.join(_ChannelDir(store, seed_id), 'meta.json')
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+# Open the array of a year, creating it full of NaN if needed.
+def _OpenYear(store, seed_id, year, nfreq, mode='r+'):
+    filename = _YearFile(store, seed_id, year)
+    if not os.path.exists(filename):
+        if mode == 'r':
+            return None
+        a = np.lib.format.open_memmap(filename + '.tmp', mode='w+',
+            dtype=np.float16, shape=(hours_per_year, nfreq))
+        a[:] = np.nan
+        a.flush()
+        del a
+        os.replace(filename + '.tmp', filename)
+    return np.load(filename, mmap_mode=mode)
+
+# Identify the day files of a day, so that changed days are computed again.
+def _Signature(files):
+    signature = []
+    for f in files:
+        s = os.stat(f)
+        signature.append('%s:%d:%d' % (os.path.basename(f), s.st_size,
+            int(s.st_mtime)))
+    return ' '.join(signature)
+
+# Hourly PSDs of one day on the grid, in dB. Returns (day, hours, values).
+def DayGridPsds(seed_id, day, grid, units=1.0, acceleration=False, path=None):
+    hours = []
+    values = []
+    for times, psds, freqs in DayRollingPsds(seed_id, day, 3600.0, units,
+            acceleration, path, fmin=grid[0]):
+        hours += [int(round((t - day) / 3600)) for t in times]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values.append(10 * np.log10(GridPsd(psds, freqs, grid)))
+    if values:
+        return day, np.array(hours), np.concatenate(values)
+    return day, np.zeros(0, int), np.zeros((0, len(grid)))
+
+def _DayGridPsds(job):
+    try:
+        return DayGridPsds(*job)
+    except Exception as e:
+        print('Failed %s: %r' % (job[1].date, e))
+        return job[1], None, None
+
+# Compute the PSDs of the new and changed days of a channel from starttime to
+# endtime and add them to the store. The units and acceleration must be the
+# same as when the store was created.
+def UpdateStore(store, seed_id, starttime, endtime, units=1.0,
+        acceleration=False, path=None, processes=None):
+    from obspy import UTCDateTime
+    path = path or archive.path
+    grid = FrequencyGrid()
+    meta = ReadMeta(store, seed_id)
+    settings = {'fmin': fmin, 'fmax': fmax, 'per_octave': per_octave,
+        'smoothing': smoothing, 'units': units, 'acceleration': acceleration}
+    if meta is None:
+        os.makedirs(_ChannelDir(store, seed_id), exist_ok=True)
+        meta = dict(settings, days={})
+    elif any(meta.get(k) != v for k, v in settings.items()):
+        raise ValueError('The PSD store of %s was made with %s. Use the same '
+            'settings or another store.' % (seed_id, ', '.join('%s=%s' % (k,
+            meta.get(k)) for k in settings)))
+
+    net, station, loc, chan = seed_id.split('.')
+    jobs = []
+    signatures = {}
+    for year, doy in archive.Days(starttime, endtime):
+        day = UTCDateTime(year=year, julday=doy)
+        files = archive.DayFiles(net, station, loc, chan, day, day, path)
+        key = '%d.%03d' % (year, doy)
+        signatures[key] = _Signature(files)
+        if files and meta['days'].get(key) != signatures[key]:
+            jobs.append((seed_id, day, grid, units, acceleration, path))
+    if not jobs:
+        return 0
+    print('Computing %d days of %s' % (len(jobs), seed_id))
+    if processes == 1 or len(jobs) == 1:
+        _StoreDays(store, seed_id, meta, signatures, map(_DayGridPsds, jobs))
+    else:
+        with Pool(processes) as pool:
+            _StoreDays(store, seed_id, meta, signatures,
+                pool.imap_unordered(_DayGridPsds, jobs))
+    WriteMeta(store, seed_id, meta)
+    return len(jobs)
+
+# Write the results of DayGridPsds() to the year files as they come in.
+def _StoreDays(store, seed_id, meta, signatures, results):
+    years = {}
+    for day, hours, values in results:
+        if hours is None:
+            continue
+        if day.year not in years:
+            years[day.year] = _OpenYear(store, seed_id, day.year,
+                values.shape[1])
+        rows = years[day.year]
+        first = (day.julday - 1) * 24
+        rows[first:first + 24] = np.nan
+        rows[first + hours] = values
+        key = '%d.%03d' % (day.year, day.julday)
+        meta['days'][key] = signatures[key]
+    for rows in years.values():
+        rows.flush()
+
+# Read the hourly PSDs of a channel for the days from starttime to endtime.
+# Returns (hour start times as POSIX timestamps, grid frequencies, dB array
+# (hours, frequencies) in float32, NaN where there is no data).
+def ReadStore(store, seed_id, starttime, endtime):
+    from obspy import UTCDateTime
+    grid = FrequencyGrid()
+    t0 = UTCDateTime(starttime.date).timestamp
+    hours = int(round((UTCDateTime(endtime.date).timestamp + 86400 - t0) /
+        3600))
+    times = t0 + 3600.0 * np.arange(hours)
+    values = np.full((hours, len(grid)), np.nan, dtype=np.float32)
+    for year in range(UTCDateTime(t0).year, endtime.year + 1):
+        rows = _OpenYear(store, seed_id, year, len(grid), mode='r')
+        if rows is None:
+            continue
+        y0 = UTCDateTime(year=year, julday=1).timestamp
+        i = np.flatnonzero((times >= y0) & (times < y0 + hours_per_year *
+            3600))
+        if len(i):
+            values[i] = rows[((times[i] - y0) // 3600).astype(int)]
+    return times, grid, values
+
+################################################################################
+# Plots.
+
+def _Figure():
+    import matplotlib
+    matplotlib.use('Agg')       # only writes files; skip loading a GUI backend
+    import matplotlib.pyplot as plt
+    return plt
+
+# Power in each band (dict of name: (fmin, fmax) Hz) of the stored PSDs, in
+# dB. Returns a dict of name: array per hour.
+def BandTrends(grid, values, bands):
+    psds = 10.0 ** (values.astype(np.float64) / 10)
+    # Frequencies with data; hours without data are NaN.
+    valid = np.isfinite(psds).any(axis=0)
+    trends = {}
+    for name, (lo, hi) in bands.items():
+        columns = (grid >= lo) & (grid <= hi) & valid
+        if columns.sum() < 2:
+            continue
+        power = BandPower(psds[:, columns], grid[columns], {name: (lo, hi)})
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trends[name] = 10 * np.log10(power[name])
+    return trends
+
+# Plot the band power over time.
+def PlotTrends(times, grid, values, bands, filename, title='', dpi=dpi):
+    plt = _Figure()
+    fig, ax = plt.subplots(figsize=(12, 5))
+    x = np.asarray(times * 1e6, dtype='datetime64[us]')
+    for name, trend in BandTrends(grid, values, bands).items():
+        lo, hi = bands[name]
+        ax.plot(x, trend, '-', linewidth=0.8,
+            label='%s (%g - %g Hz)' % (name, lo, hi))
+    ax.set_ylabel('Band power (dB)')
+    ax.set_title(title)
+    ax.grid(True)
+    ax.legend(loc='upper right', fontsize='small')
+    fig.autofmt_xdate()
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+# Plot the median PSD of each day as an image, frequency vs. day.
+def PlotSpectralImage(times, grid, values, filename, title='', dpi=dpi):
+    import warnings
+    plt = _Figure()
+    days = len(times) // 24
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # all-NaN days
+        daily = np.nanmedian(values[:days * 24].reshape(days, 24, -1), axis=1)
+    edges = np.asarray((times[0] + 86400.0 * np.arange(days + 1)) * 1e6,
+        dtype='datetime64[us]')
+    half = 2.0 ** (0.5 / per_octave)
+    fedges = np.concatenate([grid / half, [grid[-1] * half]])
+    fig, ax = plt.subplots(figsize=(12, 5))
+    mesh = ax.pcolormesh(edges, fedges, np.ma.masked_invalid(daily.T),
+        cmap='viridis', shading='flat')
+    ax.set_yscale('log')
+    columns = np.isfinite(daily).any(axis=0)
+    if columns.any():
+        ax.set_ylim(fedges[np.argmax(columns)],
+            fedges[len(columns) - np.argmax(columns[::-1])])
+    ax.set_ylabel('Frequency (Hz)')
+    ax.set_title(title)
+    fig.colorbar(mesh, ax=ax, label='dB')
+    fig.autofmt_xdate()
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+################################################################################
+
+if __name__ == '__main__':
+    from obspy import UTCDateTime
+    desc = 'Store hourly PSDs of a channel, and plot their trends.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--channel', required=True,
+        help='Channel, e.g. AM.BCCWA.01.BHZ.')
+    parser.add_argument('--path', default=archive.path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--store', default=store_path,
+        help='Directory of the PSD store (default %(default)s).')
+    parser.add_argument('--starttime', required=True,
+        help='First day.')
+    parser.add_argument('--endtime', default=None,
+        help='Last day (default now).')
+    parser.add_argument('--units', type=float, default=1.0,
+        help='Physical units per count (default counts).')
+    parser.add_argument('--acceleration', action='store_true',
+        help='Convert velocity to acceleration.')
+    parser.add_argument('--no_update', action='store_true',
+        help='Only plot what is in the store.')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of days to compute in parallel (default number of '
+        'CPUs).')
+    parser.add_argument('--trend', default=None,
+        help='Plot the band power trends to this file.')
+    parser.add_argument('--band', nargs=3, action='append', default=None,
+        metavar=('NAME', 'FMIN', 'FMAX'),
+        help='Frequency band in Hz for --trend. May be repeated (default '
+        'the seismic noise bands).')
+    parser.add_argument('--image', default=None,
+        help='Plot the spectral image to this file.')
+    parser.add_argument('--dpi', type=int, default=dpi,
+        help='Pixels per inch (default %(default)s).')
+    args = parser.parse_args()
+
+    starttime = UTCDateTime(args.starttime)
+    endtime = UTCDateTime(args.endtime) if args.endtime else UTCDateTime()
+    if not args.no_update:
+        n = UpdateStore(args.store, args.channel, starttime, endtime,
+            args.units, args.acceleration, args.path, args.processes)
+        print('Updated %d days' % n)
+
+    if args.trend or args.image:
+        times, grid, values = ReadStore(args.store, args.channel, starttime,
+            endtime)
+        title = '%s, %s to %s' % (args.channel, starttime.date, endtime.date)
+        if args.trend:
+            if args.band:
+                bands = {name: (float(lo), float(hi)) for name, lo, hi in
+                    args.band}
+            else:
+                bands = SeismicBands()
+            PlotTrends(times, grid, values, bands, args.trend, title, args.dpi)
+        if args.image:
+            PlotSpectralImage(times, grid, values, args.image, title, args.dpi)
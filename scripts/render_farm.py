@@ -0,0 +1,142 @@
+# Render plots in a pool of worker processes.
+#
+# A plot job is a plotting function from obspy_helpers (Helicorder,
+# Spectrogram) and its arguments, with the input stream given by a key instead
+# of the data itself. The streams are copied once into shared memory, and each
+# worker maps them without copying, so a job doesn't pickle a day of samples.
+# The plotting functions only read the input stream: they slice it and filter
+# a copy.
+#
+# Example:
+#   jobs = [RenderJob(Helicorder, 'BCCWA', 'heli.png', 'Vancouver, WA',
+#               starttime, 86400, freqmin=0.15, freqmax=0.5)]
+#   results = RenderAll(jobs, {'BCCWA': st})
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from obspy.core.stream import Stream
+from obspy.core.trace import Trace
+
+import obspy_helpers
+from instrumentation import Traced
+
+################################################################################
+
+# A plot job. function is called as function(stream, *args, **kwargs), where
+# stream is the stream registered under key. The cost is used to start the
+# slowest jobs first. By default it's the first number in args, which is the
+# duration for Helicorder and Spectrogram.
+def RenderJob(function, key, *args, cost=None, **kwargs):
+    if cost is None:
+        cost = 0
+        for a in args:
+            if isinstance(a, (int, float)) and not isinstance(a, bool):
+                cost = a
+                break
+    return (cost, function, key, args, kwargs)
+
+# Copy the trace data of a stream into shared memory. Returns (handle, blocks),
+# where the handle is a small picklable description for AttachStream(), and
+# blocks must be passed to FreeStream() when done.
+def ShareStream(st):
+    if any(np.ma.isMaskedArray(tr.data) for tr in st):
+        st = st.split()     # no masked values in shared memory
+    handle = []
+    blocks = []
+    for tr in st:
+        data = np.ascontiguousarray(tr.data)
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        blocks.append(shm)
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+        handle.append((shm.name, data.dtype.str, data.shape, tr.stats))
+    return handle, blocks
+
+def FreeStream(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+# Streams attached in this process, by shared memory name. The SharedMemory
+# objects must stay open while the arrays are in use.
+_attached = {}
+
+# Make a stream from a handle created by ShareStream(), with the trace data
+# in shared memory.
+def AttachStream(handle):
+    key = tuple(name for name, dtype, shape, stats in handle)
+    if key not in _attached:
+        blocks = []
+        traces = []
+        for name, dtype, shape, stats in handle:
+            shm = shared_memory.SharedMemory(name=name)
+            blocks.append(shm)
+            data = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            traces.append(Trace(data=data, header=stats))
+        _attached[key] = (Stream(traces=traces), blocks)
+    return _attached[key][0]
+
+################################################################################
+
+# Worker process setup. Plots are only written to files.
+def _InitWorker(precision, text_mode):
+    import matplotlib
+    matplotlib.use('Agg')
+    obspy_helpers.SetPrecision(precision)
+    obspy_helpers.SetTextMode(text_mode)
+
+# Run one job. Catch everything, so that one bad plot doesn't stop the others.
+def _RunJob(job):
+    cost, function, stream, args, kwargs = job
+    try:
+        if not isinstance(stream, Stream):
+            stream = AttachStream(stream)
+        function(stream, *args, **kwargs)
+        return True
+    except Exception as e:
+        print(repr(e))
+        print('Failed plotting', args[0] if args else function.__name__)
+        return False
+
+# Run the jobs, with streams a dict of the input streams by key. Jobs are run in
+# a pool of processes (default one per CPU), slowest first. precision and
+# text_mode default to the settings in obspy_helpers. Returns a list of
+# True/False for each job, in the order given.
+@Traced(counts=lambda results: {'plots': len(results),
+    'failed': results.count(False)})
+def RenderAll(jobs, streams, processes=0, precision=None, text_mode=None):
+    if precision is None:
+        precision = obspy_helpers.GetPrecision()
+    if text_mode is None:
+        text_mode = obspy_helpers.GetTextMode()
+    if processes <= 0:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+    order = sorted(range(len(jobs)), key=lambda i: -jobs[i][0])
+
+    if processes <= 1:
+        _InitWorker(precision, text_mode)
+        results = {}
+        for i in order:
+            cost, function, key, args, kwargs = jobs[i]
+            results[i] = _RunJob((cost, function, streams[key], args, kwargs))
+        return [results[i] for i in range(len(jobs))]
+
+    handles = {}
+    blocks = []
+    try:
+        for key, st in streams.items():
+            handles[key], b = ShareStream(st)
+            blocks += b
+        work = []
+        for i in order:
+            cost, function, key, args, kwargs = jobs[i]
+            work.append((cost, function, handles[key], args, kwargs))
+        with multiprocessing.Pool(processes, initializer=_InitWorker,
+                initargs=(precision, text_mode)) as pool:
+            done = pool.map(_RunJob, work, chunksize=1)
+    finally:
+        FreeStream(blocks)
+    results = dict(zip(order, done))
+    return [results[i] for i in range(len(jobs))]
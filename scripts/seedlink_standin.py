@@ -0,0 +1,131 @@
+# A minimal local Seedlink server, for benchmarking and testing GetData()
+# without a real station.
+#
+# It serves the day files in a directory (NET.STA.LOC.CHAN.YEAR.DOY.mseed, as
+# written by synthetic_data.py or the archive) to time window requests, which
+# is all that obspy's basic Seedlink client uses: HELLO, STATION, SELECT, TIME
+# and END. Data is sent as 512 byte MiniSEED records, followed by END.
+#
+# Example: python seedlink_standin.py --path /tmp/mseed --port 18000
+# Then:    GetData('localhost:18000', 'AM', 'BCCWA', '01', 'BHZ', t0, t1)
+
+import argparse
+import io
+import socketserver
+import sys
+import threading
+
+from obspy import UTCDateTime
+
+sys.path.append('.')
+from obspy_helpers import GetLocalDataRange
+
+# Defaults
+port = 18000
+record_length = 512
+
+class SeedlinkHandler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    # Read one command. Commands end with CR, or CR LF.
+    def command(self):
+        line = b''
+        while True:
+            c = self.rfile.read(1)
+            if not c:
+                return None
+            if c == b'\r':
+                return line.decode('ascii', 'replace').strip()
+            line += c
+
+    def handle(self):
+        net = station = None
+        selectors = []
+        requests = []
+        seqnum = 0
+        while True:
+            cmd = self.command()
+            if cmd is None or cmd.upper() == 'BYE':
+                return
+            words = cmd.split()
+            if not words:
+                continue
+            action = words[0].upper()
+            if action == 'HELLO':
+                self.send(b'SeedLink v3.1 (seedlink_standin)\r\n'
+                    b'local archive\r\n')
+            elif action == 'STATION' and len(words) == 3:
+                station, net = words[1], words[2]
+                selectors = []
+                self.send(b'OK\r\n')
+            elif action == 'SELECT' and len(words) == 2 and station:
+                selectors.append(words[1])
+                self.send(b'OK\r\n')
+            elif action == 'TIME' and len(words) in (2, 3) and station:
+                times = [UTCDateTime(*[int(v) for v in w.split(',')])
+                    for w in words[1:]]
+                if len(times) == 1:
+                    times.append(UTCDateTime())
+                for s in selectors or ['  BHZ']:
+                    requests.append((net, station, s[:-3].strip(), s[-3:],
+                        times[0], times[1]))
+                self.send(b'OK\r\n')
+            elif action == 'END':
+                for request in requests:
+                    seqnum = self.send_data(seqnum, *request)
+                self.send(b'END')
+                return
+            else:
+                self.send(b'ERROR\r\n')
+
+    # Send the data for one stream and time window. Returns the next sequence
+    # number.
+    def send_data(self, seqnum, net, station, loc, chan, starttime, endtime):
+        st = GetLocalDataRange(net, station, loc, chan, starttime, endtime,
+            path=self.server.path)
+        st.trim(starttime, endtime)
+        if len(st) == 0:
+            return seqnum
+        buf = io.BytesIO()
+        st.write(buf, format='MSEED', reclen=record_length)
+        data = buf.getvalue()
+        for i in range(0, len(data), record_length):
+            self.send(b'SL%06X' % (seqnum % 0x1000000) +
+                data[i:i+record_length])
+            seqnum += 1
+        return seqnum
+
+class SeedlinkStandin(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, path, host='localhost', port=port):
+        self.path = path
+        super().__init__((host, port), SeedlinkHandler)
+
+# Start a server in a background thread. Returns the server; call shutdown()
+# to stop it. Use port 0 to pick any free port, then see server_address.
+def StartSeedlinkStandin(path, host='localhost', port=port):
+    server = SeedlinkStandin(path, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Serve MiniSEED day files to Seedlink time window requests.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--path', required=True,
+        help='Directory of the day files.')
+    parser.add_argument('--host', default='localhost',
+        help='Address to listen on (default %(default)s).')
+    parser.add_argument('--port', type=int, default=port,
+        help='Port to listen on (default %(default)s).')
+    args = parser.parse_args()
+
+    with SeedlinkStandin(args.path, args.host, args.port) as server:
+        print('Serving', args.path, 'on port', server.server_address[1])
+        server.serve_forever()
@@ -0,0 +1,298 @@
+# Streaming audio export of seismic data.
+#
+# The data are processed in chunks, so days or weeks can be sonified without
+# holding them in memory: a high-pass removes the offset and drift, then the
+# data are time-compressed by speedup and resampled to the audio rate, scaled,
+# and appended to the audio file. The filter and resampler keep their state
+# from one chunk to the next, so the result doesn't depend on the chunk size.
+# The high-pass starts in its steady state for the first sample, so the offset
+# of raw counts doesn't start it with a step. Gaps in the day files are filled
+# with the mean of the data before them, so they are silent rather than steps.
+#
+# Normalisation needs the peak of the whole span. Unless it's given, the data
+# are read twice: once for the peak, and once to write the audio.
+#
+# WAV is written with the standard library. FLAC needs the soundfile package.
+#
+# Example, a day compressed 1000x (100 sps becomes 100 kHz, resampled to 48
+# kHz):
+#   python sonify.py --channel AM.BCCWA.01.BHZ --starttime 2025-06-01
+#       --endtime 2025-06-02 --speedup 1000 --rate 48000 --outfile day.wav
+
+import argparse
+import sys
+import wave
+from fractions import Fraction
+
+import numpy as np
+
+sys.path.append('.')
+from filter_design import ButterworthSos, ResamplingFir
+
+# Defaults
+path = '/data/seismometer_data/mseed'
+rate = 8000                 # audio sample rate
+highpass = 0.01             # Hz, in the data's time base
+gap_window = 60.0           # seconds of data before a gap for its fill level
+max_denominator = 100       # limit on up and down of the resampling ratio
+amplitude = 0.95            # of full scale at the peak
+
+################################################################################
+
+# Polyphase resampler by up/down that can be fed consecutive chunks of data.
+# Output sample k is at input time k * down / up, delayed by the filter.
+class Resampler:
+    def __init__(self, up, down, taps_per_phase=16):
+        self.up = up
+        self.down = down
+        self.h = ResamplingFir(up, down, taps_per_phase)
+        self.buffer = np.zeros(0)
+        self.start = 0          # input index of buffer[0], a multiple of down
+        self.next = 0           # index of the next output sample
+
+    def __call__(self, x):
+        from scipy.signal import upfirdn
+        self.buffer = np.concatenate([self.buffer, x])
+        end = self.start + len(self.buffer)
+        # Outputs that only need the inputs we have.
+        last = (end * self.up - 1) // self.down
+        if last < self.next:
+            return np.zeros(0)
+        y = upfirdn(self.h, self.buffer, self.up, self.down)
+        first = self.next - self.start * self.up // self.down
+        y = y[first:first + last - self.next + 1]
+        self.next = last + 1
+        # Keep the inputs the next output still needs, from a multiple of down
+        # so that the output samples stay on the same grid.
+        need = max((self.next * self.down - len(self.h) + 1) // self.up, 0)
+        keep = need - need % self.down
+        if keep > self.start:
+            self.buffer = self.buffer[keep - self.start:]
+            self.start = keep
+        return y
+
+# High-pass filter that can be fed consecutive chunks of data. The state
+# starts as if the first sample had always been there.
+class Highpass:
+    def __init__(self, freq, df, corners=4):
+        self.sos = ButterworthSos('highpass', df, corners, freq=freq)[0]
+        self.zi = None
+
+    def __call__(self, x):
+        from scipy.signal import sosfilt, sosfilt_zi
+        if not len(x):
+            return x
+        if self.zi is None:
+            self.zi = sosfilt_zi(self.sos) * x[0]
+        y, self.zi = sosfilt(self.sos, x, zi=self.zi)
+        return y
+
+# Audio file written one chunk at a time, as 16 bit PCM.
+class AudioWriter:
+    def __init__(self, filename, rate):
+        self.flac = filename.lower().endswith('.flac')
+        if self.flac:
+            import soundfile
+            self.f = soundfile.SoundFile(filename, 'w', samplerate=rate,
+                channels=1, subtype='PCM_16')
+        else:
+            self.f = wave.open(filename, 'wb')
+            self.f.setnchannels(1)
+            self.f.setsampwidth(2)
+            self.f.setframerate(rate)
+
+    def write(self, samples):
+        samples = np.clip(np.round(samples * 32767), -32768, 32767)
+        samples = samples.astype('<i2')
+        if self.flac:
+            self.f.write(samples)
+        else:
+            self.f.writeframes(samples.tobytes())
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+################################################################################
+
+# Processing chain for the data: the optional high-pass, then the resampler.
+def _Chain(df, speedup, rate, highpass):
+    steps = []
+    if highpass:
+        steps.append(Highpass(highpass, df))
+    ratio = Fraction(rate / (df * speedup)).limit_denominator(max_denominator)
+    if ratio != 1:
+        steps.append(Resampler(ratio.numerator, ratio.denominator))
+    def process(x):
+        x = np.asarray(x, dtype=np.float64)
+        for step in steps:
+            x = step(x)
+        return x
+    return process
+
+# Write the chunks of data from source() to an audio file. source is a
+# function that returns an iterable of numpy arrays, which are consecutive
+# samples at df. speedup is the time compression; by default the samples are
+# played at the audio rate, without resampling. The data are scaled so that
+# peak is at 'amplitude' of full scale; if peak is None, it is found with a
+# first pass over source(). Returns the number of audio samples.
+def Sonify(source, filename, df, rate=rate, speedup=None, highpass=highpass,
+        peak=None, amplitude=amplitude):
+    if speedup is None:
+        speedup = rate / df
+    if peak is None:
+        # First pass for the peak of the filtered data. The resampler can
+        # overshoot a little, which is clipped.
+        process = _Chain(df, speedup, df * speedup, highpass)
+        peak = 0.0
+        for x in source():
+            x = process(x)
+            if len(x):
+                peak = max(peak, float(np.max(np.abs(x))))
+    gain = amplitude / peak if peak > 0 else 1.0
+
+    process = _Chain(df, speedup, rate, highpass)
+    n = 0
+    with AudioWriter(filename, rate) as f:
+        for x in source():
+            y = process(x) * gain
+            f.write(y)
+            n += len(y)
+    print('Wrote %s: %.1f s of audio at %d Hz, %gx speedup' %
+        (filename, n / rate, rate, speedup))
+    return n
+
+# Source of fixed size chunks of an array in memory.
+def ArrayChunks(data, chunk=1 << 20):
+    return lambda: (data[i:i+chunk] for i in range(0, len(data), chunk))
+
+# Fill the gaps (masked samples) of data with the mean of the window samples
+# before each gap, or after it if there are none before, or level if the data
+# is all gaps. Returns (filled data, mean of the last window valid samples, or
+# level).
+def FillGaps(data, level, window):
+    mask = np.ma.getmaskarray(data)
+    values = np.ma.getdata(data).astype(np.float64)
+    if not mask.any():
+        return values, float(values[-window:].mean()) if len(values) else level
+    valid = np.flatnonzero(~mask)
+    if not len(valid):
+        return np.full(len(values), level), level
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.view(np.int8),
+        [0]])))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if start > 0:
+            before = valid[valid < start][-window:]
+            level = values[before].mean()
+        else:
+            level = values[valid[:window]].mean()
+        values[start:end] = level
+    return values, float(values[valid[-window:]].mean())
+
+# Source of the data of a channel from starttime to endtime in the day files,
+# one day at a time. Gaps are filled with the mean of the data before them, so
+# they are silent. Returns (source, sampling rate), or (None, None) if there
+# is no data.
+def ArchiveChunks(net, station, loc, chan, starttime, endtime, path=path):
+    from obspy import UTCDateTime, read
+    from archive import DayFilename
+    from obspy_helpers import GetLocalData
+
+    def days():
+        day = UTCDateTime(starttime.date)
+        while day < endtime:
+            yield day
+            day += 86400
+
+    df = None
+    for day in days():
+        try:
+            st = read(DayFilename(path, net, station, loc, chan, day.year,
+                day.julday), headonly=True)
+        except Exception:
+            continue
+        if len(st):
+            df = st[0].stats.sampling_rate
+            break
+    if df is None:
+        return None, None
+
+    def source():
+        t = starttime
+        level = None
+        window = max(int(gap_window * df), 1)
+        for day in days():
+            t1 = min(day + 86400, endtime)
+            npts = int(round((t1 - t) * df))
+            st = GetLocalData(net, station, loc, chan, day.year, day.julday,
+                path)
+            data = np.ma.masked_all(npts)
+            if st:
+                st.merge(method=0)
+                st.trim(t, t + (npts - 1) / df, pad=True, nearest_sample=False)
+            if st and len(st[0].data):
+                n = min(len(st[0].data), npts)
+                data[:n] = st[0].data[:n]
+            if level is None:
+                level = float(data.mean()) if data.count() else 0.0
+            data, level = FillGaps(data, level, window)
+            yield data
+            t = t + npts / df
+    return source, df
+
+# Sonify a Stream in memory, e.g. from plot_event. Each trace is written to
+# its own file when there is more than one.
+def SonifyStream(st, filename, rate=rate, speedup=None, highpass=highpass):
+    for i, tr in enumerate(st):
+        name = filename
+        if len(st) > 1:
+            base, _, ext = filename.rpartition('.')
+            name = '%s.%s.%s' % (base, tr.id, ext)
+        Sonify(ArrayChunks(tr.data), name, tr.stats.sampling_rate, rate=rate,
+            speedup=speedup, highpass=highpass)
+
+################################################################################
+
+if __name__ == '__main__':
+    import dateutil.parser
+    from obspy import UTCDateTime
+    desc = 'Write a span of a channel from the day files as audio.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--channel', required=True,
+        help='NETWORK.STATION.LOCATION.CHANNEL format.')
+    parser.add_argument('--starttime', required=True,
+        help='Start time. Ex: 2025-06-01')
+    parser.add_argument('--endtime', required=True,
+        help='End time. Ex: 2025-06-08')
+    parser.add_argument('--path', default=path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--outfile', default='output.wav',
+        help='Output file, .wav or .flac (default %(default)s).')
+    parser.add_argument('--rate', type=int, default=rate,
+        help='Audio sample rate (default %(default)s).')
+    parser.add_argument('--speedup', type=float, default=None,
+        help='Time compression (default: play the samples at the audio rate).')
+    parser.add_argument('--highpass', type=float, default=highpass,
+        help='High-pass corner in Hz, before the speedup, or 0 for none '
+        '(default %(default)s).')
+    parser.add_argument('--peak', type=float, default=None,
+        help='Peak in counts for full scale (default: find it with a first '
+        'pass over the data).')
+    args = parser.parse_args()
+
+    net, station, loc, chan = args.channel.split('.')
+    starttime = UTCDateTime(dateutil.parser.parse(args.starttime))
+    endtime = UTCDateTime(dateutil.parser.parse(args.endtime))
+    source, df = ArchiveChunks(net, station, loc, chan, starttime, endtime,
+        args.path)
+    if source is None:
+        print('No data for', args.channel)
+        exit(1)
+    Sonify(source, args.outfile, df, rate=args.rate, speedup=args.speedup,
+        highpass=args.highpass, peak=args.peak)
@@ -0,0 +1,142 @@
+# Generate synthetic MiniSEED day files for benchmarking and testing.
+#
+# Each day has background noise, microseism, a few local events and
+# teleseismic surface wave trains, plus gaps and overlapping records like a
+# real archive. The files use the archive layout
+# NET.STA.LOC.CHAN.YEAR.DOY.mseed. The data are int32 counts, roughly the
+# levels seen from a Yuma-2 at 2 nm/s per count.
+#
+# Example: python synthetic_data.py --path /tmp/mseed --days 2 --rate 200
+
+import argparse
+import os
+import sys
+
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+
+sys.path.append('.')
+from obspy_helpers import FilterData
+
+# Defaults
+net, station, loc, chan = 'AM', 'BCCWA', '01', 'BHZ'
+sampling_rate = 100.0
+
+# Band limited gaussian noise with the given rms amplitude.
+def _BandNoise(rng, n, df, freqmin, freqmax, rms):
+    x = rng.standard_normal(n)
+    x = FilterData(x, 'bandpass', df, freqmin=freqmin, freqmax=freqmax)
+    return x * (rms / max(np.std(x), 1e-12))
+
+# Add a dispersed surface wave train starting at sample i0: the period sweeps
+# from 25 s down to 12 s over its duration, under a smooth envelope.
+def _AddTeleseism(rng, x, i0, df, amplitude, duration=2400.0):
+    n = min(int(duration * df), len(x) - i0)
+    if n <= 0:
+        return
+    t = np.arange(n) / df
+    f = 0.04 + (1/12.0 - 0.04) * t / duration
+    phase = 2 * np.pi * np.cumsum(f) / df
+    envelope = np.sin(np.pi * t / duration) ** 2
+    x[i0:i0+n] += amplitude * envelope * np.sin(phase + rng.uniform(0, 2*np.pi))
+
+# Add a local event at sample i0: a short burst of 2-10 Hz energy with an
+# exponential decay.
+def _AddLocalEvent(rng, x, i0, df, amplitude, duration=60.0):
+    n = min(int(duration * df), len(x) - i0)
+    if n <= 0:
+        return
+    t = np.arange(n) / df
+    burst = _BandNoise(rng, n, df, 2.0, min(10.0, 0.4*df), 1.0)
+    x[i0:i0+n] += amplitude * burst * np.exp(-t / (duration / 6))
+
+# One day of synthetic data starting at midnight of (year, doy). Returns a
+# Stream, with a trace for each segment between gaps and extra traces for the
+# overlaps.
+def SyntheticDay(net, station, loc, chan, year, doy, sampling_rate=100.0,
+        seed=0, gaps=2, overlaps=1, local_events=3, teleseisms=2):
+    rng = np.random.default_rng([seed, year, doy])
+    df = sampling_rate
+    n = int(86400 * df)
+    starttime = UTCDateTime(year=year, julday=doy)
+
+    x = rng.standard_normal(n) * 20                     # instrument noise
+    x += _BandNoise(rng, n, df, 0.1, 0.3, 400)          # microseism
+    x += _BandNoise(rng, n, df, 0.005, 0.02, 100)       # long period drift
+    for i in range(teleseisms):
+        _AddTeleseism(rng, x, rng.integers(0, n), df, rng.uniform(100, 2000))
+    for i in range(local_events):
+        _AddLocalEvent(rng, x, rng.integers(0, n), df, rng.uniform(500, 50000))
+    data = np.round(x).astype(np.int32)
+
+    # Split into segments at the gaps, each gap 1 to 10 minutes long.
+    edges = [0]
+    for i in sorted(rng.integers(n // 10, n - n // 10, gaps)):
+        if i > edges[-1]:
+            edges += [i, min(n, i + int(rng.uniform(60, 600) * df))]
+    edges.append(n)
+
+    st = Stream()
+    for i0, i1 in zip(edges[0::2], edges[1::2]):
+        if i1 > i0:
+            st.append(Trace(data=data[i0:i1].copy(), header={
+                'network': net, 'station': station, 'location': loc,
+                'channel': chan, 'sampling_rate': df,
+                'starttime': starttime + i0 / df}))
+
+    # Overlaps are records sent twice: 1 to 5 minutes of data repeated.
+    for i in range(overlaps):
+        tr = st[int(rng.integers(0, len(st)))]
+        length = int(rng.uniform(60, 300) * df)
+        if tr.stats.npts > length:
+            i0 = int(rng.integers(0, tr.stats.npts - length))
+            tr2 = tr.copy()
+            tr2.data = tr.data[i0:i0+length].copy()
+            tr2.stats.starttime = tr.stats.starttime + i0 / df
+            st.append(tr2)
+    return st
+
+# Filename of a day file in the archive layout.
+def DayFilename(path, net, station, loc, chan, year, doy):
+    return os.path.join(path, '%s.%s.%s.%s.%d.%03d.mseed' %
+        (net, station, loc, chan, year, doy))
+
+# Write synthetic day files for the days starting at starttime. Returns the
+# list of filenames.
+def WriteSyntheticDays(path, net, station, loc, chan, starttime, days=1,
+        **options):
+    os.makedirs(path, exist_ok=True)
+    filenames = []
+    for i in range(days):
+        t = starttime + i * 86400
+        year, doy = t.year, t.julday
+        filename = DayFilename(path, net, station, loc, chan, year, doy)
+        st = SyntheticDay(net, station, loc, chan, year, doy, **options)
+        st.write(filename, format='MSEED', encoding='STEIM2', reclen=512)
+        filenames.append(filename)
+    return filenames
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Write synthetic MiniSEED day files.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--path', required=True,
+        help='Directory to write the day files to.')
+    parser.add_argument('--channel', default='%s.%s.%s.%s' %
+        (net, station, loc, chan), help='SEED id (default %(default)s).')
+    parser.add_argument('--start', default=None,
+        help='First day (default yesterday).')
+    parser.add_argument('--days', type=int, default=1,
+        help='Number of days (default %(default)s).')
+    parser.add_argument('--rate', type=float, default=sampling_rate,
+        help='Sampling rate (default %(default)s).')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Random seed (default %(default)s).')
+    args = parser.parse_args()
+
+    start = UTCDateTime(args.start) if args.start else UTCDateTime() - 86400
+    start = UTCDateTime(year=start.year, julday=start.julday)
+    for f in WriteSyntheticDays(args.path, *args.channel.split('.'), start,
+            days=args.days, sampling_rate=args.rate, seed=args.seed):
+        print(f)
@@ -0,0 +1,375 @@
+# Matched-filter detection of events similar to known ones in the archive.
+#
+# Templates are short windows of one channel cut from the day files at the
+# arrivals of well-recorded events: times given directly, from a CSV file
+# (name,arrival), or the first arrivals of catalog events at a site. The
+# templates and the continuous data are filtered to the same band, and the
+# normalised cross-correlation of each template with each day is computed by
+# overlap-save FFTs:
+#   - the spectra of the templates are computed once per worker,
+#   - each block of data is transformed once and multiplied by the spectra of
+#     all templates in the job,
+#   - the norm of the data under the sliding window comes from cumulative sums
+#     within the block, so the normalisation costs O(n) instead of O(n m).
+# A detection is a peak of the correlation above threshold times the median
+# absolute deviation (MAD) of the day's correlation, and above min_cc. The
+# detections are written with the columns template, channel, time (of the
+# arrival), cc (the peak correlation) and cc_over_mad: the peak in MADs, the
+# significance of the detection, not the MAD itself.
+#
+# Jobs are (day, group of templates), run in parallel. A year of 50 sps data
+# against 50 templates of 10 s is roughly an hour of CPU.
+#
+# Example: python template_matching.py --channel AM.BCCWA.01.BHZ
+#              --template 2025-03-14T08:12:31 --template 2025-04-02T19:44:05
+#              --starttime 2024-06-01 --endtime 2025-06-01
+#              --outfile detections.csv
+
+import argparse
+import csv
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from obspy import UTCDateTime
+
+sys.path.append('.')
+import archive
+from obspy_helpers import GetLocalDataRange, FilterData, FilterPadding
+
+# Defaults
+outfile = 'detections.csv'
+before = 1.0            # seconds of the template before the arrival
+length = 10.0           # seconds
+freqmin = 2.0           # Hz
+freqmax = 8.0
+threshold = 9.0         # detection level, times the MAD of the correlation
+min_cc = 0.3            # and at least this correlation
+block_size = 1 << 15    # minimum FFT length of the overlap-save blocks
+templates_per_job = 4
+max_distance = 300.0    # km, for templates from the catalog
+
+columns = ['template', 'channel', 'time', 'cc', 'cc_over_mad']
+
+################################################################################
+# Correlation.
+
+# FFT length for templates of m samples: long enough that most of each block
+# is output, and fast for scipy's FFT.
+def FftLength(m, minimum=block_size):
+    from scipy.fft import next_fast_len
+    return next_fast_len(max(minimum, 4 * m), real=True)
+
+# Demean templates (k, m) and scale them to unit norm, so that the
+# correlation with data of the same shape is 1.
+def NormaliseTemplates(templates):
+    t = np.atleast_2d(np.asarray(templates, dtype=np.float64))
+    t = t - t.mean(axis=1, keepdims=True)
+    norm = np.sqrt(np.sum(t * t, axis=1, keepdims=True))
+    norm[norm == 0] = 1.0
+    return t / norm
+
+# Conjugate spectra of normalised templates for Correlate().
+def TemplateSpectra(templates, nfft):
+    from scipy.fft import rfft
+    return np.conj(rfft(templates, nfft, axis=1))
+
+# Normalised cross-correlation of normalised templates (k, m) with data (n),
+# for each lag 0 <= i <= n - m of the window data[i:i+m]. Returns an array
+# (k, n - m + 1) of float32. spectra and nfft are from TemplateSpectra() and
+# FftLength(), and are computed if not given.
+def Correlate(data, templates, spectra=None, nfft=None):
+    from scipy.fft import rfft, irfft
+    k, m = templates.shape
+    n = len(data) - m + 1
+    if n <= 0:
+        return np.zeros((k, 0), np.float32)
+    if nfft is None:
+        nfft = FftLength(m)
+    if spectra is None:
+        spectra = TemplateSpectra(templates, nfft)
+    data = np.asarray(data, dtype=np.float64)
+    cc = np.empty((k, n), np.float32)
+    step = nfft - m + 1
+    for start in range(0, n, step):
+        count = min(step, n - start)
+        # Removing the block mean doesn't change the correlation with a zero
+        # mean template, and keeps the sums of squares accurate.
+        seg = data[start:start + count + m - 1]
+        seg = seg - seg.mean()
+        products = irfft(rfft(seg, nfft) * spectra, nfft, axis=1)[:, :count]
+
+        # Sum of squares about the mean of each window, from cumulative sums.
+        c1 = np.concatenate([[0.0], np.cumsum(seg)])
+        c2 = np.concatenate([[0.0], np.cumsum(seg * seg)])
+        s1 = c1[m:m + count] - c1[:count]
+        s2 = c2[m:m + count] - c2[:count]
+        squares = s2 - s1 * s1 / m
+        # Flat data (e.g. a dead channel) has no correlation.
+        norm = np.sqrt(np.maximum(squares, 0.0))
+        norm[squares <= 1e-12 * max(s2.max(), 1e-300)] = np.inf
+        cc[:, start:start + count] = np.clip(products / norm, -1.0, 1.0)
+    return cc
+
+# Detections in the correlation of one template: the highest sample of each
+# run of samples above threshold times the MAD and above min_cc, where runs
+# closer than distance samples are joined. Returns (indices, cc, MAD).
+def Detect(cc, threshold=threshold, min_cc=min_cc, distance=1):
+    if len(cc) == 0:
+        return np.zeros(0, int), np.zeros(0, np.float32), 0.0
+    mad = float(np.median(np.abs(cc - np.median(cc))))
+    above = np.flatnonzero(cc >= max(threshold * mad, min_cc))
+    if len(above) == 0:
+        return above, cc[above], mad
+    runs = np.split(above, np.flatnonzero(np.diff(above) > distance) + 1)
+    peaks = np.array([r[np.argmax(cc[r])] for r in runs])
+    return peaks, cc[peaks], mad
+
+################################################################################
+# Templates.
+
+# Read and filter the data of a channel from starttime to endtime, with
+# padding for the filter transients. Returns a list of contiguous traces.
+def _ReadFiltered(net, station, loc, chan, starttime, endtime, freqmin,
+        freqmax, path):
+    padding = FilterPadding(freqmin, freqmax)
+    st = GetLocalDataRange(net, station, loc, chan, starttime - padding,
+        endtime + padding, path)
+    st = st.merge().split()
+    traces = []
+    for tr in st.trim(starttime - padding, endtime + padding):
+        if tr.stats.npts <= 2 * padding * tr.stats.sampling_rate:
+            continue
+        tr.data = FilterData(tr.data, 'bandpass', tr.stats.sampling_rate,
+            freqmin=freqmin, freqmax=freqmax, zerophase=True,
+            dtype=np.float64)
+        traces.append(tr)
+    return traces
+
+# Cut a template of a channel ('NET.STA.LOC.CHAN') starting 'before' seconds
+# before an arrival. Returns (data, sampling rate), or None if the archive
+# doesn't cover the window.
+def CutTemplate(seed_id, arrival, before=before, length=length,
+        freqmin=freqmin, freqmax=freqmax, path=None):
+    net, station, loc, chan = seed_id.split('.')
+    start = UTCDateTime(arrival) - before
+    for tr in _ReadFiltered(net, station, loc, chan, start, start + length,
+            freqmin, freqmax, path):
+        df = tr.stats.sampling_rate
+        m = int(round(length * df))
+        i = int(round((start - tr.stats.starttime) * df))
+        if i >= 0 and i + m <= tr.stats.npts:
+            return tr.data[i:i + m].copy(), df
+    return None
+
+# Templates from a CSV file with the columns name and arrival.
+def ReadTemplateTimes(filename):
+    with open(filename, newline='') as f:
+        return [(row['name'], UTCDateTime(row['arrival']))
+            for row in csv.DictReader(f)]
+
+# Templates at the first arrivals at site (lat, lon) of the catalog events
+# from starttime to endtime within max_distance km. Returns [(name, arrival)].
+def CatalogTemplateTimes(starttime, endtime, site, min_magnitude=2.0,
+        max_distance=max_distance):
+    from obspy_helpers import GetEvents, FilterEvents, GetArrivalTimes
+    events = GetEvents(starttime, endtime, min_magnitude)
+    events = FilterEvents(events, [(min_magnitude, max_distance * 1000)],
+        site[0], site[1])
+    return [(str(event_time)[:19], arrival) for event_time, desc, arrival, _
+        in GetArrivalTimes(events, site)]
+
+################################################################################
+# Scanning the archive.
+
+_job = {}               # set in each worker by _InitWorker()
+_spectra = {}           # group -> (nfft, spectra)
+
+def _InitWorker(job):
+    _job.clear()
+    _job.update(job)
+    _spectra.clear()
+
+# Correlate one day with one group of templates. Returns a list of detection
+# rows.
+def ScanDay(day, group):
+    j = _job
+    names = j['names'][group]
+    templates = j['templates'][group]
+    m = templates.shape[1]
+    if group not in _spectra:
+        nfft = FftLength(m)
+        _spectra[group] = (nfft, TemplateSpectra(templates, nfft))
+    nfft, spectra = _spectra[group]
+
+    day = UTCDateTime(day)
+    net, station, loc, chan = j['seed_id'].split('.')
+    # Windows starting in the day, which may run into the next one.
+    traces = _ReadFiltered(net, station, loc, chan, day,
+        day + 86400 + j['length'], j['freqmin'], j['freqmax'], j['path'])
+    rows = []
+    for tr in traces:
+        if tr.stats.sampling_rate != j['df']:
+            print('%s: %s is %g sps, the templates are %g sps' % (
+                day.date, tr.id, tr.stats.sampling_rate, j['df']))
+            continue
+        cc = Correlate(tr.data, templates, spectra, nfft)
+        t0 = tr.stats.starttime
+        for name, c in zip(names, cc):
+            peaks, values, mad = Detect(c, j['threshold'], j['min_cc'], m)
+            for i, value in zip(peaks, values):
+                t = t0 + i / j['df']
+                if day <= t < day + 86400:
+                    rows.append({'template': name, 'channel': tr.id,
+                        'time': str(t + j['before']), 'cc': float(value),
+                        'cc_over_mad': float(value) / mad if mad else
+                            np.inf})
+    return rows
+
+def _ScanDay(args):
+    try:
+        return args, ScanDay(*args)
+    except Exception as e:
+        print('Failed scanning %s: %r' % (UTCDateTime(args[0]).date, e))
+        return args, []
+
+# Gather the detections of the jobs as they finish, with progress.
+def _Collect(results, count):
+    rows = []
+    t = time.time()
+    for i, (_, result) in enumerate(results):
+        rows += result
+        if (i + 1) % 50 == 0 or i + 1 == count:
+            print('%d of %d jobs, %d detections, %.0f s' % (i + 1, count,
+                len(rows), time.time() - t))
+    return rows
+
+# Scan a channel from starttime to endtime for events similar to the
+# templates, a dict {name: data} at sampling rate df. Returns the detection
+# rows sorted by time.
+def Scan(seed_id, templates, df, starttime, endtime, path=None,
+        before=before, freqmin=freqmin, freqmax=freqmax, threshold=threshold,
+        min_cc=min_cc, processes=None, group_size=templates_per_job):
+    names = list(templates)
+    data = NormaliseTemplates([templates[name] for name in names])
+    groups = [slice(i, i + group_size) for i in range(0, len(names),
+        group_size)]
+    job = {'seed_id': seed_id, 'path': path or archive.path, 'df': df,
+        'before': before, 'length': data.shape[1] / df, 'freqmin': freqmin,
+        'freqmax': freqmax, 'threshold': threshold, 'min_cc': min_cc,
+        'names': [names[g] for g in groups],
+        'templates': [data[g] for g in groups]}
+
+    net, station, loc, chan = seed_id.split('.')
+    days = []
+    for f in archive.DayFiles(net, station, loc, chan, starttime, endtime,
+            job['path']):
+        year, doy = archive.ParseDayFilename(f)[4:]
+        days.append(UTCDateTime(year=year, julday=doy).timestamp)
+    jobs = [(day, g) for day in days for g in range(len(groups))]
+    print('Scanning %d days with %d templates in %d jobs' % (len(days),
+        len(names), len(jobs)))
+
+    if processes == 1 or len(jobs) <= 1:
+        _InitWorker(job)
+        rows = _Collect(map(_ScanDay, jobs), len(jobs))
+    else:
+        with Pool(processes, _InitWorker, (job,)) as pool:
+            rows = _Collect(pool.imap_unordered(_ScanDay, jobs), len(jobs))
+    return sorted(rows, key=lambda r: (r['time'], r['template']))
+
+def WriteDetections(filename, rows):
+    with open(filename, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=columns)
+        w.writeheader()
+        for row in rows:
+            w.writerow({k: ('%.4f' % v if isinstance(v, float) else v)
+                for k, v in row.items()})
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Find events similar to template events in the MiniSEED archive ' \
+        'by normalised cross-correlation.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--channel', required=True,
+        help='Channel to scan and cut the templates from, e.g. '
+        'AM.BCCWA.01.BHZ.')
+    parser.add_argument('--path', default=archive.path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--starttime', required=True,
+        help='Start of the scan.')
+    parser.add_argument('--endtime', default=None,
+        help='End of the scan (default now).')
+    parser.add_argument('--template', action='append', default=[],
+        help='Arrival time of a template event. May be repeated.')
+    parser.add_argument('--templates', default=None,
+        help='CSV file of template events, with columns name and arrival.')
+    parser.add_argument('--catalog', nargs=2, default=None,
+        metavar=('STARTTIME', 'ENDTIME'),
+        help='Use the catalog events of this time span as templates.')
+    parser.add_argument('--site', type=float, nargs=2, default=None,
+        metavar=('LAT', 'LON'),
+        help='Station location, for the arrivals of catalog events.')
+    parser.add_argument('--min_magnitude', type=float, default=2.0,
+        help='Minimum magnitude of catalog events (default %(default)s).')
+    parser.add_argument('--max_distance', type=float, default=max_distance,
+        help='Maximum distance of catalog events in km (default '
+        '%(default)s).')
+    parser.add_argument('--before', type=float, default=before,
+        help='Seconds of the template before the arrival (default '
+        '%(default)s).')
+    parser.add_argument('--length', type=float, default=length,
+        help='Template length in seconds (default %(default)s).')
+    parser.add_argument('--freqmin', type=float, default=freqmin,
+        help='Low corner of the band-pass in Hz (default %(default)s).')
+    parser.add_argument('--freqmax', type=float, default=freqmax,
+        help='High corner of the band-pass in Hz (default %(default)s).')
+    parser.add_argument('--threshold', type=float, default=threshold,
+        help='Detection threshold in MADs of the correlation (default '
+        '%(default)s).')
+    parser.add_argument('--min_cc', type=float, default=min_cc,
+        help='Minimum correlation of a detection (default %(default)s).')
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of jobs to run in parallel (default number of CPUs).')
+    parser.add_argument('--group', type=int, default=templates_per_job,
+        help='Templates per job (default %(default)s). Larger groups share '
+        'more FFTs but use more memory.')
+    parser.add_argument('--outfile', default=outfile,
+        help='CSV file of the detections (default %(default)s).')
+    args = parser.parse_args()
+
+    times = [(t, UTCDateTime(t)) for t in args.template]
+    if args.templates:
+        times += ReadTemplateTimes(args.templates)
+    if args.catalog:
+        if not args.site:
+            parser.error('--catalog needs --site')
+        times += CatalogTemplateTimes(UTCDateTime(args.catalog[0]),
+            UTCDateTime(args.catalog[1]), args.site, args.min_magnitude,
+            args.max_distance)
+    if not times:
+        parser.error('No templates: use --template, --templates or --catalog')
+
+    templates = {}
+    df = None
+    for name, arrival in times:
+        t = CutTemplate(args.channel, arrival, args.before, args.length,
+            args.freqmin, args.freqmax, args.path)
+        if t is None:
+            print('No data for template', name)
+            continue
+        if df is not None and t[1] != df:
+            print('Skipping template %s at %g sps' % (name, t[1]))
+            continue
+        templates[name], df = t
+    if not templates:
+        sys.exit('No templates could be cut from the archive')
+
+    endtime = UTCDateTime(args.endtime) if args.endtime else UTCDateTime()
+    rows = Scan(args.channel, templates, df, UTCDateTime(args.starttime),
+        endtime, args.path, args.before, args.freqmin, args.freqmax,
+        args.threshold, args.min_cc, args.processes, args.group)
+    WriteDetections(args.outfile, rows)
+    print('%d detections written to %s' % (len(rows), args.outfile))
@@ -0,0 +1,273 @@
+# Streaming regression of the centering force (mass position) against the
+# instrument temperature, over any number of days.
+#
+# Both channels are reduced to block means on a common time grid (one point
+# per 'interval' seconds), which works for any sample rates, gaps and masked
+# data. For each day and each thermal lag, the sufficient statistics of the
+# linear fit cf(t) = slope * temperature(t - lag) + intercept are accumulated:
+#   n, sum(x), sum(y), sum(x*x), sum(x*y), sum(y*y)
+# and stored in a small CSV table, one row per day and lag. Days that are
+# already in the table are not read again unless their files changed (with
+# lags, including the temperature file of the day before), so a year of
+# thermal response can be fitted in seconds. The per-day statistics
+# add up, so fits over any run of days (rolling windows) come from the table.
+#
+# Example: python thermal_regression.py --channel AM.BCCWA.01 --temp LKS
+#              --cf LEC --days 365 --lag 0 --lag 1800 --lag 3600 --window 7
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+from obspy import UTCDateTime, read
+
+sys.path.append('.')
+import archive
+from obspy_helpers import GetStationResponse, ConvertStream
+from inventory_store import LoadInventory
+
+# Defaults
+path = '/data/seismometer_data/mseed'
+interval = 60.0         # seconds per point of the decimated grid
+window = 7              # days in a rolling fit
+
+# Spring temperature coefficient, from the slope in volts / deg C.
+Ri = 15e3   # appx
+Gn = 10.6   # appx
+M0 = 0.0875 # appx
+
+columns = ['n', 'sx', 'sy', 'sxx', 'sxy', 'syy']
+
+################################################################################
+
+def TempcoPpm(slope):
+    return slope / Ri * Gn / (M0 * 9.81) * 1e6
+
+################################################################################
+
+# Mean of the samples of a stream in each block of 'interval' seconds, for
+# nblocks blocks from starttime. Blocks without data are NaN. The traces don't
+# need to be merged, and masked samples are ignored.
+def BlockMeans(st, starttime, interval, nblocks):
+    sums = np.zeros(nblocks)
+    counts = np.zeros(nblocks)
+    for tr in st:
+        data = tr.data
+        valid = ~np.ma.getmaskarray(data)
+        t = (tr.stats.starttime - starttime) + \
+            np.arange(tr.stats.npts) * tr.stats.delta
+        index = np.floor(t / interval).astype(np.int64)
+        valid &= (index >= 0) & (index < nblocks)
+        sums += np.bincount(index[valid],
+            weights=np.ma.getdata(data)[valid].astype(np.float64),
+            minlength=nblocks)
+        counts += np.bincount(index[valid], minlength=nblocks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+# Sufficient statistics of y[i] against x[i - lag], for each lag in samples.
+# x has max(lags) extra points at the start, before y[0]. Points where either
+# is NaN are skipped. Returns an array of [n, sx, sy, sxx, sxy, syy] per lag.
+def LagStats(x, y, lags):
+    pad = max(lags)
+    stats = np.zeros((len(lags), len(columns)))
+    for i, lag in enumerate(lags):
+        xl = x[pad-lag:pad-lag+len(y)]
+        ok = ~(np.isnan(xl) | np.isnan(y))
+        xl = xl[ok]
+        yl = y[ok]
+        stats[i] = [len(xl), xl.sum(), yl.sum(), np.dot(xl, xl),
+            np.dot(xl, yl), np.dot(yl, yl)]
+    return stats
+
+# Least squares line from sufficient statistics (one row of columns, or the
+# sum of several). Returns (slope, intercept, r, n); NaN if under-determined.
+def Fit(stats):
+    n, sx, sy, sxx, sxy, syy = stats
+    vx = n * sxx - sx * sx
+    vy = n * syy - sy * sy
+    if n < 3 or vx <= 0:
+        return (np.nan, np.nan, np.nan, n)
+    slope = (n * sxy - sx * sy) / vx
+    intercept = (sy - slope * sx) / n
+    r = (n * sxy - sx * sy) / np.sqrt(vx * vy) if vy > 0 else np.nan
+    return (slope, intercept, r, n)
+
+# Statistics for the window starttime to endtime from streams that are already
+# loaded, converted and on the same time base (e.g. for a plot). lags are in
+# seconds. Returns an array of statistics per lag.
+def WindowStats(st_temp, st_cf, starttime, endtime, interval=interval,
+        lags=[0]):
+    steps = [int(round(lag / interval)) for lag in lags]
+    pad = max(steps)
+    nblocks = int((endtime - starttime) // interval)
+    x = BlockMeans(st_temp, starttime - pad * interval, interval,
+        nblocks + pad)
+    y = BlockMeans(st_cf, starttime, interval, nblocks)
+    return LagStats(x, y, steps)
+
+################################################################################
+# Per-day statistics table.
+
+def DayFilename(path, net, station, loc, chan, day):
+    return archive.DayFilename(path, net, station, loc, chan, day.year,
+        day.julday)
+
+# Identify the input files of a day, so that changed days are recomputed.
+def _Signature(filenames):
+    sig = []
+    for f in filenames:
+        try:
+            s = os.stat(f)
+            sig.append('%d:%d' % (s.st_size, int(s.st_mtime)))
+        except OSError:
+            sig.append('-')
+    return ';'.join(sig)
+
+# Read the table: {(day string, lag seconds): (signature, stats array)}
+def ReadTable(filename):
+    table = {}
+    if not os.path.exists(filename):
+        return table
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            table[(row['day'], int(row['lag']))] = (row['files'],
+                np.array([float(row[c]) for c in columns]))
+    return table
+
+def WriteTable(filename, table):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['day', 'lag'] + columns + ['files'])
+        for (day, lag), (sig, stats) in sorted(table.items()):
+            w.writerow([day, lag] + ['%.17g' % v for v in stats] + [sig])
+    os.replace(tmp, filename)
+
+# Block means of one day of a channel, converted to physical units with the
+# response in inv. Returns NaNs if the day file is missing.
+def _DayMeans(path, net, station, loc, chan, day, interval, inv):
+    nblocks = int(86400 // interval)
+    try:
+        st = read(DayFilename(path, net, station, loc, chan, day))
+    except Exception:
+        return np.full(nblocks, np.nan)
+    ConvertStream(st, inv)
+    return BlockMeans(st, day, interval, nblocks)
+
+# Add the statistics for the days from starttime to endtime to the table file,
+# skipping days that are already there with the same input files, which with
+# lags include the temperature file of the day before. lags are in
+# seconds, and must be a multiple of interval. inv has the responses of the
+# channels, and defaults to the station's StationXML file. Returns the table.
+def UpdateTable(filename, net, station, loc, chan_temp, chan_cf, starttime,
+        endtime, path=path, interval=interval, lags=[0], inv=None):
+    table = ReadTable(filename)
+    if inv is None:
+        inv = GetStationResponse(net, station)
+    steps = [int(round(lag / interval)) for lag in lags]
+    pad = max(steps)
+    day = UTCDateTime(starttime.date)
+    previous = None         # temperature means of the day before
+    changed = False
+    while day <= endtime:
+        key = str(day.date)
+        files = [DayFilename(path, net, station, loc, c, day)
+            for c in (chan_temp, chan_cf)]
+        if pad:
+            # The lagged statistics also depend on the day before.
+            files.append(DayFilename(path, net, station, loc, chan_temp,
+                day - 86400))
+        sig = _Signature(files)
+        if all(table.get((key, lag), ('',))[0] == sig for lag in lags):
+            previous = None
+            day += 86400
+            continue
+
+        x = _DayMeans(path, net, station, loc, chan_temp, day, interval, inv)
+        y = _DayMeans(path, net, station, loc, chan_cf, day, interval, inv)
+        if pad:
+            # The lagged temperature starts in the day before.
+            if previous is None:
+                previous = _DayMeans(path, net, station, loc, chan_temp,
+                    day - 86400, interval, inv)
+            xl = np.concatenate([previous[len(previous)-pad:], x])
+        else:
+            xl = x
+        stats = LagStats(xl, y, steps)
+        for lag, s in zip(lags, stats):
+            table[(key, lag)] = (sig, s)
+        changed = True
+        previous = x
+        day += 86400
+
+    if changed:
+        WriteTable(filename, table)
+    return table
+
+# Fits for each day, and over the 'window' days ending on each day, for one
+# lag. Returns a list of (day, daily fit, rolling fit).
+def RollingFits(table, lag, window=window):
+    days = sorted(day for day, l in table if l == lag)
+    stats = np.array([table[(day, lag)][1] for day in days])
+    cumulative = np.vstack([np.zeros(len(columns)), np.cumsum(stats, axis=0)])
+    fits = []
+    for i, day in enumerate(days):
+        # The window is by calendar days, so missing days shorten it.
+        first = UTCDateTime(day) - (window - 1) * 86400
+        j = i
+        while j > 0 and UTCDateTime(days[j-1]) >= first:
+            j -= 1
+        fits.append((day, Fit(stats[i]), Fit(cumulative[i+1] - cumulative[j])))
+    return fits
+
+################################################################################
+
+if __name__ == '__main__':
+    desc = 'Fit the centering force against temperature, per day and over ' \
+        'rolling windows of days.'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--channel', required=True,
+        help='NET.STA.LOC of the station, e.g. AM.BCCWA.01.')
+    parser.add_argument('--temp', required=True,
+        help='Temperature channel, e.g. LKS.')
+    parser.add_argument('--cf', required=True,
+        help='Centering force channel, e.g. LEC.')
+    parser.add_argument('--path', default=path,
+        help='Directory of the MiniSEED day files (default %(default)s).')
+    parser.add_argument('--days', type=int, default=30,
+        help='Number of days up to today (default %(default)s).')
+    parser.add_argument('--interval', type=float, default=interval,
+        help='Seconds per decimated point (default %(default)s).')
+    parser.add_argument('--lag', type=float, action='append', default=None,
+        help='Thermal lag in seconds. Multiple lags may be given (default 0).')
+    parser.add_argument('--window', type=int, default=window,
+        help='Days in the rolling fit (default %(default)s).')
+    parser.add_argument('--respfile', default=None,
+        help='StationXML file (default NET_STA.xml).')
+    parser.add_argument('--table', default=None,
+        help='Statistics table (default thermal_NET_STA_LOC.csv).')
+    args = parser.parse_args()
+
+    net, station, loc = args.channel.split('.')
+    lags = [int(lag) for lag in args.lag or [0]]
+    table_file = args.table or 'thermal_%s_%s_%s.csv' % (net, station, loc)
+    endtime = UTCDateTime()
+    starttime = endtime - (args.days - 1) * 86400
+    inv = LoadInventory(args.respfile) if args.respfile else None
+    table = UpdateTable(table_file, net, station, loc, args.temp, args.cf,
+        starttime, endtime, path=args.path, interval=args.interval, lags=lags,
+        inv=inv)
+
+    for lag in lags:
+        print('Lag %d s:' % lag)
+        print('%-10s %12s %8s %6s %12s %8s' % ('day', 'ppm/°C', 'r', 'n',
+            '%dd ppm/°C' % args.window, 'r'))
+        for day, daily, rolling in RollingFits(table, lag, args.window):
+            if UTCDateTime(day) < UTCDateTime(starttime.date):
+                continue
+            print('%-10s %12.1f %8.3f %6d %12.1f %8.3f' % (day,
+                TempcoPpm(daily[0]), daily[2], daily[3],
+                TempcoPpm(rolling[0]), rolling[2]))